@@ -1,6 +1,13 @@
-# pip install requests beautifulsoup4 python-slugify
-import sys, re, requests, html
+# pip install requests beautifulsoup4 lxml python-slugify
+import os, sys, re, requests, html
 from bs4 import BeautifulSoup
+try:
+    import lxml.html as lxml_html  # C parser, ~10x faster on barcode-list pages
+except ImportError:
+    lxml_html = None
+import off_index
+import http_cache
+from source_resolver import Resolver
 
 CATEGORIES = [
     "01 BAR_BEVERAGES",
@@ -18,10 +25,16 @@ CATEGORIES = [
 ]
 
 # --- OpenFoodFacts (JSON) ---
+OFF_INDEX_ONLY = os.getenv("OFF_INDEX_ONLY", "0") == "1"  # with OFF_INDEX: never ask the OFF API
+
 def fetch_openfoodfacts(barcode: str) -> dict | None:
+    # local dump index first (OFF_INDEX=off_index.sqlite, see off_index.py)
+    indexed, product = off_index.lookup(barcode)
+    if product or (indexed and OFF_INDEX_ONLY):
+        return product
     url = f"https://world.openfoodfacts.org/api/v0/product/{barcode}.json"
     try:
-        r = requests.get(url, timeout=8)
+        r = http_cache.get("openfoodfacts", url, timeout=8, is_miss=lambda r: r.json().get("status") != 1)
         if r.status_code != 200:
             return None
         data = r.json()
@@ -102,36 +115,154 @@ def _parse_barcode_list_search_page(soup, barcode: str):
 
     return {"name": name or None, "brand": None, "categories": None, "image": None}
 
-def fetch_barcode_list_ru(barcode: str) -> dict | None:
-    headers = {
-        "User-Agent": "Mozilla/5.0",
-        "Accept-Language": "ru,en;q=0.8"
-    }
-    # 1) Direct product page
+# --- barcode-list.ru, lxml backend: same dicts, targeted XPath instead of full-tree scans ---
+# BARCODE_LIST_PARSER=bs4 forces the BeautifulSoup/html.parser versions above
+HTML_PARSER = os.getenv("BARCODE_LIST_PARSER", "lxml" if lxml_html is not None else "bs4")
+
+def _lxml_text(el, sep: str = " ") -> str:
+    """bs4's get_text(sep, strip=True): stripped text pieces, empty ones dropped."""
+    return sep.join(t for t in (s.strip() for s in el.itertext()) if t)
+
+# lxml refuses a str that still carries an XML encoding declaration (ValueError);
+# the body is already decoded, so the declaration says nothing and is dropped
+_XML_DECL_RE = re.compile(r"^\s*<\?xml[^>]*\?>", re.I)
+
+def _lxml_doc(text: str):
+    text = _XML_DECL_RE.sub("", text or "", count=1)
+    try:
+        return lxml_html.document_fromstring(text)
+    except lxml_html.etree.ParserError:  # "Document is empty": nothing to parse, as for bs4
+        return lxml_html.document_fromstring("<html></html>")
+
+def _lxml_parse_product_page(doc, barcode: str):
+    h1 = doc.find(".//h1")
+    title = doc.find(".//title")
+    # soup.title.string is None when <title> has child tags
+    title = (title.text or "") if title is not None and len(title) == 0 else ""
+    og = doc.xpath("//meta[@property='og:title']/@content")
+    name = (_lxml_text(h1, "") if h1 is not None else "") or (og[0].strip() if og else "") or title
+    name = html.unescape(name).strip()
+    if name:
+        name = re.sub(rf"^\s*Штрихкод\s*(?:{re.escape(barcode)}|\d+)\s*[-—:]\s*", "", name, flags=re.I).strip()
+    if name and name.lower() in {"штрихкод", "barcode"}:
+        name = None
+
+    brand = None
+    for row in doc.xpath("//table//tr"):
+        th = row.find(".//th"); td = row.find(".//td")
+        if th is not None and td is not None:
+            key = _lxml_text(th).lower()
+            val = _lxml_text(td)
+        else:
+            cells = row.xpath(".//td | .//th")
+            if len(cells) < 2:
+                continue
+            key, val = _lxml_text(cells[0]).lower(), _lxml_text(cells[1])
+        if any(k in key for k in ["производитель", "бренд", "торговая марка"]):
+            brand = val.strip() or None
+            if brand:
+                break
+
+    return {"name": name or None, "brand": brand or None, "categories": None, "image": None}
+
+# rows holding a cell whose digits are exactly the barcode; the digit filter runs inside libxml2
+_SEARCH_ROWS = "//table//tr[.//td[translate(., translate(., '0123456789', ''), '') = $wanted]]"
+
+def _lxml_parse_search_page(doc, barcode: str):
+    def digits(s: str) -> str:
+        return re.sub(r"\D+", "", s or "")
+
+    wanted = digits(barcode)
+    name = None
+    for tr in doc.xpath(_SEARCH_ROWS, wanted=wanted) if wanted else ():
+        tds = tr.xpath(".//td")
+        if len(tds) < 2:
+            continue
+        for i, td in enumerate(tds):
+            if digits(_lxml_text(td)) == wanted:
+                if i + 1 < len(tds):
+                    name = _lxml_text(tds[i + 1])
+                break
+        if name:
+            break
+
+    if name and digits(name) == name:
+        name = None
+
+    return {"name": name or None, "brand": None, "categories": None, "image": None}
+
+def parse_product_page(text: str, barcode: str, backend: str | None = None) -> dict:
+    if (backend or HTML_PARSER) == "lxml" and lxml_html is not None:
+        return _lxml_parse_product_page(_lxml_doc(text), barcode)
+    return _parse_barcode_list_product_page(BeautifulSoup(text, "html.parser"), barcode)
+
+def parse_search_page(text: str, barcode: str, backend: str | None = None) -> dict:
+    if (backend or HTML_PARSER) == "lxml" and lxml_html is not None:
+        return _lxml_parse_search_page(_lxml_doc(text), barcode)
+    return _parse_barcode_list_search_page(BeautifulSoup(text, "html.parser"), barcode)
+
+_BARCODE_LIST_HEADERS = {
+    "User-Agent": "Mozilla/5.0",
+    "Accept-Language": "ru,en;q=0.8"
+}
+
+def fetch_barcode_list_product(barcode: str) -> dict | None:
+    """Direct product page /barcode/<barcode>/."""
     try:
         url_direct = f"https://barcode-list.ru/barcode/{barcode}/"
-        r = requests.get(url_direct, headers=headers, timeout=10)
+        r = http_cache.get("barcode-list", url_direct, headers=_BARCODE_LIST_HEADERS, timeout=10)
         if r.status_code == 200:
-            soup = BeautifulSoup(r.text, "html.parser")
-            data = _parse_barcode_list_product_page(soup, barcode)
+            data = parse_product_page(r.text, barcode)
             if data.get("name"):
                 return data
+            if not r.from_cache:
+                http_cache.mark_miss(url_direct)  # empty card: recheck after the miss TTL
     except Exception:
         pass
+    return None
 
-    # 2) Search page
+def fetch_barcode_list_search(barcode: str) -> dict | None:
+    """Site search Поиск.htm?barcode=<barcode>."""
     try:
         url_search = "https://barcode-list.ru/barcode/RU/%D0%9F%D0%BE%D0%B8%D1%81%D0%BA.htm"
-        rs = requests.get(url_search, headers=headers, params={"barcode": barcode}, timeout=10)
+        rs = http_cache.get("barcode-list-search", url_search, params={"barcode": barcode}, headers=_BARCODE_LIST_HEADERS,
+                            timeout=10, is_miss=lambda r: barcode.encode() not in r.content)
         if rs.status_code != 200:
             return None
         if not rs.encoding or rs.encoding.lower() in {"iso-8859-1", "latin-1"}:
             rs.encoding = "cp1251"
-        soup_s = BeautifulSoup(rs.text, "html.parser")
-        return _parse_barcode_list_search_page(soup_s, barcode)
+        return parse_search_page(rs.text, barcode)
     except Exception:
         return None
 
+def fetch_barcode_list_ru(barcode: str) -> dict | None:
+    # 1) Direct product page, 2) search page
+    return fetch_barcode_list_product(barcode) or fetch_barcode_list_search(barcode)
+
+# --- all sources at once (see source_resolver.py) ---
+SOURCES = {  # name -> (fetch, host); sources on one host share RESOLVE_HOST_LIMIT requests at a time
+    "openfoodfacts": (fetch_openfoodfacts, "world.openfoodfacts.org"),
+    "barcode-list": (fetch_barcode_list_product, "barcode-list.ru"),
+    "barcode-list-search": (fetch_barcode_list_search, "barcode-list.ru"),
+}
+# order = tie-break and merge priority; tune it from the stats printed at the end
+SOURCE_ORDER = [s.strip() for s in os.getenv("BARCODE_SOURCES", ",".join(SOURCES)).split(",") if s.strip() in SOURCES]
+MIN_QUALITY = float(os.getenv("RESOLVE_MIN_QUALITY", "0.6"))   # 0.6 = a usable name
+MERGE_SOURCES = os.getenv("RESOLVE_MERGE", "0") == "1"         # wait for all sources, fill fields across them
+RESOLVER_STATS = os.getenv("RESOLVER_STATS", "")               # append per-source stats (JSON line) here
+SOURCE_WORKERS = int(os.getenv("RESOLVE_SOURCE_WORKERS", "2"))  # threads per source; all busy = source skipped
+HOST_LIMIT = int(os.getenv("RESOLVE_HOST_LIMIT", "1"))          # concurrent requests per host
+
+_resolver = None
+
+def resolver() -> Resolver:
+    global _resolver
+    if _resolver is None:
+        _resolver = Resolver([(name, *SOURCES[name]) for name in SOURCE_ORDER],
+                             min_quality=MIN_QUALITY, merge=MERGE_SOURCES,
+                             per_source=SOURCE_WORKERS, host_limit=HOST_LIMIT)
+    return _resolver
+
 # --- formatting & glue ---
 def build_table(barcode: str, name: str | None, desc: str | None, cat: str | None, brand: str | None, img: str | None) -> str:
     return (
@@ -155,8 +286,7 @@ def make_desc(name: str | None, brand: str | None) -> str | None:
     return name or brand
 
 def process_barcode(barcode: str) -> str:
-    #data = fetch_openfoodfacts(barcode) or fetch_barcode_list_ru(barcode) or {}
-    data = fetch_barcode_list_ru(barcode) or {}
+    data = resolver().resolve(barcode) or {}
 
     name = (data or {}).get("name")
     brand = (data or {}).get("brand")
@@ -175,6 +305,12 @@ def main():
         args = ["5011007015534"]
     tables = [process_barcode(b.strip()) for b in args if b.strip()]
     print("\n".join(tables))
+    print(http_cache.summary(), file=sys.stderr)
+    if _resolver is not None:
+        print(_resolver.stats.summary(), file=sys.stderr)
+        if RESOLVER_STATS:
+            _resolver.stats.dump(RESOLVER_STATS)
+        _resolver.close()
 
 if __name__ == "__main__":
     main()
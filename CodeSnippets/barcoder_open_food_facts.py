@@ -1,9 +1,22 @@
 # fill_barcodes.py
-import csv, os, json, requests
+# Bulk mode: unique barcodes are resolved concurrently (OFF lookups and GPT calls each
+# bounded by their own limit) over one pooled HTTP session and one shared OpenAI client;
+# output rows keep the input order. --off-workers 1 --llm-workers 1 is the old one-by-one run.
+import csv, os, json, argparse, threading, requests
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from openai import OpenAI
+import off_index
+import http_cache
 
 INPUT_FILE = "barcodes.csv"
 OUTPUT_FILE = "barcodes_filled.csv"
+MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+OFF_WORKERS = int(os.getenv("OFF_WORKERS", "8"))   # concurrent OpenFoodFacts lookups
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "4"))   # concurrent GPT calls
+USER_AGENT = "ProductsCatalogue/1.0 (barcode enrichment)"
+OFF_INDEX_ONLY = os.getenv("OFF_INDEX_ONLY", "0") == "1"  # with OFF_INDEX: never ask the OFF API
 
 CATEGORIES = [
     "01 BAR_BEVERAGES", "02 BAR_SNACKS", "03 BAR_PACKAGED_FOOD",
@@ -12,10 +25,45 @@ CATEGORIES = [
     "10 BAR_BAKERY BAR_STAPLES", "11 BAR_ALCOHOL_TOBACCO", "12 BAR_OTHER"
 ]
 
+_lock = threading.Lock()
+_session = None
+_client = None
+
+def http_session() -> requests.Session:
+    """One keep-alive session for all threads (urllib3 pools are thread-safe), retrying 429/5xx."""
+    global _session
+    with _lock:
+        if _session is None:
+            s = requests.Session()
+            retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(429, 502, 503, 504),
+                          allowed_methods=("GET",), respect_retry_after_header=True)
+            s.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=max(OFF_WORKERS, 4), max_retries=retry))
+            s.headers["User-Agent"] = USER_AGENT
+            _session = s
+        return _session
+
+def llm_client() -> OpenAI | None:
+    """One OpenAI client for the whole run (it is thread-safe and pools its connections)."""
+    global _client
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    with _lock:
+        if _client is None:
+            _client = OpenAI(api_key=api_key, base_url=os.getenv("OPENAI_BASE_URL") or None)
+        return _client
+
+def _off_missing(r) -> bool:
+    return r.json().get("status") != 1
+
 def fetch_openfoodfacts(barcode: str) -> dict | None:
+    # local dump index first (OFF_INDEX=off_index.sqlite, see off_index.py)
+    indexed, product = off_index.lookup(barcode)
+    if product or (indexed and OFF_INDEX_ONLY):
+        return product
     url = f"https://world.openfoodfacts.org/api/v0/product/{barcode}.json"
     try:
-        r = requests.get(url, timeout=8)
+        r = http_cache.get("openfoodfacts", url, fetch=http_session().get, timeout=8, is_miss=_off_missing)
         if r.status_code != 200:
             return None
         data = r.json()
@@ -34,10 +82,9 @@ def fetch_openfoodfacts(barcode: str) -> dict | None:
         return None
 
 def gpt_enrich(barcode: str, off: dict) -> dict | None:
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
+    client = llm_client()
+    if client is None:
         return None
-    client = OpenAI(api_key=api_key)
 
     categories_str = "\n".join(CATEGORIES)
     off_name = (off.get("name") or "").strip()
@@ -73,7 +120,7 @@ JSON формат:
 
     try:
         resp = client.chat.completions.create(
-            model="gpt-4o-mini",
+            model=MODEL,
             response_format={"type": "json_object"},
             temperature=0.2,
             messages=[
@@ -91,57 +138,127 @@ JSON формат:
     except Exception as e:
         print("GPT error:", e)
         return None
+class Enricher:
+    """Resolves each distinct barcode once: OFF lookup, then GPT when OFF found something.
+
+    Duplicate barcodes (several photos of one product) share the first
+    request's future. OFF lookups and GPT calls run on separate executors;
+    the GPT call is submitted from the OFF future's completion callback, so
+    no thread sits waiting for an LLM slot and slow GPT calls cannot starve
+    the lookups.
+    """
+    def __init__(self, off_workers: int = OFF_WORKERS, llm_workers: int = LLM_WORKERS):
+        self.off_pool = ThreadPoolExecutor(max_workers=max(1, off_workers), thread_name_prefix="off")
+        self.llm_pool = ThreadPoolExecutor(max_workers=max(1, llm_workers), thread_name_prefix="gpt")
+        self.futures = {}
+
+    def _chain(self, barcode: str, off_fut: Future, out: Future):
+        """OFF finished: answer (None, None) or hand the product to the GPT executor."""
+        if off_fut.cancelled():
+            out.cancel()
+            return
+        if off_fut.exception() is not None:
+            out.set_exception(off_fut.exception())
+            return
+        off = off_fut.result()
+        if not off or not (off.get("name") or off.get("brand")):
+            out.set_result((None, None))
+            return
+        try:
+            llm_fut = self.llm_pool.submit(gpt_enrich, barcode, off)
+        except RuntimeError as e:  # closed while this lookup was in flight
+            out.set_exception(e)
+            return
+
+        def done(f: Future):
+            if f.cancelled():
+                out.cancel()
+            elif f.exception() is not None:
+                out.set_exception(f.exception())
+            else:
+                out.set_result((off, f.result() or {}))
+        llm_fut.add_done_callback(done)
+
+    def submit(self, barcode: str) -> Future:
+        if barcode not in self.futures:
+            out = Future()
+            off_fut = self.off_pool.submit(fetch_openfoodfacts, barcode)
+            off_fut.add_done_callback(lambda f: self._chain(barcode, f, out))
+            self.futures[barcode] = out
+        return self.futures[barcode]
+
+    def close(self, cancel: bool = False):
+        """Wait for the queued work; cancel=True (error / Ctrl+C) drops whatever has not started."""
+        self.off_pool.shutdown(wait=True, cancel_futures=cancel)
+        self.llm_pool.shutdown(wait=True, cancel_futures=cancel)
+
+def merge_row(row: dict, off: dict, enriched: dict):
+    # merge (GPT > OFF > existing)
+    row["name"] = (enriched.get("name") or off.get("name") or row.get("name") or "").strip()
+    row["brand"] = (enriched.get("brand") or off.get("brand") or row.get("brand") or "").strip()
+    row["category"] = (enriched.get("category") or row.get("category") or "").strip()
+    row["productDesc"] = (enriched.get("productDesc") or row.get("productDesc") or "").strip()
+    row["productImg"] = (off.get("image") or row.get("productImg") or "").strip()
+
 def main():
-    print(f"[START] reading {INPUT_FILE}")
+    global OFF_WORKERS
+    ap = argparse.ArgumentParser(description="Fill name/brand/category from OpenFoodFacts + GPT")
+    ap.add_argument("-i", "--input", default=INPUT_FILE)
+    ap.add_argument("-o", "--output", default=OUTPUT_FILE)
+    ap.add_argument("--off-workers", type=int, default=OFF_WORKERS, help="concurrent OFF lookups")
+    ap.add_argument("--llm-workers", type=int, default=LLM_WORKERS, help="concurrent GPT calls")
+    args = ap.parse_args()
+    OFF_WORKERS = args.off_workers  # sizes the session's connection pool
+
+    print(f"[START] reading {args.input}")
 
     rows = []
     total = found = enriched_cnt = 0
 
-    with open(INPUT_FILE, newline="", encoding="utf-8") as f_in:
+    with open(args.input, newline="", encoding="utf-8") as f_in:
         reader = csv.DictReader(f_in)
         fieldnames_in = reader.fieldnames or []
         print(f"[HEADER-IN] {fieldnames_in}")
+        rows = list(reader)
 
-        # ensure the output has our enriched columns
-        required_cols = ["name", "productDesc", "category", "brand", "productImg"]
-        fieldnames_out = list(fieldnames_in)
-        for c in required_cols:
-            if c not in fieldnames_out:
-                fieldnames_out.append(c)
+    # ensure the output has our enriched columns
+    required_cols = ["name", "productDesc", "category", "brand", "productImg"]
+    fieldnames_out = list(fieldnames_in)
+    for c in required_cols:
+        if c not in fieldnames_out:
+            fieldnames_out.append(c)
 
-        for i, row in enumerate(reader, start=1):
+    # queue every distinct barcode up front, then collect in input order
+    enricher = Enricher(args.off_workers, args.llm_workers)
+    pending = [enricher.submit(b) if (b := (row.get("barcode") or "").strip()) else None for row in rows]
+    print(f"[INFO] {len(rows)} rows, {len(enricher.futures)} distinct barcodes "
+          f"(OFF x{args.off_workers}, GPT x{args.llm_workers})")
+
+    try:
+        for i, (row, fut) in enumerate(zip(rows, pending), start=1):
             total += 1
             barcode = (row.get("barcode") or "").strip()
-            if not barcode:
+            if fut is None:
                 print(f"[{i:04}] empty barcode → skip")
-                rows.append(row)
                 continue
 
-            print(f"[{i:04}] {barcode} → querying OFF")
-            off = fetch_openfoodfacts(barcode)
-
-            if not off or not (off.get("name") or off.get("brand")):
-                print(f"       NOT FOUND in OpenFoodFacts")
-                rows.append(row)
+            off, enriched = fut.result()
+            if off is None:
+                print(f"[{i:04}] {barcode} → NOT FOUND in OpenFoodFacts")
                 continue
 
             found += 1
-            enriched = gpt_enrich(barcode, off) or {}
             if enriched:
                 enriched_cnt += 1
-
-            # merge (GPT > OFF > existing)
-            row["name"] = (enriched.get("name") or off.get("name") or row.get("name") or "").strip()
-            row["brand"] = (enriched.get("brand") or off.get("brand") or row.get("brand") or "").strip()
-            row["category"] = (enriched.get("category") or row.get("category") or "").strip()
-            row["productDesc"] = (enriched.get("productDesc") or row.get("productDesc") or "").strip()
-            row["productImg"] = (off.get("image") or row.get("productImg") or "").strip()
-
-            print(f"       SAVED name={row['name']!r}, brand={row['brand']!r}")
-            rows.append(row)
+            merge_row(row, off, enriched)
+            print(f"[{i:04}] {barcode} → SAVED name={row['name']!r}, brand={row['brand']!r}")
+    except BaseException:
+        enricher.close(cancel=True)
+        raise
+    enricher.close()
 
     # write to OUTPUT_FILE (with extended header)
-    with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f_out:
+    with open(args.output, "w", newline="", encoding="utf-8") as f_out:
         writer = csv.DictWriter(f_out, fieldnames=fieldnames_out, extrasaction="ignore")
         writer.writeheader()
         for r in rows:
@@ -153,11 +270,13 @@ def main():
     # final report
     print("\n========== REPORT ==========")
     print(f"Total barcodes processed : {total}")
+    print(f"Distinct barcodes        : {len(enricher.futures)}")
     print(f"Found in OpenFoodFacts   : {found}")
     print(f"Enriched with GPT        : {enriched_cnt}")
-    print(f"Saved to                 : {OUTPUT_FILE}")
+    print(f"Saved to                 : {args.output}")
+    print(http_cache.summary())
     print("============================")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
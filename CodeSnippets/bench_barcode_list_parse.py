@@ -0,0 +1,98 @@
+# bench_barcode_list_parse.py
+"""
+Compare the barcode-list.ru page parsers of barcoder_2_sources on HTML pages:
+BeautifulSoup + html.parser (the original) vs lxml with targeted XPath.
+
+Pages are read from --pages: product_<barcode>.html is a /barcode/<barcode>/
+card, search_<barcode>.html a Поиск.htm?barcode= result. The default,
+fixtures/barcode_list, holds synthetic pages that imitate the site's layout
+(see its README) — not saved copies, so their parity and timings say nothing
+about real pages; point --pages at pages saved from the site for that.
+Bodies are decoded like fetch_barcode_list_ru sees them (utf-8, else cp1251).
+Both backends must return the same dict for every page; any difference is
+printed and makes the exit code 1.
+
+Usage:
+    python bench_barcode_list_parse.py
+    python bench_barcode_list_parse.py --pages saved_pages/ --repeat 200
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import barcoder_2_sources as b2s
+
+BACKENDS = ("bs4", "lxml")
+
+
+def load_pages(folder: Path):
+    pages = []
+    for path in sorted(folder.glob("*.htm*")):
+        kind, _, barcode = path.stem.partition("_")
+        if kind not in {"product", "search"} or not barcode:
+            continue
+        raw = path.read_bytes()
+        try:
+            text = raw.decode("utf-8")
+        except UnicodeDecodeError:
+            text = raw.decode("cp1251")
+        pages.append((path.name, kind, barcode, text))
+    return pages
+
+
+def parse(kind: str, text: str, barcode: str, backend: str) -> dict:
+    if kind == "product":
+        return b2s.parse_product_page(text, barcode, backend)
+    return b2s.parse_search_page(text, barcode, backend)
+
+
+def bench(pages, backend: str, repeat: int) -> dict:
+    """Best-of-3 mean milliseconds per page, per page."""
+    out = {}
+    for name, kind, barcode, text in pages:
+        best = float("inf")
+        for _ in range(3):
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                parse(kind, text, barcode, backend)
+            best = min(best, (time.perf_counter() - t0) / repeat * 1000)
+        out[name] = best
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark bs4 vs lxml parsing of barcode-list.ru pages")
+    ap.add_argument("--pages", default=str(Path(__file__).resolve().parent / "fixtures" / "barcode_list"))
+    ap.add_argument("--repeat", type=int, default=50, help="parses per page per timing round")
+    args = ap.parse_args()
+
+    if b2s.lxml_html is None:
+        print("[error] lxml is not installed (pip install lxml)")
+        sys.exit(1)
+    pages = load_pages(Path(args.pages))
+    if not pages:
+        print(f"[error] no product_*.html / search_*.html pages in {args.pages}")
+        sys.exit(1)
+
+    mismatches = 0
+    for name, kind, barcode, text in pages:
+        results = {backend: parse(kind, text, barcode, backend) for backend in BACKENDS}
+        if results["bs4"] != results["lxml"]:
+            mismatches += 1
+            print(f"[warn] {name}: bs4={results['bs4']} lxml={results['lxml']}")
+
+    timings = {backend: bench(pages, backend, args.repeat) for backend in BACKENDS}
+    print(f"{'page':<32} {'KB':>6} {'bs4 ms':>8} {'lxml ms':>8} {'speedup':>8}")
+    for name, kind, barcode, text in pages:
+        a, b = timings["bs4"][name], timings["lxml"][name]
+        print(f"{name:<32} {len(text.encode()) / 1024:>6.1f} {a:>8.2f} {b:>8.2f} {a / b:>7.1f}x")
+    total_a, total_b = sum(timings["bs4"].values()), sum(timings["lxml"].values())
+    print(f"{'total':<32} {'':>6} {total_a:>8.2f} {total_b:>8.2f} {total_a / total_b:>7.1f}x")
+    print(f"[ok] {len(pages)} pages, {mismatches} mismatches")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
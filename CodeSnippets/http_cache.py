@@ -0,0 +1,296 @@
+# http_cache.py
+"""
+Shared on-disk cache of HTTP GET responses for the barcode sources
+(barcoder_2_sources / barcoder_open_food_facts), so a rerun over the same
+barcodes.csv does not download the same product and search pages again.
+
+- Storage: one SQLite file (WAL), one connection shared by all threads.
+- Key: sha256 over (method, URL, sorted query params); headers are not part
+  of the key.
+- Value: zlib-compressed body + status code, encoding and content type; a
+  cached answer comes back as a real requests.Response (.text/.json() work
+  as on a fresh one, `from_cache` is True).
+- Negative caching: 404/410, or whatever the caller's is_miss(response) says
+  is a "not found" page, is kept for HTTP_CACHE_MISS_TTL_DAYS (default 3)
+  instead of HTTP_CACHE_HIT_TTL_DAYS (default 30), so new products get
+  picked up. 429/5xx and network errors are never stored.
+- Size budget: HTTP_CACHE_MAX_MB (default 256) of compressed bodies; above
+  it the least recently used entries are dropped down to 90% of the budget.
+- Per-source counters (hits, negative hits, network fetches) for the run
+  and accumulated in the file; see summary() or `python http_cache.py stats`.
+
+HTTP_CACHE=path (default http_cache.sqlite); HTTP_CACHE="" disables caching.
+
+Usage:
+    r = http_cache.get("openfoodfacts", url, timeout=8, is_miss=lambda r: r.json().get("status") != 1)
+    print(http_cache.summary())
+"""
+
+import argparse
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from urllib.parse import urlencode
+import requests
+from requests.structures import CaseInsensitiveDict
+
+DAY = 86400.0
+CACHEABLE = {200, 404, 410}
+ALWAYS_MISS = {404, 410}
+
+
+class HttpCache:
+    def __init__(self, path, hit_ttl_sec: float = 30 * DAY, miss_ttl_sec: float = 3 * DAY,
+                 max_bytes: int = 256 * 2**20):
+        self.path = str(path)
+        self.hit_ttl_sec = hit_ttl_sec
+        self.miss_ttl_sec = miss_ttl_sec
+        self.max_bytes = max_bytes
+        self.stats = {}  # source -> Counter(hit, negative_hit, fetched, stored, expired)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " source TEXT NOT NULL,"
+            " url TEXT NOT NULL,"
+            " status INTEGER NOT NULL,"
+            " encoding TEXT,"
+            " content_type TEXT,"
+            " body BLOB NOT NULL,"
+            " miss INTEGER NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS source_stats ("
+            " source TEXT NOT NULL, counter TEXT NOT NULL, n INTEGER NOT NULL,"
+            " PRIMARY KEY (source, counter))"
+        )
+        self.conn.commit()
+        (self.size,) = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        self.evict()
+
+    @staticmethod
+    def key(url: str, params=None, method: str = "GET") -> str:
+        query = urlencode(sorted((str(k), str(v)) for k, v in dict(params or {}).items()))
+        return hashlib.sha256(f"{method.upper()} {url}?{query}".encode("utf-8")).hexdigest()
+
+    def _count(self, source: str, counter: str):
+        self.stats.setdefault(source, Counter())[counter] += 1
+
+    def get(self, source: str, url: str, params=None) -> requests.Response | None:
+        """Fresh cached response for (url, params), or None."""
+        key = self.key(url, params)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status, encoding, content_type, body, miss, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            status, encoding, content_type, body, miss, created_at = row
+            if created_at < now - (self.miss_ttl_sec if miss else self.hit_ttl_sec):
+                self._count(source, "expired")
+                return None
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self._count(source, "negative_hit" if miss else "hit")
+        r = requests.Response()
+        r.status_code = status
+        r._content = zlib.decompress(body)
+        r.encoding = encoding
+        r.headers = CaseInsensitiveDict({"Content-Type": content_type} if content_type else {})
+        r.url = url
+        r.from_cache = True
+        r.cache_miss = bool(miss)
+        return r
+
+    def put(self, source: str, url: str, params, response: requests.Response, miss: bool = False) -> bool:
+        """Store a response; only 200/404/410 are kept (404/410 always as misses)."""
+        if response.status_code not in CACHEABLE:
+            return False
+        miss = bool(miss) or response.status_code in ALWAYS_MISS
+        body = zlib.compress(response.content or b"", 6)
+        now = time.time()
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (self.key(url, params),)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses(key, source, url, status, encoding, content_type, body, miss, size,"
+                " created_at, last_used) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                (self.key(url, params), source, url, response.status_code, response.encoding,
+                 response.headers.get("Content-Type"), body, int(miss), len(body), now, now),
+            )
+            self.conn.commit()
+            self.size += len(body) - (old[0] if old else 0)
+            self._count(source, "stored")
+            if self.max_bytes and self.size > self.max_bytes:
+                self._evict_lru()
+        return True
+
+    def mark_miss(self, url: str, params=None):
+        """Turn a stored answer into a negative entry (for "not found" only the parser can tell)."""
+        with self.lock:
+            self.conn.execute("UPDATE responses SET miss = 1 WHERE key = ?", (self.key(url, params),))
+            self.conn.commit()
+
+    def _evict_lru(self):
+        """Drop least-recently-used entries down to 90% of the budget (caller holds the lock)."""
+        target = int(self.max_bytes * 0.9)
+        doomed = []
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY last_used ASC"):
+            if self.size <= target:
+                break
+            doomed.append((key,))
+            self.size -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self.conn.commit()
+
+    def evict(self):
+        """Drop expired entries, then LRU entries above the size budget."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM responses WHERE (miss = 0 AND created_at < ?) OR (miss = 1 AND created_at < ?)",
+                (now - self.hit_ttl_sec, now - self.miss_ttl_sec),
+            )
+            self.conn.commit()
+            (self.size,) = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+            if self.max_bytes and self.size > self.max_bytes:
+                self._evict_lru()
+
+    def flush_stats(self):
+        """Add this run's counters to the per-source totals in the file."""
+        with self.lock:
+            rows = [(s, c, n) for s, counts in self.stats.items() for c, n in counts.items() if n]
+            self.conn.executemany(
+                "INSERT INTO source_stats(source, counter, n) VALUES (?,?,?)"
+                " ON CONFLICT(source, counter) DO UPDATE SET n = n + excluded.n",
+                rows,
+            )
+            self.conn.commit()
+            self.stats = {}
+
+    def totals(self) -> dict:
+        out = {}
+        with self.lock:
+            for s, c, n in self.conn.execute("SELECT source, counter, n FROM source_stats"):
+                out.setdefault(s, Counter())[c] += n
+        return out
+
+    def summary(self, stats: dict | None = None) -> str:
+        lines = []
+        for source, c in sorted((self.stats if stats is None else stats).items()):
+            cached = c["hit"] + c["negative_hit"]
+            total = cached + c["fetched"]
+            rate = (cached / total * 100) if total else 0.0
+            lines.append(f"{source}: hits={c['hit']} negative={c['negative_hit']} fetched={c['fetched']}"
+                         f" ({rate:.1f}% hit rate)")
+        lines.append(f"http cache {self.size / 2**20:.1f} MB of {self.max_bytes / 2**20:.0f} MB → {self.path}")
+        return "\n".join(lines)
+
+    def close(self):
+        self.flush_stats()
+        self.conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def shared() -> HttpCache | None:
+    """The process-wide cache configured by HTTP_CACHE*, or None when disabled."""
+    global _cache
+    path = os.getenv("HTTP_CACHE", "http_cache.sqlite")
+    if not path:
+        return None
+    with _cache_lock:
+        if _cache is None or _cache.path != path:
+            _cache = HttpCache(
+                path,
+                hit_ttl_sec=float(os.getenv("HTTP_CACHE_HIT_TTL_DAYS", "30")) * DAY,
+                miss_ttl_sec=float(os.getenv("HTTP_CACHE_MISS_TTL_DAYS", "3")) * DAY,
+                max_bytes=int(float(os.getenv("HTTP_CACHE_MAX_MB", "256")) * 2**20),
+            )
+            atexit.register(_cache.flush_stats)
+        return _cache
+
+
+def get(source: str, url: str, *, params=None, fetch=requests.get, is_miss=None, **kwargs) -> requests.Response:
+    """GET through the shared cache; fetch(url, params=..., **kwargs) does the network call.
+
+    is_miss(response) marks a 200 answer as "not found" (shorter TTL). A
+    response that fails to parse counts as a miss rather than a hit.
+    """
+    cache = shared()
+    if cache is not None:
+        r = cache.get(source, url, params)
+        if r is not None:
+            return r
+    r = fetch(url, params=params, **kwargs)
+    r.from_cache = False
+    if cache is not None:
+        with cache.lock:
+            cache._count(source, "fetched")
+        miss = False
+        if is_miss is not None and r.status_code == 200:
+            try:
+                miss = bool(is_miss(r))
+            except Exception:
+                miss = True
+        cache.put(source, url, params, r, miss)
+    return r
+
+
+def mark_miss(url: str, params=None):
+    cache = shared()
+    if cache is not None:
+        cache.mark_miss(url, params)
+
+
+def summary() -> str:
+    cache = shared()
+    return cache.summary() if cache is not None else "http cache off"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Inspect / trim the shared HTTP response cache")
+    ap.add_argument("cmd", choices=["stats", "evict", "clear"])
+    ap.add_argument("-d", "--db", default=os.getenv("HTTP_CACHE") or "http_cache.sqlite")
+    ap.add_argument("--source", help="clear only this source")
+    args = ap.parse_args()
+    os.environ["HTTP_CACHE"] = args.db
+    cache = shared()
+
+    if args.cmd == "stats":
+        print(cache.summary(cache.totals()))
+        for source, n, misses, size in cache.conn.execute(
+            "SELECT source, COUNT(*), SUM(miss), SUM(size) FROM responses GROUP BY source ORDER BY source"
+        ):
+            print(f"  {source}: {n} entries ({misses} negative), {size / 2**20:.1f} MB")
+    elif args.cmd == "evict":
+        cache.evict()
+        print(f"[ok] {cache.size / 2**20:.1f} MB left")
+    else:
+        with cache.lock:
+            if args.source:
+                cache.conn.execute("DELETE FROM responses WHERE source = ?", (args.source,))
+            else:
+                cache.conn.execute("DELETE FROM responses")
+            cache.conn.commit()
+        cache.evict()
+        cache.conn.execute("VACUUM")
+        print(f"[ok] cleared{' ' + args.source if args.source else ''}")
+
+
+if __name__ == "__main__":
+    main()
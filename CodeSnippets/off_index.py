@@ -0,0 +1,199 @@
+# off_index.py
+"""
+Local OpenFoodFacts index: import a bulk export once, look barcodes up offline.
+
+The importer streams an OFF dump line by line (never holding it in RAM):
+- JSONL (openfoodfacts-products.jsonl.gz), one product object per line;
+- CSV/TSV (en.openfoodfacts.org.products.csv.gz, tab-separated).
+Plain or gzip-compressed (by the .gz suffix). Only the fields the barcoders
+use are kept: product_name, generic_name, brands, categories, quantity,
+labels, image_url — into one SQLite table keyed by the barcode
+(PRIMARY KEY, WITHOUT ROWID), so a lookup is a single B-tree probe.
+The index is built in a temp file and renamed into place when complete.
+
+fetch_openfoodfacts (barcoder_open_food_facts / barcoder_2_sources) asks the
+index first when OFF_INDEX points at it; OFF_INDEX_ONLY=1 skips the network
+for barcodes the dump does not have.
+
+Usage:
+    python off_index.py import openfoodfacts-products.jsonl.gz -o off_index.sqlite
+    python off_index.py get 4006396102676 -d off_index.sqlite
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+FIELDS = ("product_name", "generic_name", "brands", "categories", "quantity", "labels", "image_url")
+BATCH_ROWS = 20000
+
+_NON_DIGITS = re.compile(r"\D+")
+
+
+def _open_text(path):
+    raw = gzip.open(path, "rb") if str(path).endswith(".gz") else open(path, "rb")
+    return io.TextIOWrapper(raw, encoding="utf-8", errors="replace", newline="")
+
+
+def _iter_jsonl(f):
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            p = json.loads(line)
+        except ValueError:
+            continue
+        yield p.get("code") or p.get("_id"), p
+
+
+def _iter_csv(f):
+    csv.field_size_limit(sys.maxsize)
+    first = f.readline()
+    delimiter = "\t" if first.count("\t") > first.count(",") else ","
+    header = next(csv.reader([first], delimiter=delimiter))
+    for row in csv.DictReader(f, fieldnames=header, delimiter=delimiter, quoting=csv.QUOTE_NONE if delimiter == "\t" else csv.QUOTE_MINIMAL):
+        yield row.get("code"), row
+
+
+def iter_products(path):
+    """(barcode, {field: value}) for every product of a dump, streamed."""
+    name = str(path).removesuffix(".gz")
+    with _open_text(path) as f:
+        records = _iter_jsonl(f) if name.endswith((".jsonl", ".json", ".ndjson")) else _iter_csv(f)
+        for code, p in records:
+            code = _NON_DIGITS.sub("", str(code or ""))
+            if not code:
+                continue
+            values = tuple(_text(p.get(k)) for k in FIELDS)
+            if values[0] or values[1] or values[2]:  # no name and no brand: useless to us
+                yield code, values
+
+
+def _text(v) -> str | None:
+    if isinstance(v, list):
+        v = ", ".join(str(x) for x in v if x)
+    v = (str(v).strip() if v is not None else "")
+    return v or None
+
+
+def import_dump(src, db_path, verbose=True) -> int:
+    tmp = f"{db_path}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute(f"CREATE TABLE products (code TEXT PRIMARY KEY, {', '.join(f'{k} TEXT' for k in FIELDS)}) WITHOUT ROWID")
+    sql = f"INSERT OR REPLACE INTO products VALUES ({', '.join('?' * (len(FIELDS) + 1))})"
+    t0, n, batch = time.time(), 0, []
+    for code, values in iter_products(src):
+        batch.append((code, *values))
+        if len(batch) >= BATCH_ROWS:
+            conn.executemany(sql, batch)
+            n += len(batch)
+            batch = []
+            if verbose:
+                print(f"[info] {n} products ({n / (time.time() - t0):.0f}/s)", flush=True)
+    conn.executemany(sql, batch)
+    n += len(batch)
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    os.replace(tmp, db_path)
+    if verbose:
+        print(f"[ok] {db_path}: {n} products in {time.time() - t0:.1f}s")
+    return n
+
+
+def _candidates(barcode: str):
+    """The code as given, plus the EAN-13/UPC-A zero-padding variants OFF uses."""
+    code = _NON_DIGITS.sub("", barcode or "")
+    if not code:
+        return []
+    out = [code]
+    stripped = code.lstrip("0")
+    for c in (stripped, stripped.zfill(13), stripped.zfill(12), stripped.zfill(8)):
+        if c and c not in out:
+            out.append(c)
+    return out
+
+
+class OffIndex:
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()  # one read-only connection per thread
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def get(self, barcode: str) -> dict | None:
+        """Product in fetch_openfoodfacts' shape, or None."""
+        conn = self._conn()
+        for code in _candidates(barcode):
+            row = conn.execute(f"SELECT {', '.join(FIELDS)} FROM products WHERE code = ?", (code,)).fetchone()
+            if row:
+                p = dict(zip(FIELDS, row))
+                return {
+                    "name": p["product_name"] or p["generic_name"],
+                    "brand": p["brands"],
+                    "categories": p["categories"],
+                    "quantity": p["quantity"],
+                    "labels": p["labels"],
+                    "image": p["image_url"],
+                    "source": "openfoodfacts-dump",
+                }
+        return None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def lookup(barcode: str):
+    """(True, product or None) when OFF_INDEX is configured, else (False, None)."""
+    global _index
+    path = os.getenv("OFF_INDEX", "")
+    if not path or not os.path.exists(path):
+        return False, None
+    with _index_lock:
+        if _index is None or _index.path != path:
+            _index = OffIndex(path)
+    return True, _index.get(barcode)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Import an OpenFoodFacts dump into a barcode index / query it")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    i = sub.add_parser("import", help="stream a .jsonl[.gz] / .csv[.gz] dump into the index")
+    i.add_argument("dump")
+    i.add_argument("-o", "--output", default="off_index.sqlite")
+    g = sub.add_parser("get", help="look barcodes up")
+    g.add_argument("barcodes", nargs="+")
+    g.add_argument("-d", "--db", default="off_index.sqlite")
+    args = ap.parse_args()
+
+    if args.cmd == "import":
+        import_dump(args.dump, args.output)
+    else:
+        idx = OffIndex(args.db)
+        for b in args.barcodes:
+            t0 = time.perf_counter()
+            p = idx.get(b)
+            print(f"{b}: {json.dumps(p, ensure_ascii=False)} ({(time.perf_counter() - t0) * 1e6:.0f} µs)")
+
+
+if __name__ == "__main__":
+    main()
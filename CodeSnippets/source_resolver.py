@@ -0,0 +1,225 @@
+# source_resolver.py
+"""
+Ask several barcode sources at once and keep the first good answer.
+
+Each registered source is a (name, fetch[, host]) tuple, fetch(barcode) ->
+dict | None in the barcoders' shape (name, brand, categories, image). For one
+barcode all sources are started together, each on its own small thread pool:
+- first-good-wins (default): the first result whose quality() reaches
+  min_quality is returned; sources not started yet are cancelled and the
+  ones in flight are no longer waited for (a thread cannot be interrupted —
+  they finish within their own HTTP timeout and still feed the stats and
+  the HTTP cache);
+- merge=True: wait for every source (up to `timeout`) and fill each field
+  from the best-scoring result that has it, ties broken by source order.
+If nothing reaches the threshold, the best partial result is returned.
+
+Abandoned calls only occupy their own source's pool (per_source threads).
+A source whose threads are all still busy with earlier barcodes is skipped
+for this one instead of queueing behind them, unless every source is busy.
+Sources on the same host (host defaults to the source name) share
+host_limit concurrent requests; a call still waiting for its host when the
+answer has been chosen gives up without sending anything.
+
+Per source, SourceStats keeps a latency histogram and outcome counters
+(good / partial / miss / error, plus wins, late answers and skips), so the
+source order and the threshold can be tuned from data:
+    print(resolver.stats.summary())
+
+Usage:
+    resolver = Resolver([("openfoodfacts", fetch_openfoodfacts, "world.openfoodfacts.org"),
+                         ("barcode-list", fetch_barcode_list_product, "barcode-list.ru")])
+    data = resolver.resolve("4607001771234")   # {"name": ..., "brand": ..., "source": "barcode-list"}
+"""
+
+import bisect
+import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+FIELDS = ("name", "brand", "categories", "image")
+WEIGHTS = {"name": 0.6, "brand": 0.25, "image": 0.1, "categories": 0.05}
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0)  # seconds; one more bucket for slower
+
+
+def usable(field: str, value) -> bool:
+    value = str(value or "").strip()
+    if field == "name":
+        return len(value) >= 3 and not value.isdigit()
+    return bool(value)
+
+
+def quality(data: dict | None) -> float:
+    """0..1: a usable name alone passes the default threshold, brand/image/categories add to it."""
+    if not data:
+        return 0.0
+    return round(sum(w for field, w in WEIGHTS.items() if usable(field, data.get(field))), 3)
+
+
+class SourceStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}     # source -> Counter(calls, good, partial, miss, error, wins, late, skipped)
+        self.histograms = {}  # source -> [count per LATENCY_BUCKETS + overflow]
+        self.total_sec = Counter()
+
+    def record(self, source: str, seconds: float, outcome: str, late: bool = False):
+        with self.lock:
+            c = self.counts.setdefault(source, Counter())
+            c["calls"] += 1
+            c[outcome] += 1
+            if late:
+                c["late"] += 1
+            h = self.histograms.setdefault(source, [0] * (len(LATENCY_BUCKETS) + 1))
+            h[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            self.total_sec[source] += seconds
+
+    def win(self, source: str):
+        with self.lock:
+            self.counts.setdefault(source, Counter())["wins"] += 1
+
+    def skip(self, source: str):
+        """Not asked: its pool was busy with earlier barcodes, or its host stayed busy."""
+        with self.lock:
+            self.counts.setdefault(source, Counter())["skipped"] += 1
+
+    def percentile(self, source: str, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (inf for the overflow bucket)."""
+        h = self.histograms.get(source) or []
+        target, seen = q * sum(h), 0
+        for i, n in enumerate(h):
+            seen += n
+            if n and seen >= target:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float("inf")
+        return float("nan")
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {s: {**c, "calls": c["calls"], "hit_rate": round(c["good"] / c["calls"], 3) if c["calls"] else 0.0,
+                        "mean_s": round(self.total_sec[s] / c["calls"], 3) if c["calls"] else 0.0,
+                        "latency_hist": dict(zip([*map(str, LATENCY_BUCKETS), "inf"], self.histograms.get(s, [])))}
+                    for s, c in self.counts.items()}
+
+    def summary(self) -> str:
+        lines = [f"{'source':<22} {'calls':>6} {'good':>5} {'part':>5} {'miss':>5} {'err':>4} {'wins':>5}"
+                 f" {'skip':>5} {'hit%':>6} {'mean s':>7} {'p50≤':>6} {'p90≤':>6}"]
+        for s, d in self.to_dict().items():
+            lines.append(f"{s:<22} {d['calls']:>6} {d.get('good', 0):>5} {d.get('partial', 0):>5} {d.get('miss', 0):>5}"
+                         f" {d.get('error', 0):>4} {d.get('wins', 0):>5} {d.get('skipped', 0):>5}"
+                         f" {d['hit_rate'] * 100:>5.1f}% {d['mean_s']:>7.2f}"
+                         f" {self.percentile(s, 0.5):>6} {self.percentile(s, 0.9):>6}")
+        return "\n".join(lines)
+
+    def dump(self, path: str):
+        """Append this run's per-source stats as one JSON line."""
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "sources": self.to_dict()},
+                               ensure_ascii=False) + "\n")
+
+
+class Resolver:
+    def __init__(self, sources, min_quality: float = 0.6, merge: bool = False, timeout: float = 15.0,
+                 per_source: int = 2, host_limit: int = 1):
+        self.sources = [(src[0], src[1], src[2] if len(src) > 2 else src[0]) for src in sources]
+        self.min_quality = min_quality
+        self.merge = merge
+        self.timeout = timeout
+        self.per_source = max(1, per_source)
+        self.pools = {name: ThreadPoolExecutor(max_workers=self.per_source, thread_name_prefix=name)
+                      for name, _, _ in self.sources}
+        self.hosts = {host: threading.BoundedSemaphore(max(1, host_limit)) for _, _, host in self.sources}
+        self.lock = threading.RLock()  # a fast call's done-callback may run inside resolve()'s critical section
+        self.in_flight = Counter()  # source -> calls submitted and not finished (queued or running)
+        self.stats = SourceStats()
+
+    def _call(self, name: str, fetch, host: str, barcode: str, done: threading.Event, deadline: float):
+        slot = self.hosts[host]
+        while not slot.acquire(timeout=0.05):
+            if done.is_set() or time.monotonic() >= deadline:
+                self.stats.skip(name)  # answer chosen / timed out before the host was free
+                return None
+        t0 = time.perf_counter()
+        try:
+            data = fetch(barcode)
+        except Exception:
+            self.stats.record(name, time.perf_counter() - t0, "error", done.is_set())
+            return None
+        finally:
+            slot.release()
+        q = quality(data)
+        outcome = "good" if q >= self.min_quality else ("partial" if q > 0 else "miss")
+        self.stats.record(name, time.perf_counter() - t0, outcome, done.is_set())
+        return data if q > 0 else None
+
+    def _finished(self, name: str):
+        with self.lock:
+            self.in_flight[name] -= 1
+
+    def _submit(self, rank: int, name: str, fetch, host: str, barcode: str, done, deadline, futures):
+        self.in_flight[name] += 1  # caller holds self.lock
+        fut = self.pools[name].submit(self._call, name, fetch, host, barcode, done, deadline)
+        fut.add_done_callback(lambda f, name=name: self._finished(name))
+        futures[fut] = (rank, name)
+
+    def resolve(self, barcode: str) -> dict | None:
+        done = threading.Event()  # set once the answer is chosen; later finishers count as late
+        deadline = time.monotonic() + self.timeout
+        futures, busy = {}, []
+        with self.lock:
+            for rank, (name, fetch, host) in enumerate(self.sources):
+                if self.in_flight[name] >= self.per_source:
+                    busy.append((rank, name, fetch, host))  # every thread still on earlier barcodes
+                else:
+                    self._submit(rank, name, fetch, host, barcode, done, deadline, futures)
+            if not futures:
+                # everything is saturated: queue after all rather than answer nothing
+                for rank, name, fetch, host in busy:
+                    self._submit(rank, name, fetch, host, barcode, done, deadline, futures)
+                busy = []
+        for _, name, _, _ in busy:
+            self.stats.skip(name)
+        results = []  # (quality, -rank, name, data)
+        pending = set(futures)
+        while pending:
+            finished, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not finished:
+                break  # timeout: go with what we have
+            for fut in finished:
+                data = fut.result()
+                if data:
+                    rank, name = futures[fut]
+                    results.append((quality(data), -rank, name, data))
+            if not self.merge and any(q >= self.min_quality for q, *_ in results):
+                break
+        done.set()
+        for fut in pending:
+            fut.cancel()
+        if not results:
+            return None
+
+        results.sort(key=lambda r: (r[0], r[1]), reverse=True)
+        if not self.merge:
+            good = [r for r in results if r[0] >= self.min_quality]
+            # first good one to arrive; answers arriving together go by quality, then source order
+            _, _, name, data = good[0] if good else results[0]
+            self.stats.win(name)
+            return {**data, "source": name}
+
+        merged = {"source": results[0][2]}
+        self.stats.win(results[0][2])
+        for field in FIELDS:
+            for _, _, name, data in results:
+                if usable(field, data.get(field)):
+                    merged[field] = data[field]
+                    if name != merged["source"]:
+                        merged.setdefault("merged_from", {})[field] = name
+                    break
+            else:
+                merged[field] = None
+        return merged
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -52,10 +52,8 @@ def normalize_unit(val: str) -> str:
     key = s.lower()
     return UNIT_MAP.get(key, s)  # leave unknown values unchanged
 
-def main():
-    # read CSV as strings
-    df = pd.read_csv(INPUT, dtype=str, keep_default_na=False)
-
+def clean(df: pd.DataFrame) -> pd.DataFrame:
+    """Stage 0: rename 1C columns, add empty columns, normalize units, drop the bad row."""
     # rename columns
     df = df.rename(columns={
         "Номенклатура": "name",
@@ -81,6 +79,13 @@ def main():
         )
         df = df[~mask_remove].copy()
 
+    return df
+
+def main():
+    # read CSV as strings
+    df = pd.read_csv(INPUT, dtype=str, keep_default_na=False)
+    df = clean(df)
+
     # save
     df.to_csv(OUTPUT, index=False, encoding="utf-8-sig")
     print(f"[OK] Saved → {OUTPUT}")
@@ -3,12 +3,14 @@ CSV Cleaner to assign product categories.
 
 Steps:
 1. Reads data_0_1.csv into a DataFrame.
-2. Walks through rows:
-   - If the row is a category header (e.g. "Молочная продукция"), 
-     set current category = mapped enum from CATEGORY_MAP and mark
-     that row’s category as empty.
-   - Otherwise, assign the last seen category enum to the product.
-3. After all rows are processed, fills a new 'category' column.
+2. Column-wise category propagation:
+   - Marks category header rows (e.g. "Молочная продукция") with a mask
+     and maps them to their enum from CATEGORY_MAP.
+   - Forward-fills that enum down onto the product rows below; the
+     header rows' own category stays empty.
+3. Reports header-like rows that are not in CATEGORY_MAP (name only,
+   no barcode/productDesc/brand) — they are dropped, so new 1C groups
+   would otherwise vanish silently. Written to data_0_1_unknown_headers.csv.
 4. Drops pure category header rows (they have no barcode, productDesc, or brand).
    → Only product rows remain, each with its category filled.
 5. Writes cleaned data to data_0_2.csv (UTF-8 with BOM).
@@ -19,6 +21,7 @@ import pandas as pd
 
 INPUT = "data_0_1.csv"
 OUTPUT = "data_0_2.csv"
+UNKNOWN_OUTPUT = "data_0_1_unknown_headers.csv"
 
 # Mapping Russian category names → enum
 CATEGORY_MAP = {
@@ -56,29 +59,50 @@ CATEGORY_MAP = {
     "Мясо ,мясные продукты": "BAR_PACKAGED_FOOD",
 }
 
-def main():
-    df = pd.read_csv(INPUT, dtype=str).fillna("")
+def header_mask(df: pd.DataFrame) -> pd.Series:
+    """True for category header rows (name is a CATEGORY_MAP key)."""
+    return df["name"].astype(str).str.strip().isin(CATEGORY_MAP.keys())
+
+def product_mask(df: pd.DataFrame) -> pd.Series:
+    """True for rows that survive the header drop (have a barcode, productDesc or brand)."""
+    return df["barcode"].ne("") | df["productDesc"].ne("") | df["brand"].ne("")
+
+def find_unknown_headers(df: pd.DataFrame) -> pd.DataFrame:
+    """Header-like rows (name only, no barcode/productDesc/brand) that are not in CATEGORY_MAP.
 
-    current_cat = None
-    categories = []
+    They neither switch the current category nor survive the drop, so they
+    used to disappear silently (new 1C groups, products without a barcode).
+    """
+    unknown = ~header_mask(df) & ~product_mask(df) & df["name"].astype(str).str.strip().ne("")
+    return df[unknown]
 
-    for _, row in df.iterrows():
-        name = str(row["name"]).strip()
+def assign_categories(df: pd.DataFrame) -> pd.DataFrame:
+    """Stage 1: carry the last seen category header onto products, drop header rows."""
+    is_header = header_mask(df)
 
-        # Detect category rows (only category text, others empty)
-        if name in CATEGORY_MAP.keys():
-            current_cat = CATEGORY_MAP[name]
-            categories.append("")  # leave category rows themselves empty
-        else:
-            categories.append(current_cat)
+    unknown = find_unknown_headers(df)
+    if len(unknown):
+        names = ", ".join(repr(n) for n in unknown["name"].head(5))
+        print(f"[warn] {len(unknown)} header-like rows not in CATEGORY_MAP (dropped): {names}")
 
-    df["category"] = categories
+    # header rows carry their enum, products inherit the last one seen
+    cats = df["name"].astype(str).str.strip().map(CATEGORY_MAP).where(is_header).ffill()
+    df["category"] = cats.where(~is_header, "").fillna("")  # leave category rows themselves empty
 
     # Drop pure category rows (optional: if you want only products left)
-    df = df[df["barcode"].ne("") | df["productDesc"].ne("") | df["brand"].ne("")]
+    df = df[product_mask(df)]
+    return df
+
+def main():
+    df = pd.read_csv(INPUT, dtype=str).fillna("")
+    unknown = find_unknown_headers(df)
+    df = assign_categories(df)
 
     df.to_csv(OUTPUT, index=False, encoding="utf-8-sig")
     print(f"[OK] Wrote {OUTPUT}")
+    if len(unknown):
+        unknown.to_csv(UNKNOWN_OUTPUT, index_label="row_index", encoding="utf-8-sig")
+        print(f"[OK] Unknown header-like rows → {UNKNOWN_OUTPUT} ({len(unknown)} rows)")
 
 if __name__ == "__main__":
     main()
@@ -26,10 +26,18 @@ def clean_price(value: str) -> str:
         return f"{digits}.00"
     return ""
 
-if __name__ == "__main__":
-    df = pd.read_csv(INPUT, dtype=str, keep_default_na=False)
+def normalize_prices(df: pd.DataFrame) -> pd.DataFrame:
+    """Stage 2: salesPrice -> digits only + '.00'."""
     if "salesPrice" not in df.columns:
         raise ValueError("CSV must contain 'salesPrice' column.")
 
     df["salesPrice"] = df["salesPrice"].apply(clean_price)
+    return df
+
+def main():
+    df = pd.read_csv(INPUT, dtype=str, keep_default_na=False)
+    df = normalize_prices(df)
     df.to_csv(OUTPUT, index=False)
+
+if __name__ == "__main__":
+    main()
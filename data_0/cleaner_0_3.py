@@ -36,69 +36,96 @@ def extract_barcodes(raw: str):
     extras  = uniq[1:] if len(uniq) > 1 else []
     return primary, extras, uniq
 
-# --- load
-df = pd.read_csv(INPUT, dtype=str, keep_default_na=False)
-
-# Canonicalize expected columns (lightweight)
-rename_map = {}
-for col in df.columns:
-    low = col.lower()
-    if low == "name": rename_map[col] = "name"
-    if low in ("barcode", "barcodes"): rename_map[col] = "barcode"
-    if low in ("salesprice", "price"): rename_map[col] = "salesPrice"
-    if low in ("uom", "unit"): rename_map[col] = "uom"
-    if low in ("category", "cat"): rename_map[col] = "category"
-if rename_map:
-    df.rename(columns=rename_map, inplace=True)
-for need in ["name","barcode","uom","salesPrice","category"]:
-    if need not in df.columns: df[need] = ""
-
-# Trim all cells
-for c in df.columns:
-    df[c] = df[c].map(trim)
-
-# Prices
-df["salesPrice"] = df["salesPrice"].map(clean_price)
-
-# Barcodes
-prim, extras_col, invalid_len, dup_of = [], [], [], []
-seen_primary = {}
-
-for i, raw in enumerate(df["barcode"]):
-    primary, extras, all_codes = extract_barcodes(raw)
-    prim.append(primary)
-    extras_col.append(" ".join(extras))
-    invalid_len.append(" ".join([b for b in all_codes if len(b) not in VALID_BARCODE_LENGTHS]))
-    if primary and primary in seen_primary:
-        dup_of.append(str(seen_primary[primary]))
-    else:
-        dup_of.append("")
-        if primary:
-            seen_primary[primary] = i
-
-df["primaryBarcode"] = prim
-df["extraBarcodes"] = extras_col
-df["barcodeInvalidLengths"] = invalid_len
-df["duplicateOf"] = dup_of
-
-# Keep-first dedupe view (do NOT drop rows in issues.csv analysis)
-clean = df[df["duplicateOf"] == ""].copy()
-
-# Issues to review
+def split_barcodes(raw: pd.Series) -> pd.DataFrame:
+    """Column-wise extract_barcodes + duplicate detection.
+
+    Returns a positional frame with primaryBarcode, extraBarcodes,
+    barcodeInvalidLengths and duplicateOf (row position of the first row
+    with the same primary barcode).
+    """
+    n = len(raw)
+    # one split/explode for the whole column, index = row position
+    parts = (
+        pd.Series(raw.map(trim).to_numpy(), index=pd.RangeIndex(n))
+        .str.split(SPLIT)
+        .explode()
+        .str.replace(r"\D", "", regex=True)
+    )
+    parts = parts[parts.notna() & parts.ne("")]
+    # dedupe inside a row, order-preserving
+    codes = parts.to_frame("code").rename_axis("row").reset_index()
+    codes = codes[~codes.duplicated(["row", "code"])]
+    rank = codes.groupby("row").cumcount()
+
+    out = pd.DataFrame(index=pd.RangeIndex(n))
+    first = codes[rank.eq(0)].set_index("row")["code"]
+    out["primaryBarcode"] = first.reindex(out.index, fill_value="")
+    extras = codes[rank.gt(0)].groupby("row")["code"].agg(" ".join)
+    out["extraBarcodes"] = extras.reindex(out.index, fill_value="")
+    bad_len = codes[~codes["code"].str.len().isin(VALID_BARCODE_LENGTHS)]
+    out["barcodeInvalidLengths"] = bad_len.groupby("row")["code"].agg(" ".join).reindex(out.index, fill_value="")
+
+    # duplicateOf: position of the first row sharing this primary barcode
+    primary = out["primaryBarcode"]
+    is_dup = primary.ne("") & primary.duplicated()
+    first_pos = pd.Series(out.index, index=out.index).groupby(primary).transform("first")
+    out["duplicateOf"] = first_pos.astype(str).where(is_dup, "")
+    return out
+
 def is_zero_or_blank(price: str) -> bool:
     return (price == "") or (price == "0.00")
 
-issues = df[
-    (df["primaryBarcode"] == "") |
-    (df["barcodeInvalidLengths"] != "") |
-    (df["duplicateOf"] != "") |
-    (df["salesPrice"].map(is_zero_or_blank))
-].copy()
-
-# Order columns for convenience
-front = ["name","primaryBarcode","extraBarcodes","uom","salesPrice","category","duplicateOf","barcodeInvalidLengths"]
-rest = [c for c in clean.columns if c not in front]
-clean[front + rest].to_csv(OUTPUT, index=False)
-issues[front + rest].to_csv(ISSUES, index=False)
-
-print(f"Done. Wrote {OUTPUT} (rows: {len(clean)}) and {ISSUES} (rows: {len(issues)})")
+def audit_barcodes(df: pd.DataFrame):
+    """Split barcodes, flag duplicates/bad lengths. Returns (clean, issues) frames."""
+    # Canonicalize expected columns (lightweight)
+    rename_map = {}
+    for col in df.columns:
+        low = col.lower()
+        if low == "name": rename_map[col] = "name"
+        if low in ("barcode", "barcodes"): rename_map[col] = "barcode"
+        if low in ("salesprice", "price"): rename_map[col] = "salesPrice"
+        if low in ("uom", "unit"): rename_map[col] = "uom"
+        if low in ("category", "cat"): rename_map[col] = "category"
+    if rename_map:
+        df.rename(columns=rename_map, inplace=True)
+    for need in ["name","barcode","uom","salesPrice","category"]:
+        if need not in df.columns: df[need] = ""
+
+    # Trim all cells
+    for c in df.columns:
+        df[c] = df[c].map(trim)
+
+    # Prices
+    df["salesPrice"] = df["salesPrice"].map(clean_price)
+
+    # Barcodes (column-wise)
+    codes = split_barcodes(df["barcode"])
+    for c in codes.columns:
+        df[c] = codes[c].to_numpy()
+
+    # Keep-first dedupe view (do NOT drop rows in issues.csv analysis)
+    clean = df[df["duplicateOf"] == ""].copy()
+
+    # Issues to review
+    issues = df[
+        (df["primaryBarcode"] == "") |
+        (df["barcodeInvalidLengths"] != "") |
+        (df["duplicateOf"] != "") |
+        (df["salesPrice"].map(is_zero_or_blank))
+    ].copy()
+
+    # Order columns for convenience
+    front = ["name","primaryBarcode","extraBarcodes","uom","salesPrice","category","duplicateOf","barcodeInvalidLengths"]
+    rest = [c for c in clean.columns if c not in front]
+    return clean[front + rest], issues[front + rest]
+
+def main():
+    df = pd.read_csv(INPUT, dtype=str, keep_default_na=False)
+    clean, issues = audit_barcodes(df)
+    clean.to_csv(OUTPUT, index=False)
+    issues.to_csv(ISSUES, index=False)
+
+    print(f"Done. Wrote {OUTPUT} (rows: {len(clean)}) and {ISSUES} (rows: {len(issues)})")
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,43 @@ OUTER_QUOTES_RE     = re.compile(r'^[\s"“”«]+|[\s"“”»]+$')       # в
 DOUBLE_QUOTES_RE    = re.compile(r'""')                          # "" -> "
 SPACES_RE           = re.compile(r'\s+')
 
+# Единицы измерения: одна скомпилированная альтернатива + таблица замен.
+# rank = порядок правила в старой цепочке re.sub (г → кг → мл → л); нужен,
+# чтобы один проход давал ровно тот же результат, что и четыре прохода подряд.
+UNIT_TABLE = {
+    "гр": ("г", 1),  "г.": ("г", 1),  "g": ("г", 1),
+    "кг.": ("кг", 2), "kg": ("кг", 2),
+    "мл.": ("мл", 3), "ml": ("мл", 3),
+    "литр": ("л", 4), "л.": ("л", 4), "l": ("л", 4),
+}
+UNIT_RE             = re.compile(r'(?i)\b(?:гр|г\.|g|кг\.|kg|мл\.|ml|литр|л\.|l)\b')
+UNIT_SPACE_RE       = re.compile(r'(\d)(г|кг|мл|л)\b')           # 500г -> 500 г
+DASH_TABLE          = str.maketrans({'–': '-', '—': '-'})
+
+def _fix_units(s: str) -> str:
+    """Все четыре правила единиц за один проход.
+
+    Последовательные re.sub отличались в одном месте: если «г.»/«кг.»/… стоит
+    вплотную перед единицей из более позднего правила («г.kg»), удалённая точка
+    убирала границу слова, и позднее правило уже не срабатывало. Повторяем это.
+    """
+    out, pos = [], 0
+    glue_end, glue_rank = -1, 0
+    for m in UNIT_RE.finditer(s):
+        tok = m.group()
+        rep, rank = UNIT_TABLE[tok.lower()]
+        if m.start() == glue_end and rank > glue_rank:
+            glue_end = -1          # токен остаётся как есть (вместе со своей точкой)
+            continue
+        out.append(s[pos:m.start()])
+        out.append(rep)
+        pos = m.end()
+        glue_end, glue_rank = (pos, rank) if tok.endswith('.') else (-1, 0)
+    if not out:
+        return s
+    out.append(s[pos:])
+    return ''.join(out)
+
 def rb_fix(s: str) -> str:
     s = (s or "")
     # снять внешние кавычки и пробелы по краям
@@ -35,24 +72,202 @@ def rb_fix(s: str) -> str:
     # добавить пробел ПОСЛЕ % если дальше сразу идёт число/буква: "1,9%260 г" -> "1,9% 260 г"
     s = PERCENT_AFTER_RE.sub('% ', s)
 
-    # единицы измерения (без регистра)
-    s = re.sub(r'(?i)\b(гр|г\.|g)\b', 'г', s)
-    s = re.sub(r'(?i)\b(кг\.|kg)\b', 'кг', s)
-    s = re.sub(r'(?i)\b(мл\.|ml)\b', 'мл', s)
-    s = re.sub(r'(?i)\b(литр|л\.|l)\b', 'л', s)
+    # единицы измерения (без регистра), один проход
+    s = _fix_units(s)
 
     # пробел между числом и единицей: 500г -> 500 г; 1л -> 1 л
-    s = re.sub(r'(\d)(г|кг|мл|л)\b', r'\1 \2', s)
+    s = UNIT_SPACE_RE.sub(r'\1 \2', s)
 
     # унификация тире и финальный обрез
-    s = s.replace('–', '-').replace('—', '-').strip()
+    s = s.translate(DASH_TABLE).strip()
     return s
 
+def rb_fix_column(names: pd.Series) -> pd.Series:
+    """rb_fix для всей колонки: чистим только уникальные имена и раскладываем обратно."""
+    names = names.fillna("").astype(str)
+    uniq = names.unique()
+    fixed = dict(zip(uniq, map(rb_fix, uniq)))
+    return names.map(fixed)
+
+# --- Смешение кириллицы и латиницы (гомоглифы) ---
+# Пары букв, которые выглядят одинаково. Строчные м/т/н/в не похожи на m/t/h/b — их нет.
+_HOMOGLYPHS = [
+    ("А", "A"), ("В", "B"), ("Е", "E"), ("К", "K"), ("М", "M"), ("Н", "H"), ("О", "O"), ("Р", "P"),
+    ("С", "C"), ("Т", "T"), ("Х", "X"), ("У", "Y"),
+    ("а", "a"), ("е", "e"), ("о", "o"), ("р", "p"), ("с", "c"), ("у", "y"), ("х", "x"),
+]
+# к/k, г/r, п/n, һ/h — не точные двойники, но так набираются типичные опечатки («Макfa», «neченье», «Ваһгomа»).
+# Их пробуем, только если точных пар не хватило: иначе «cаrе» превращается в «саге».
+_INEXACT = [("к", "k"), ("г", "r"), ("п", "n"), ("һ", "h")]
+CYR2LAT = str.maketrans({c: l for c, l in _HOMOGLYPHS})
+LAT2CYR = str.maketrans({l: c for c, l in _HOMOGLYPHS})
+CYR2LAT_LOOSE = str.maketrans({c: l for c, l in _HOMOGLYPHS + _INEXACT})
+LAT2CYR_LOOSE = str.maketrans({l: c for c, l in _HOMOGLYPHS + _INEXACT})
+
+CYR_RE   = re.compile(r'[а-яёА-ЯЁәіңғүұқөһӘІҢҒҮҰҚӨҺ]')
+LAT_RE   = re.compile(r'[a-zA-Z]')
+LETTERS_RE = re.compile(r'[^\W\d_]+')
+# Кандидат: где-то в строке кириллица вплотную к латинице (в смешанном слове это обязательно есть)
+MIXED_RE = re.compile(r'[а-яёА-ЯЁәіңғүұқөһӘІҢҒҮҰҚӨҺ][a-zA-Z]|[a-zA-Z][а-яёА-ЯЁәіңғүұқөһӘІҢҒҮҰҚӨҺ]')
+# Места разреза склеенных слов: смена алфавита между кусками от 3 букв («ВиноAlto», «FELIXапетитные»)
+SCRIPT_SPLIT_RE = re.compile(
+    r'(?<=[а-яёА-ЯЁәіңғүұқөһӘІҢҒҮҰҚӨҺ]{3})(?=[a-zA-Z]{3})|(?<=[a-zA-Z]{3})(?=[а-яёА-ЯЁәіңғүұқөһӘІҢҒҮҰҚӨҺ]{3})'
+)
+# Заглавная буква другого алфавита после строчной — тоже начало нового слова («грChocolate», «капсTide»)
+CASE_SPLIT_RE = re.compile(r'(?<=[а-яёәіңғүұқөһ])(?=[A-Z])|(?<=[a-z])(?=[А-ЯЁӘІҢҒҮҰҚӨҺ])')
+# Приклеенная единица измерения перед латинским словом («грchocolate», «млcola»)
+UNIT_GLUE_RE = re.compile(r'^(?:гр|кг|мл|г|л)(?=[a-zA-Z]{3})')
+UNIT_WORDS = {"г", "гр", "кг", "мл", "л", "шт"}
+CAMEL_SPLIT_RE  = re.compile(r'(?<=[^\W\d_])(?=[A-ZА-ЯЁ][^\W\d_])(?<![A-ZА-ЯЁ])')
+
+def _translit(tok: str, cyr: int, lat: int, to_cyr, to_lat) -> str | None:
+    as_cyr = tok.translate(to_cyr)
+    as_lat = tok.translate(to_lat)
+    ok_cyr = not LAT_RE.search(as_cyr)
+    ok_lat = not CYR_RE.search(as_lat)
+    if ok_cyr and ok_lat:
+        # оба варианта возможны: решает большинство букв (равенство разобрано в _to_one_script)
+        return as_cyr if cyr > lat else as_lat
+    if ok_cyr:
+        return as_cyr
+    if ok_lat:
+        return as_lat
+    return None
+
+def _to_one_script(tok: str, prefer_cyr: bool | None, loose: bool = True) -> str | None:
+    """Смешанное слово → одно письмо через таблицы гомоглифов; None, если так не выходит.
+
+    Сначала только точные двойники, неточные пары (к/k, г/r, п/n, һ/h) — запасной вариант (loose).
+    Поровну букв и возможны оба алфавита («Caге», «cаrе»): решает алфавит соседнего слова
+    (prefer_cyr), без соседей слово не исправляется.
+    """
+    cyr, lat = len(CYR_RE.findall(tok)), len(LAT_RE.findall(tok))
+    if not (cyr and lat):
+        return tok
+    if tok.translate(LAT2CYR_LOOSE).lower() in UNIT_WORDS:
+        return tok.translate(LAT2CYR_LOOSE)   # «50rр» → «50гр»
+    if cyr == lat:
+        as_cyr, as_lat = tok.translate(LAT2CYR_LOOSE), tok.translate(CYR2LAT_LOOSE)
+        if not LAT_RE.search(as_cyr) and not CYR_RE.search(as_lat):
+            if not loose or prefer_cyr is None:
+                return None
+            return as_cyr if prefer_cyr else as_lat
+    fixed = _translit(tok, cyr, lat, LAT2CYR, CYR2LAT)
+    if fixed is None and loose:
+        fixed = _translit(tok, cyr, lat, LAT2CYR_LOOSE, CYR2LAT_LOOSE)
+    return fixed
+
+def _split_words(tok: str) -> list[str]:
+    """Склейка слов разных алфавитов → куски: по смене алфавита между кусками от 3 букв,
+    по заглавной букве другого алфавита и после приклеенной единицы измерения."""
+    pieces = []
+    for piece in SCRIPT_SPLIT_RE.split(tok):
+        for sub in CASE_SPLIT_RE.split(piece):
+            m = UNIT_GLUE_RE.match(sub)
+            pieces += [m.group(), sub[m.end():]] if m else [sub]
+    return pieces
+
+def _fix_token(tok: str, prefer_cyr: bool | None) -> str | None:
+    # целиком — только точными двойниками («Mexико»); неточные пары — лишь после разреза склейки,
+    # иначе настоящее слово из 3+ букв переводится в чужой алфавит («капсTIDE» → «kancTIDE»)
+    fixed = _to_one_script(tok, prefer_cyr, loose=False)
+    if fixed is not None:
+        return fixed
+    parts = []
+    for piece in _split_words(tok):
+        out = _to_one_script(piece, prefer_cyr)
+        if out is None:
+            # ещё смешано: режем по заглавной букве
+            subs = [_to_one_script(p, prefer_cyr) for p in CAMEL_SPLIT_RE.split(piece)]
+            if None in subs:
+                return None
+            out = " ".join(subs)
+        parts.append(out)
+    return " ".join(parts)
+
+def _script(word: str) -> bool | None:
+    """True — только кириллица, False — только латиница, None — смешанное слово."""
+    cyr, lat = CYR_RE.search(word), LAT_RE.search(word)
+    return None if (cyr and lat) or not (cyr or lat) else bool(cyr)
+
+def _neighbour_cyr(scripts, k) -> bool | None:
+    """Алфавит ближайшего однородного слова: сначала слева, потом справа; None, если такого нет."""
+    for j in [*range(k - 1, -1, -1), *range(k + 1, len(scripts))]:
+        if scripts[j] is not None:
+            return scripts[j]
+    return None
+
+def fix_mixed_script(s: str):
+    """→ (исправленная строка, [(слово, замена или None если не исправить)])."""
+    words = list(LETTERS_RE.finditer(s))
+    scripts = [_script(m.group()) for m in words]
+    found, out, pos = [], [], 0
+    for k, m in enumerate(words):
+        tok = m.group()
+        if not MIXED_RE.search(tok):
+            continue
+        fixed = _fix_token(tok, _neighbour_cyr(scripts, k))
+        found.append((tok, fixed))
+        out += [s[pos:m.start()], tok if fixed is None else fixed]
+        pos = m.end()
+    return "".join(out) + s[pos:], found
+
+def fix_homoglyphs(df: pd.DataFrame, columns=("name", "brand")):
+    """Чинит смешанные кириллица/латиница слова в колонках. Возвращает (df, отчёт).
+
+    Отбор кандидатов векторный (str.contains по уникальным значениям),
+    разбираются только строки со смешанными словами. В отчёте status=fixed
+    для исправленных и flagged для слов, которые таблицами не исправить.
+    """
+    report = []
+    for col in columns:
+        if col not in df.columns:
+            continue
+        before = df[col].fillna("").astype(str)
+        uniq = pd.Series(before.unique())
+        cand = uniq[uniq.str.contains(MIXED_RE)]
+        results = {v: fix_mixed_script(v) for v in cand}
+        if not results:
+            continue
+        df[col] = before.map({v: r[0] for v, r in results.items()}).fillna(before)
+        hit = before.isin(list(results)).to_numpy().nonzero()[0]
+        for i in hit:
+            old = before.iat[i]
+            new, found = results[old]
+            report.append({
+                "row_index": int(i),
+                "column": col,
+                "old_value": old,
+                "new_value": new,
+                "tokens": "; ".join(f"{t}→{f}" if f is not None else f"{t}→?" for t, f in found),
+                "status": "fixed" if new != old else "flagged",
+            })
+    return df, report
+
+HOMOGLYPH_COLS = ["row_index", "column", "old_value", "new_value", "tokens", "status"]
+
+def write_homoglyph_report(report, path):
+    pd.DataFrame(report, columns=HOMOGLYPH_COLS).to_csv(path, index=False)
+    fixed = sum(r["status"] == "fixed" for r in report)
+    print(f"[ok] homoglyphs: {path} ({fixed} values fixed, {len(report) - fixed} flagged)")
+
+def fix_names(df: pd.DataFrame):
+    """Применяет rb_fix к `name`. Возвращает (df, список изменений для отчёта)."""
+    before = df["name"].fillna("").astype(str)
+    after  = rb_fix_column(before)
+    df["name"] = after
+
+    diff = (before != after).to_numpy().nonzero()[0]
+    changed = [{"row_index": int(i), "old_name": before.iat[i], "new_name": after.iat[i]} for i in diff]
+    return df, changed
+
 def build_cli():
     p = argparse.ArgumentParser(description="Cleaner: нормализует поле 'name' (пробелы, %, единицы, кавычки).")
     p.add_argument("-i", "--input",  default="data_0_3.csv", help="Входной CSV (по умолчанию data_1_0.csv)")
     p.add_argument("-o", "--output", default="data_0_4.csv",          help="Выходной CSV (по умолчанию <input>.cleaned.csv)")
     p.add_argument("-r", "--report", default="data_0_3_changes.csv",          help="CSV-отчёт изменений (по умолчанию <input>.cleaned.changes.csv)")
+    p.add_argument("--homoglyph-report", default="data_0_3_homoglyphs.csv", help="CSV-отчёт по смешанным кириллица/латиница словам")
+    p.add_argument("--no-homoglyphs", action="store_true",  help="Не чинить смешанные кириллица/латиница слова")
     p.add_argument("--inplace", action="store_true",        help="Перезаписать входной файл")
     return p
 
@@ -71,16 +286,17 @@ def main():
     if "name" not in df.columns:
         print("[error] CSV не содержит столбца 'name'", file=sys.stderr); sys.exit(2)
 
-    before = df["name"].tolist()
-    df["name"] = df["name"].map(rb_fix)
-    after  = df["name"].tolist()
-
-    changed = [{"row_index": i, "old_name": o, "new_name": n} for i,(o,n) in enumerate(zip(before, after)) if o != n]
+    glyphs = None
+    if not args.no_homoglyphs:
+        df, glyphs = fix_homoglyphs(df)
+    df, changed = fix_names(df)
 
     df.to_csv(out_path, index=False)
     pd.DataFrame(changed).to_csv(rep_path, index=False)
     print(f"[ok] cleaned: {out_path}")
     print(f"[ok] changes: {rep_path} ({len(changed)} rows changed)")
+    if glyphs is not None:
+        write_homoglyph_report(glyphs, args.homoglyph_report)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,120 @@
+"""
+Fused data_0 pipeline: runs the whole cleaner chain in memory.
+
+Instead of every cleaner re-reading and re-writing a CSV, the raw 1C export
+is parsed once, passed through the stage functions in order and written once:
+
+    cleaner_0_0.clean              data_0_0.csv -> data_0_1.csv
+    cleaner_0_1.assign_categories  data_0_1.csv -> data_0_2.csv
+    cleaner_0_2.normalize_prices   data_0_2.csv -> data_0_3.csv
+    cleaner_0_4.fix_homoglyphs     data_0_3.csv -> (data_0_3_homoglyphs.csv)
+    cleaner_0_4.fix_names          data_0_3.csv -> data_0_4.csv (+ data_0_3_changes.csv)
+    cleaner_0_3.audit_barcodes     data_0_3.csv -> cleaned.csv + issues.csv
+
+The barcode audit branches off the data_0_3 frame, exactly as the standalone
+scripts do, so every output is byte-identical to running the chain by hand.
+Intermediate CSVs (data_0_1 … data_0_3) are only written with --dump-intermediate,
+each with the encoding its original script used.
+
+Usage (from the data_0 folder):
+    python pipeline_0.py
+    python pipeline_0.py --dump-intermediate
+    python pipeline_0.py --no-audit
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+import pandas as pd
+
+import cleaner_0_0
+import cleaner_0_1
+import cleaner_0_2
+import cleaner_0_3
+import cleaner_0_4
+
+# (stage name, step function, intermediate artifact, encoding of that artifact)
+STAGES = [
+    ("clean",      cleaner_0_0.clean,             "data_0_1.csv", "utf-8-sig"),
+    ("categories", cleaner_0_1.assign_categories, "data_0_2.csv", "utf-8-sig"),
+    ("prices",     cleaner_0_2.normalize_prices,  "data_0_3.csv", "utf-8"),
+]
+
+def run_stages(df: pd.DataFrame, dump_dir: Path | None = None, verbose: bool = True) -> pd.DataFrame:
+    """Apply STAGES in order; optionally dump each stage's artifact into dump_dir."""
+    for name, step, artifact, encoding in STAGES:
+        t0 = time.time()
+        # fillna/reset_index stand in for the CSV round-trip between scripts
+        df = step(df).fillna("").reset_index(drop=True)
+        if dump_dir is not None:
+            df.to_csv(dump_dir / artifact, index=False, encoding=encoding)
+        if verbose:
+            print(f"[stage] {name}: {len(df)} rows in {time.time() - t0:.2f}s")
+    return df
+
+def build_cli():
+    p = argparse.ArgumentParser(description="Run cleaner_0_0 … cleaner_0_4 in one pass (single read, single write).")
+    p.add_argument("-i", "--input",   default=cleaner_0_0.INPUT,  help="Raw 1C export (default: data_0_0.csv)")
+    p.add_argument("-o", "--output",  default="data_0_4.csv",     help="Cleaned output CSV (default: data_0_4.csv)")
+    p.add_argument("-r", "--report",  default="data_0_3_changes.csv", help="Name-change report CSV")
+    p.add_argument("--homoglyph-report", default="data_0_3_homoglyphs.csv", help="Mixed Cyrillic/Latin word report CSV")
+    p.add_argument("--no-homoglyphs", action="store_true",        help="Skip the mixed-script repair")
+    p.add_argument("--cleaned",       default=cleaner_0_3.OUTPUT, help="Deduplicated barcode view (default: cleaned.csv)")
+    p.add_argument("--issues",        default=cleaner_0_3.ISSUES, help="Rows to review (default: issues.csv)")
+    p.add_argument("--no-audit", action="store_true",             help="Skip the barcode audit (cleaned.csv / issues.csv)")
+    p.add_argument("--dump-intermediate", action="store_true",    help="Also write data_0_1.csv … data_0_3.csv")
+    p.add_argument("--dump-dir",      default=".",                help="Where to write intermediate CSVs (default: .)")
+    return p
+
+def main():
+    args = build_cli().parse_args()
+    in_path = Path(args.input)
+    if not in_path.exists():
+        print(f"[error] input not found: {in_path}", file=sys.stderr); sys.exit(1)
+
+    dump_dir = None
+    if args.dump_intermediate:
+        dump_dir = Path(args.dump_dir)
+        dump_dir.mkdir(parents=True, exist_ok=True)
+
+    t_start = time.time()
+    # single read — everything below works on in-memory frames
+    df = pd.read_csv(in_path, dtype=str, keep_default_na=False)
+    print(f"[info] Loaded {len(df)} rows from {in_path}")
+
+    df = run_stages(df, dump_dir)
+
+    # barcode audit branches off the data_0_3 frame (cleaner_0_3 input)
+    audit = None
+    if not args.no_audit:
+        audit = cleaner_0_3.audit_barcodes(df.copy())
+
+    glyphs = None
+    if not args.no_homoglyphs:
+        t0 = time.time()
+        df, glyphs = cleaner_0_4.fix_homoglyphs(df)
+        print(f"[stage] homoglyphs: {len(glyphs)} values in {time.time() - t0:.2f}s")
+
+    t0 = time.time()
+    df, changed = cleaner_0_4.fix_names(df)
+    print(f"[stage] names: {len(changed)} rows changed in {time.time() - t0:.2f}s")
+
+    # single write of the final artifacts
+    df.to_csv(args.output, index=False)
+    pd.DataFrame(changed).to_csv(args.report, index=False)
+    print(f"[ok] cleaned: {args.output}")
+    print(f"[ok] changes: {args.report} ({len(changed)} rows changed)")
+    if glyphs is not None:
+        cleaner_0_4.write_homoglyph_report(glyphs, args.homoglyph_report)
+    if audit is not None:
+        clean, issues = audit
+        clean.to_csv(args.cleaned, index=False)
+        issues.to_csv(args.issues, index=False)
+        print(f"[ok] audit: {args.cleaned} (rows: {len(clean)}) and {args.issues} (rows: {len(issues)})")
+    if dump_dir is not None:
+        print(f"[ok] intermediates: {', '.join(str(dump_dir / a) for _, _, a, _ in STAGES)}")
+    print(f"[ok] total {time.time() - t_start:.2f}s")
+
+if __name__ == "__main__":
+    main()
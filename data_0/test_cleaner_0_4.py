@@ -0,0 +1,30 @@
+# test_cleaner_0_4.py — смешанные кириллица/латиница: python -m pytest -q test_cleaner_0_4.py
+import pytest
+
+from cleaner_0_4 import fix_mixed_script
+
+CASES = [
+    # склейка двух слов: режем, настоящие слова не переводим
+    ("Жидк капсTIDE Авт", "Жидк капс TIDE Авт"),
+    ("Kanky 35грChocolate Bar", "Kanky 35гр Chocolate Bar"),
+    ("ВиноAlto", "Вино Alto"),
+    ("FELIXапетитные", "FELIX апетитные"),
+    ("HeinzТерияки", "Heinz Терияки"),
+    # точные двойники важнее неточных пар
+    ("Мыло туалетное Econom cаrе 150гр", "Мыло туалетное Econom care 150гр"),
+    ("Сэндвич Mexико", "Сэндвич Мехико"),
+    ("NeutroPower 50rр", "NeutroPower 50гр"),
+    # поровну букв, возможны оба алфавита: решает соседнее слово, без соседей — не трогаем
+    ("Влажная салфеткаTM Econom Caге(120шт)", "Влажная салфеткаТМ Econom Care(120шт)"),
+    ("Ватные диски ТM Cotto", "Ватные диски ТМ Cotto"),
+    ("Caге", "Caге"),
+    # типичные опечатки через неточные пары
+    ("Макароны Макfa", "Макароны Makfa"),
+    ("Печенье neченье", "Печенье печенье"),
+    ("Ваһгomа", "Bahroma"),
+]
+
+
+@pytest.mark.parametrize("raw, expected", CASES)
+def test_fix_mixed_script(raw, expected):
+    assert fix_mixed_script(raw)[0] == expected
@@ -0,0 +1,124 @@
+# batcher.py
+"""
+Adaptive, token-aware batch sizing for modifier_1_0.
+
+Rows are packed by estimated tokens, not by a fixed count:
+- a batch stops growing at `size` rows (the adaptive limit), or when its
+  estimated payload input tokens / model output tokens would exceed the budgets;
+- `size` grows additively while latency stays under target and recent calls
+  succeed, halves on timeouts / truncated JSON, and backs off a little on
+  other errors (AIMD, like TCP congestion control).
+
+Token estimates start from a chars-per-token heuristic and are corrected from
+the `usage` block of every real response. Every API call is appended to a
+stats CSV (rows, tokens, tokens/row, latency, outcome, size after) so the
+chosen size can be inspected after the run.
+"""
+
+import csv
+import os
+import time
+from collections import deque
+
+STATS_COLUMNS = ["ts", "batch", "rows", "payload_chars", "prompt_tokens", "completion_tokens",
+                 "tokens_per_row", "latency_s", "outcome", "size_after"]
+
+
+class AdaptiveBatcher:
+    def __init__(self, start: int, min_rows: int, max_rows: int,
+                 max_input_tokens: int, max_output_tokens: int,
+                 target_latency: float, prompt_chars: int, stats_path=None):
+        self.min_rows = max(1, min_rows)
+        self.max_rows = max(self.min_rows, max_rows)
+        self.size = min(max(start, self.min_rows), self.max_rows)
+        self.max_input_tokens = max_input_tokens
+        self.max_output_tokens = max_output_tokens
+        self.target_latency = target_latency
+        self.prompt_chars = prompt_chars
+        self.chars_per_token = 3.0        # Cyrillic JSON, corrected from usage
+        self.out_tokens_per_row = 60.0    # one NormalizedRow object, corrected from usage
+        self.recent = deque(maxlen=20)    # True = ok, False = error
+        self.calls = 0
+        self.ok_calls = 0
+        self.total_rows = 0
+        self.total_tokens = 0
+        self.total_latency = 0.0
+        self.stats_path = stats_path
+        self._stats = None
+        if stats_path:
+            new = not os.path.exists(stats_path)
+            self._stats = open(stats_path, "a", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._stats)
+            if new:
+                self._writer.writerow(STATS_COLUMNS)
+
+    # ---- packing ----
+    def row_tokens(self, chars: int):
+        """(input, output) token estimate for one row of `chars` payload characters."""
+        return chars / self.chars_per_token, self.out_tokens_per_row
+
+    def take(self, pending: deque, row_chars) -> list:
+        """Pop the next batch of row ids from `pending`; row_chars(i) -> payload chars of row i."""
+        batch, tin, tout = [], 0.0, 0.0
+        while pending and len(batch) < self.size:
+            rin, rout = self.row_tokens(row_chars(pending[0]))
+            if batch and (tin + rin > self.max_input_tokens or tout + rout > self.max_output_tokens):
+                break
+            batch.append(pending.popleft())
+            tin += rin
+            tout += rout
+        return batch
+
+    # ---- feedback ----
+    def error_rate(self) -> float:
+        return (self.recent.count(False) / len(self.recent)) if self.recent else 0.0
+
+    def record(self, bi, rows: int, payload_chars: int, latency: float,
+               usage: dict | None = None, error: str | None = None):
+        """Feed back one API call. error: None | 'timeout' | 'truncated' | 'throttled' | 'error'."""
+        self.calls += 1
+        if error != "throttled":  # a 429 says nothing about the batch size
+            self.recent.append(error is None)
+        prompt_tokens = completion_tokens = None
+        if error is None:
+            if usage:
+                prompt_tokens = usage.get("prompt_tokens")
+                completion_tokens = usage.get("completion_tokens")
+                if prompt_tokens:
+                    observed = (self.prompt_chars + payload_chars) / prompt_tokens
+                    self.chars_per_token = 0.8 * self.chars_per_token + 0.2 * observed
+                if completion_tokens and rows:
+                    self.out_tokens_per_row = 0.8 * self.out_tokens_per_row + 0.2 * (completion_tokens / rows)
+                self.total_tokens += (prompt_tokens or 0) + (completion_tokens or 0)
+            self.ok_calls += 1
+            self.total_rows += rows
+            self.total_latency += latency
+            if latency < self.target_latency and self.error_rate() < 0.05 and rows >= self.size:
+                self.size = min(self.max_rows, self.size + max(1, self.size // 5))
+            elif latency > self.target_latency * 1.5:
+                self.size = max(self.min_rows, int(self.size * 0.8))
+        elif error == "throttled":
+            pass
+        elif error in ("timeout", "truncated"):
+            self.size = max(self.min_rows, min(self.size, rows // 2))
+        else:
+            self.size = max(self.min_rows, int(self.size * 0.8))
+
+        if self._stats:
+            total = (prompt_tokens or 0) + (completion_tokens or 0)
+            self._writer.writerow([
+                f"{time.time():.3f}", bi, rows, payload_chars, prompt_tokens or "", completion_tokens or "",
+                f"{total / rows:.1f}" if total and rows else "", f"{latency:.2f}", error or "ok", self.size,
+            ])
+            self._stats.flush()
+
+    def summary(self) -> str:
+        per_row = (self.total_tokens / self.total_rows) if self.total_rows else 0.0
+        avg_lat = (self.total_latency / self.ok_calls) if self.ok_calls else 0.0
+        return (f"batcher: final size={self.size}, calls={self.calls}, "
+                f"tokens/row={per_row:.1f}, avg latency={avg_lat:.1f}s, error rate={self.error_rate():.0%}")
+
+    def close(self):
+        if self._stats:
+            self._stats.close()
+            self._stats = None
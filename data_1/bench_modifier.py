@@ -0,0 +1,261 @@
+# bench_modifier.py
+"""
+Load benchmark for modifier_1_0 / run_parallel against the local stand-in
+server (fake_openai.py), so concurrency and batching changes can be compared
+against a reproducible baseline without paid calls.
+
+Every scenario runs in a fresh scratch copy of data_1 (scripts + the first
+--rows rows of data_1_0.csv; rows past the end of the file are repeated with
+a " #k" suffix so they stay distinct names), with the response cache,
+journal and translation memory off, and the SDK's own retries off
+(OPENAI_MAX_RETRIES=0). The stand-in server runs in this process
+with a fixed seed. Reported per scenario:
+- rows/s over the whole run (process start → outputs written);
+- p50/p99 batch latency and the outcome mix, from the batch stats CSVs
+  (one line per API call, needs ADAPTIVE_BATCH=1, the default);
+- peak RSS of the largest process and of the whole process tree (sampled
+  from /proc every 50 ms; Linux only);
+- server counters (requests, 429s, 500s, truncated, malformed).
+Results are appended to --results as JSON lines.
+
+Usage (from the data_1 folder):
+    python bench_modifier.py --rows 3000 --modes single,async,parallel
+    python bench_modifier.py --modes async --env CONCURRENCY=8 --latency lognormal:0.8:0.4 --rate-429 0.02
+    python bench_modifier.py --modes parallel --workers 5 --truncate-rate 0.05 --max-rows 40
+"""
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+import pandas as pd
+
+import fake_openai
+
+HERE = Path(__file__).resolve().parent
+INPUT_NAME = "data_1_0.csv"
+OTHER_DIR = HERE.parent / "Other"
+
+# Scenario env on top of the caller's: isolate the run from caches and earlier reports
+BENCH_ENV = {
+    "OPENAI_API_KEY": "bench",
+    "CACHE_PATH": "",
+    "JOURNAL_PATH": "",
+    "TRANSLATION_MEMORY": "0",
+    "OPENAI_MAX_RETRIES": "0",  # every retry goes through modifier_1_0's loop, so the batch stats count it
+    "BRAND_SOURCES": ",".join(str(OTHER_DIR / f) for f in (
+        "barcodes_enriched.csv", "barcodes_enriched_2_old.csv", "manual_extractions_1.csv")),
+    "PYTHONUNBUFFERED": "1",
+}
+
+
+def prepare_workdir(rows: int) -> Path:
+    work = Path(tempfile.mkdtemp(prefix="bench_modifier_"))
+    for py in HERE.glob("*.py"):
+        shutil.copy2(py, work / py.name)
+    with open(HERE / INPUT_NAME, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        source = list(reader)
+    name_col = header.index("name")
+    with open(work / INPUT_NAME, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(header)
+        for n in range(rows):
+            row = list(source[n % len(source)])
+            if n >= len(source):
+                row[name_col] = f"{row[name_col]} #{n // len(source)}"
+            w.writerow(row)
+    return work
+
+
+def _tree_rss(root_pid: int):
+    """(largest process RSS, sum over the tree) in bytes, from /proc."""
+    children = {}
+    rss = {}
+    for d in os.listdir("/proc"):
+        if not d.isdigit():
+            continue
+        try:
+            with open(f"/proc/{d}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            with open(f"/proc/{d}/statm") as f:
+                rss[int(d)] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(d))
+    stack, top, total = [root_pid], 0, 0
+    while stack:
+        pid = stack.pop()
+        top, total = max(top, rss.get(pid, 0)), total + rss.get(pid, 0)
+        stack.extend(children.get(pid, ()))
+    return top, total
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid: int, every: float = 0.05):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.every = every
+        self.peak_process = 0
+        self.peak_tree = 0
+        self.done = threading.Event()
+
+    def run(self):
+        if not os.path.isdir("/proc"):
+            return
+        while not self.done.is_set():
+            top, total = _tree_rss(self.pid)
+            self.peak_process = max(self.peak_process, top)
+            self.peak_tree = max(self.peak_tree, total)
+            self.done.wait(self.every)
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def read_batch_stats(work: Path):
+    """(latencies of successful calls, Counter of outcomes) over all batch stats CSVs of the run."""
+    lat, outcomes = [], Counter()
+    for path in work.rglob("*.batch_stats.csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                outcomes[row["outcome"]] += 1
+                if row["outcome"] == "ok":
+                    lat.append(float(row["latency_s"]))
+    return lat, outcomes
+
+
+def count_rows(path: Path) -> int:
+    if not path.exists():
+        return -1
+    return len(pd.read_csv(path, dtype=str))
+
+
+def run_scenario(mode: str, args, server_url: str, fake) -> dict:
+    work = prepare_workdir(args.rows)
+    extra = dict(kv.split("=", 1) for kv in args.env)
+    env = dict(os.environ, **BENCH_ENV, OPENAI_BASE_URL=server_url, **extra)
+    if mode == "single":
+        env["CONCURRENCY"] = "1"
+        cmd, output = [sys.executable, "modifier_1_0.py"], work / "data_1_1.csv"
+    elif mode == "async":
+        env["CONCURRENCY"] = extra.get("CONCURRENCY", str(args.concurrency))
+        cmd, output = [sys.executable, "modifier_1_0.py"], work / "data_1_1.csv"
+    elif mode == "parallel":
+        cmd, output = [sys.executable, "run_parallel.py", "--workers", str(args.workers)], work / "data_1_1.merged.csv"
+    else:
+        raise ValueError(f"unknown mode: {mode}")
+
+    before = Counter(fake.stats)
+    log_path = work / "bench.log"
+    t0 = time.time()
+    with open(log_path, "w", encoding="utf-8") as log:
+        p = subprocess.Popen(cmd, cwd=work, env=env, stdout=log, stderr=subprocess.STDOUT)
+        sampler = RssSampler(p.pid)
+        sampler.start()
+        try:
+            rc = p.wait(timeout=args.timeout)
+        except subprocess.TimeoutExpired:
+            p.kill()
+            rc = p.wait()
+        sampler.done.set()
+        sampler.join()
+    wall = time.time() - t0
+
+    lat, outcomes = read_batch_stats(work)
+    server = Counter(fake.stats)
+    server.subtract(before)
+    rows_out = count_rows(output)
+    result = {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "mode": mode,
+        "rows": args.rows,
+        "rows_out": rows_out,
+        "exit_code": rc,
+        "wall_s": round(wall, 2),
+        "rows_per_s": round(args.rows / wall, 1) if wall > 0 else 0.0,
+        "batch_p50_s": round(percentile(lat, 0.50), 3),
+        "batch_p99_s": round(percentile(lat, 0.99), 3),
+        "api_calls": sum(outcomes.values()),
+        "outcomes": dict(outcomes),
+        "peak_rss_process_mb": round(sampler.peak_process / 2**20, 1),
+        "peak_rss_tree_mb": round(sampler.peak_tree / 2**20, 1),
+        "server": {k: v for k, v in server.items() if v},
+        "workers": args.workers if mode == "parallel" else 1,
+        "concurrency": int(env.get("CONCURRENCY", "1")) if mode != "parallel" else None,
+        "env": extra,
+        "fake": {k: getattr(args, k) for k in ("latency", "per_row_latency", "error_rate", "rate_429", "rpm",
+                                               "truncate_rate", "max_rows", "malformed_rate", "seed")},
+        "workdir": str(work) if args.keep else None,
+    }
+    if rc != 0 or rows_out != args.rows:
+        print(f"[warn] {mode}: exit code {rc}, {rows_out} output rows of {args.rows} — see {log_path}")
+        args.keep = True
+        result["workdir"] = str(work)
+    if not args.keep:
+        shutil.rmtree(work, ignore_errors=True)
+    return result
+
+
+def print_table(results):
+    cols = [("mode", 9), ("rows_per_s", 10), ("wall_s", 8), ("batch_p50_s", 11), ("batch_p99_s", 11),
+            ("api_calls", 9), ("peak_rss_process_mb", 19), ("peak_rss_tree_mb", 16)]
+    print("  ".join(f"{c:>{w}}" for c, w in cols))
+    for r in results:
+        print("  ".join(f"{r[c]!s:>{w}}" for c, w in cols))
+        print(f"{'':>9}  outcomes {r['outcomes']}  server {r['server']}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark modifier_1_0 / run_parallel against a local fake OpenAI server")
+    ap.add_argument("--rows", type=int, default=2000, help="rows per scenario (default: 2000)")
+    ap.add_argument("--modes", default="single,async,parallel", help="comma-separated: single, async, parallel")
+    ap.add_argument("--workers", type=int, default=3, help="run_parallel workers (parallel mode)")
+    ap.add_argument("--concurrency", type=int, default=4, help="CONCURRENCY for async mode")
+    ap.add_argument("--repeat", type=int, default=1, help="runs per mode")
+    ap.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra env for the runs")
+    ap.add_argument("--timeout", type=float, default=1800, help="seconds before a run is killed")
+    ap.add_argument("--results", default="bench_results.jsonl", help="append results here (empty = don't)")
+    ap.add_argument("--keep", action="store_true", help="keep the scratch directories")
+    fake_openai.add_arguments(ap)
+    args = ap.parse_args()
+
+    results = []
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        for _ in range(args.repeat):
+            fake = fake_openai.from_args(args)  # same seed → same fault sequence per run
+            server = fake.serve("127.0.0.1", 0)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+            print(f"[info] {mode}: {args.rows} rows against {url}")
+            try:
+                results.append(run_scenario(mode, args, url, fake))
+            finally:
+                server.shutdown()
+                server.server_close()
+
+    print_table(results)
+    if args.results:
+        with open(args.results, "a", encoding="utf-8") as f:
+            for r in results:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        print(f"[ok] results appended to {args.results}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# brand_lexicon.py
+"""
+Offline brand dictionary with SymSpell-style typo lookup.
+
+Brands come from catalog files with a `brand` column (barcodes_enriched.csv,
+an already-branded catalog) and from Other/manual_extractions_1.csv (no
+header: barcode, name, desc..., category, brand — the description may hold
+unquoted commas, so the brand is taken from the last field).
+
+Every brand key is stored together with all its deletions up to
+`max_dist` characters, so a typo is found with a handful of dict lookups:
+the deletions of the query meet the deletions of the brand. Candidates are
+confirmed with a real (Damerau) edit distance. How far a typo may go depends
+on the length: short brands (<= 4 chars, "Asu", "Марс") match exactly only.
+
+correct_names() works on a whole column at once: every distinct word/phrase
+is resolved once, and a word that appears often in the catalog itself is
+treated as a real word, not as a typo of a similar brand. Call count_words()
+with the whole catalog first when names are corrected in chunks (work-queue
+units), so the "frequent word" guard does not depend on the chunk. A word
+written in lower case in the name ("… коробка") is never taken for a brand
+whose canonical spelling is capitalized ("Коробка"); Latin brands are often
+typed in lower case, so this only applies to Cyrillic.
+
+Usage:
+    lex = BrandLexicon.from_sources(["../Other/barcodes_enriched.csv", "../Other/manual_extractions_1.csv"])
+    names, brands, fixes = lex.correct_names(df["name"])   # "Сыр Hohland 45%" → "Сыр Hochland 45%", "Hochland",
+                                                           # [("Hohland", "Hochland")]
+"""
+
+import csv
+import os
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+WORD_RE = re.compile(r"[^\W_]+(?:['’`\-][^\W_]+)*")
+_APOSTROPHE_RE = re.compile(r"['’`]")
+_DASH_RE = re.compile(r"[-‐–]")
+_CYR_LOWER_RE = re.compile(r"[а-яё\s'’`\-]+")
+
+# Descriptive words that are never a brand on their own (same spirit as the SYSTEM_PROMPT ban list)
+STOPWORDS = {
+    "classic", "original", "premium", "food", "домашний", "домашняя", "крестьянский", "крепыш",
+    "протеин", "протейн", "белые сыры", "рассыпчатый", "рассыпчатая", "эскимо", "пломбир",
+    "молоко", "сыр", "масло", "водка", "майонез",
+    # packaging words that slip into brand columns
+    "коробка", "пакет", "банка", "бутылка", "упаковка", "пачка", "туба", "ведро",
+}
+
+
+@lru_cache(maxsize=1 << 16)
+def brand_key(text: str) -> str:
+    """Case/ё/apostrophe-insensitive key: "A’SU" and "a'su" and "ASU" share one."""
+    s = unicodedata.normalize("NFC", text or "").casefold().replace("ё", "е")
+    return " ".join(_DASH_RE.sub(" ", _APOSTROPHE_RE.sub("", s)).split())
+
+
+def deletes(s: str, depth: int) -> set:
+    out, frontier = {s}, {s}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        out |= frontier
+    return out
+
+
+def damerau(a: str, b: str, limit: int) -> int:
+    """Optimal-string-alignment distance, capped at limit + 1."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def same_shape(a: str, b: str) -> bool:
+    """Fuzzy matches keep the word count ("Kit-Kat" ~ "KitKat" is only a space apart)."""
+    return len(a.split()) == len(b.split()) or a.replace(" ", "") == b.replace(" ", "")
+
+
+def inflection(a: str, b: str) -> bool:
+    """A truncation, a changed last letter or a suffix in place of the last letter is a word form
+    ("Пампушки"/"Пампушка", "Коровка"/"Корова"), not a typo."""
+    short, long_ = sorted((a, b), key=len)
+    return (long_.startswith(short) or (len(a) == len(b) and a[:-1] == b[:-1])
+            or (len(long_) == len(short) + 1 and long_.startswith(short[:-1])))
+
+
+def allowed_dist(key: str, max_dist: int) -> int:
+    n = len(key.replace(" ", ""))
+    if n <= 4:
+        return 0
+    return min(max_dist, 1 if n <= 8 else 2)
+
+
+class BrandLexicon:
+    def __init__(self, max_dist: int = 2, min_word_count: int = 3):
+        self.max_dist = max_dist
+        self.min_word_count = min_word_count
+        self.brands = {}       # key -> canonical spelling
+        self.votes = {}        # key -> Counter of spellings seen
+        self.index = {}        # deletion -> set of keys
+        self.max_words = 1
+        self.max_len = 0
+        self.phrase_words = set()  # words that occur in multi-word brands
+        self.word_counts = None    # catalog-wide word counts (count_words), else per call
+
+    # ---- building ----
+    @classmethod
+    def from_sources(cls, paths, extra_brands=(), **kwargs):
+        lex = cls(**kwargs)
+        for path in paths:
+            if path and os.path.exists(path):
+                lex.load(path)
+        for b in extra_brands:
+            lex.add(b)
+        lex.build()
+        return lex
+
+    def load(self, path) -> int:
+        n = 0
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            rows = csv.reader(f)
+            first = next(rows, [])
+            if "brand" in first:
+                col = first.index("brand")
+                values = (r[col] for r in rows if len(r) > col)
+            else:  # headerless manual extractions: brand is the last field
+                values = (r[-1] for r in [first, *rows] if len(r) >= 5)
+            for value in values:
+                for b in value.split(","):
+                    n += self.add(b)
+        return n
+
+    def add(self, brand: str) -> int:
+        brand = " ".join((brand or "").split()).strip("«»\"' ")
+        key = brand_key(brand)
+        if not key or key in STOPWORDS or not re.search(r"[^\W\d_]", key):
+            return 0
+        self.votes.setdefault(key, Counter())[brand] += 1
+        return 1
+
+    def build(self):
+        """Pick the most frequent spelling per key and index all deletions."""
+        for key, spellings in self.votes.items():
+            self.brands[key] = spellings.most_common(1)[0][0]
+            words = key.split()
+            self.max_words = max(self.max_words, len(words))
+            self.max_len = max(self.max_len, len(key))
+            if len(words) > 1:
+                self.phrase_words.update(w for w in words if len(w) > 2)  # not "в"/"на"/"из"
+            for d in deletes(key, allowed_dist(key, self.max_dist)):
+                self.index.setdefault(d, set()).add(key)
+
+    def __len__(self):
+        return len(self.brands)
+
+    # ---- lookup ----
+    def lookup(self, text: str):
+        """(canonical brand, distance) for a word/phrase, or (None, None)."""
+        return self._lookup_key(brand_key(text))
+
+    def _lookup_key(self, key: str):
+        if key in self.brands:
+            return self.brands[key], 0
+        limit = allowed_dist(key, self.max_dist)
+        if not limit or len(key) > self.max_len + limit:
+            return None, None
+        best, best_d = None, limit + 1
+        for d in deletes(key, limit):
+            for cand in self.index.get(d, ()):
+                if (allowed_dist(cand, self.max_dist) == 0 or cand[:1] != key[:1]
+                        or not same_shape(key, cand) or inflection(key, cand)):
+                    continue
+                dist = damerau(key, cand, min(limit, allowed_dist(cand, self.max_dist)))
+                if dist < best_d or (dist == best_d and best and len(cand) > len(best)):
+                    best, best_d = cand, dist
+        if best is None:
+            return None, None
+        return self.brands[best], best_d
+
+    def count_words(self, names):
+        """Word counts of the whole catalog for the "frequent word" guard."""
+        self.word_counts = Counter(brand_key(m.group()) for n in names for m in WORD_RE.finditer(str(n)))
+
+    def _resolve(self, keys: list, word_counts: Counter, memo: dict):
+        phrase = " ".join(keys)
+        if phrase not in memo:
+            brand, dist = self._lookup_key(phrase)
+            # a frequent catalog word is a word, not a typo of a similar brand
+            if dist and len(keys) == 1 and word_counts[phrase] >= self.min_word_count:
+                brand = None
+            memo[phrase] = (brand, dist) if brand else (None, None)
+        return memo[phrase]
+
+    def correct_names(self, names):
+        """→ (corrected names, brand or "" per name, [(typo, fix)] per name); longest phrase wins,
+        the first brand fills `brand`."""
+        names = [str(n) for n in names]
+        tokenized = [[(m.start(), m.end(), brand_key(m.group())) for m in WORD_RE.finditer(n)] for n in names]
+        word_counts = self.word_counts or Counter(t[2] for toks in tokenized for t in toks)
+        memo = {}
+        out_names, out_brands, out_fixes = [], [], []
+        for name, toks in zip(names, tokenized):
+            keys = [t[2] for t in toks]
+            spans, brand, i = [], "", 0
+            while i < len(toks):
+                for n in range(min(self.max_words, len(toks) - i), 0, -1):
+                    # phrases are only tried when a word belongs to some multi-word brand
+                    if n > 1 and not any(k in self.phrase_words for k in keys[i:i + n]):
+                        continue
+                    found, dist = self._resolve(keys[i:i + n], word_counts, memo)
+                    if found and not found[:1].islower() and _CYR_LOWER_RE.fullmatch(name[toks[i][0]:toks[i + n - 1][1]]):
+                        found = None  # "коробка" in running text is a word, not the brand "Коробка"
+                    if found:
+                        if dist:
+                            spans.append((toks[i][0], toks[i + n - 1][1], found))
+                        brand = brand or found
+                        i += n
+                        break
+                else:
+                    i += 1
+            out_fixes.append([(name[a:b], fixed) for a, b, fixed in spans])
+            for a, b, fixed in reversed(spans):
+                name = name[:a] + fixed + name[b:]
+            out_names.append(name)
+            out_brands.append(brand)
+        return out_names, out_brands, out_fixes
@@ -0,0 +1,67 @@
+# csv_ranges.py
+"""
+Byte-range access to a CSV file, so work-queue units can be read straight
+from the source file without materialized shard copies.
+
+scan_units() walks the file once in binary, counting records (a newline
+inside a quoted field does not end a record, blank lines are skipped like
+pandas does) and remembers the byte offset at every `unit_rows`-th record.
+Only those boundaries are kept, so memory does not grow with the file.
+
+read_rows() parses one range (header + its bytes) into a DataFrame whose
+index is the global row number, identical to the same rows of a full
+pd.read_csv(path, dtype=str).fillna("").
+"""
+
+import io
+import pandas as pd
+
+
+def _records(f):
+    """Yield (byte offset, record bytes) of each CSV record from the current position."""
+    start = f.tell()
+    parts, in_quotes = [], False
+    for line in f:
+        parts.append(line)
+        if line.count(b'"') % 2:
+            in_quotes = not in_quotes
+        if not in_quotes:
+            rec = b"".join(parts)
+            yield start, rec
+            start += len(rec)
+            parts = []
+    if parts:  # unterminated quote at EOF — pandas would fail on it too
+        yield start, b"".join(parts)
+
+
+def scan_units(path, unit_rows: int):
+    """→ (header_bytes, [(start_row, stop_row, byte_start, byte_stop), ...], n_rows)."""
+    units = []
+    n_rows = 0
+    with open(path, "rb") as f:
+        records = _records(f)
+        header = next(records, (0, b""))[1]
+        header_bytes = len(header)
+        unit_row, unit_byte, end = 0, header_bytes, header_bytes
+        for off, rec in records:
+            end = off + len(rec)
+            if not rec.strip(b"\r\n"):
+                continue  # blank line: not a row for pandas
+            if n_rows - unit_row == unit_rows:
+                units.append((unit_row, n_rows, unit_byte, off))
+                unit_row, unit_byte = n_rows, off
+            n_rows += 1
+        if n_rows > unit_row:
+            units.append((unit_row, n_rows, unit_byte, end))
+    return header_bytes, units, n_rows
+
+
+def read_rows(path, header_bytes: int, byte_start: int, byte_stop: int, start_row: int) -> pd.DataFrame:
+    """Rows of one byte range as strings, indexed by global row number."""
+    with open(path, "rb") as f:
+        header = f.read(header_bytes)
+        f.seek(byte_start)
+        body = f.read(byte_stop - byte_start)
+    df = pd.read_csv(io.BytesIO(header + body), dtype=str).fillna("")
+    df.index = pd.RangeIndex(start_row, start_row + len(df))
+    return df
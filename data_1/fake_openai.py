@@ -0,0 +1,197 @@
+# fake_openai.py
+"""
+Local stand-in for the OpenAI chat.completions endpoint, for load tests of
+modifier_1_0 / run_parallel without paid calls.
+
+It speaks the json_schema contract modifier_1_0 uses: the last message holds
+the JSON list of items, the answer is {"rows": [...]} with every row echoed
+(same id/barcode/name, confidence "high"). Behaviour is configurable and
+seeded, so two runs with the same settings see the same faults:
+- latency: const:S | uniform:A:B | lognormal:MEDIAN:SIGMA | exp:MEAN, plus a per-row cost;
+- random HTTP 500s, random 429s (with retry-after) and a real RPM window;
+- truncated answers (finish_reason "length"): at random, or whenever a batch
+  has more than --max-rows rows (an output-token limit);
+- malformed JSON at random.
+GET / returns the counters as JSON.
+
+Usage:
+    python fake_openai.py --port 18080 --latency lognormal:0.8:0.4 --rate-429 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:18080/v1 OPENAI_API_KEY=x python modifier_1_0.py
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def parse_latency(spec: str):
+    """'const:0.2' / 'uniform:0.1:0.5' / 'lognormal:0.8:0.4' / 'exp:0.3' → sampler(rng) -> seconds."""
+    kind, *args = spec.split(":")
+    a = [float(x) for x in args]
+    if kind == "const":
+        return lambda rng: a[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(a[0], a[1])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(a[0]), a[1])
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1.0 / a[0]) if a[0] > 0 else 0.0
+    raise ValueError(f"unknown latency spec: {spec}")
+
+
+class FakeOpenAI:
+    def __init__(self, latency="const:0", per_row_latency=0.0, error_rate=0.0, rate_429=0.0,
+                 rpm=0, retry_after=1.0, truncate_rate=0.0, max_rows=0, malformed_rate=0.0, seed=0):
+        self.latency = parse_latency(latency)
+        self.per_row_latency = per_row_latency
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.rpm = rpm
+        self.retry_after = retry_after
+        self.truncate_rate = truncate_rate
+        self.max_rows = max_rows
+        self.malformed_rate = malformed_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        self.window = (0, 0)  # (minute, requests in it)
+
+    # ---- decisions (under the lock, so a seeded run is reproducible for a given request order) ----
+    def plan(self, n_rows: int):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["rows"] += n_rows
+            if self.rpm:
+                minute = int(time.time() // 60)
+                start, count = self.window if self.window[0] == minute else (minute, 0)
+                self.window = (start, count + 1)
+                if count >= self.rpm:
+                    self.stats["429"] += 1
+                    return "429", 0.0, 60 - time.time() % 60
+            r = self.rng.random()
+            delay = self.latency(self.rng) + self.per_row_latency * n_rows
+            for outcome, p in (("500", self.error_rate), ("429", self.rate_429),
+                               ("truncated", self.truncate_rate), ("malformed", self.malformed_rate)):
+                if r < p:
+                    break
+                r -= p
+            else:
+                outcome = "truncated" if self.max_rows and n_rows > self.max_rows else "ok"
+            self.stats[outcome] += 1
+            return outcome, delay, self.retry_after
+
+    def answer(self, body: dict):
+        """→ (status, headers, payload bytes)."""
+        items = json.loads(body["messages"][-1]["content"])
+        outcome, delay, retry_after = self.plan(len(items))
+        if outcome == "429":
+            return 429, {"retry-after": str(math.ceil(retry_after)), "x-ratelimit-remaining-requests": "0"}, json.dumps(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+            ).encode()
+        time.sleep(delay)
+        if outcome == "500":
+            return 500, {}, json.dumps({"error": {"message": "The server had an error", "type": "server_error"}}).encode()
+
+        rows = [{
+            "id": it["id"], "barcode": it["barcode"], "name": " ".join(it["name"].split()),
+            "brand": None, "productDesc": None, "changed": False,
+            "changes": {"spelling": False, "units": False, "punctuation": False, "brandFix": False, "other": False},
+            "confidence": "high",
+        } for it in items]
+        content = json.dumps({"rows": rows}, ensure_ascii=False)
+        finish = "stop"
+        if outcome == "truncated":
+            content, finish = content[:len(content) // 2], "length"
+        elif outcome == "malformed":
+            cut = content.rfind('"name": "') + len('"name": "')
+            content = content[:cut] + "\\q" + content[cut:]  # invalid escape in the last row
+        payload = {
+            "id": f"chatcmpl-fake-{self.stats['requests']}", "object": "chat.completion",
+            "created": int(time.time()), "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish}],
+            "usage": {
+                "prompt_tokens": sum(len(m.get("content") or "") for m in body["messages"]) // 3,
+                "completion_tokens": len(content) // 3,
+                "total_tokens": 0,
+            },
+        }
+        return 200, {}, json.dumps(payload, ensure_ascii=False).encode()
+
+    # ---- HTTP ----
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, headers, data):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                with fake.lock:
+                    self._send(200, {}, json.dumps(dict(fake.stats)).encode())
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                self._send(*fake.answer(body))
+
+        return Handler
+
+    def serve(self, host="127.0.0.1", port=0) -> ThreadingHTTPServer:
+        """Bound server (port 0 = any free port); call serve_forever() or run it in a thread."""
+        server = ThreadingHTTPServer((host, port), self.handler())
+        server.daemon_threads = True
+        return server
+
+
+def add_arguments(p: argparse.ArgumentParser):
+    p.add_argument("--latency", default="const:0", help="const:S | uniform:A:B | lognormal:MEDIAN:SIGMA | exp:MEAN")
+    p.add_argument("--per-row-latency", type=float, default=0.0, help="extra seconds per row in the batch")
+    p.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with HTTP 500")
+    p.add_argument("--rate-429", type=float, default=0.0, help="share of requests answered with HTTP 429")
+    p.add_argument("--rpm", type=int, default=0, help="requests per minute before 429s (0 = unlimited)")
+    p.add_argument("--retry-after", type=float, default=1.0, help="retry-after seconds on random 429s")
+    p.add_argument("--truncate-rate", type=float, default=0.0, help="share of answers cut off (finish_reason=length)")
+    p.add_argument("--max-rows", type=int, default=0, help="answers for larger batches are cut off (0 = never)")
+    p.add_argument("--malformed-rate", type=float, default=0.0, help="share of answers with broken JSON")
+    p.add_argument("--seed", type=int, default=0)
+
+
+def from_args(args) -> FakeOpenAI:
+    return FakeOpenAI(
+        latency=args.latency, per_row_latency=args.per_row_latency, error_rate=args.error_rate,
+        rate_429=args.rate_429, rpm=args.rpm, retry_after=args.retry_after, truncate_rate=args.truncate_rate,
+        max_rows=args.max_rows, malformed_rate=args.malformed_rate, seed=args.seed,
+    )
+
+
+def main():
+    p = argparse.ArgumentParser(description="Local OpenAI chat.completions stand-in for modifier_1_0 load tests")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=18080)
+    add_arguments(p)
+    args = p.parse_args()
+    server = from_args(args).serve(args.host, args.port)
+    print(f"[ok] fake OpenAI on http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
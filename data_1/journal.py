@@ -0,0 +1,114 @@
+# journal.py
+"""
+Append-only checkpoint journal for modifier_1_0.
+
+One JSON object per line, fsynced after every completed batch:
+    {"type": "header", "input": "data_1_0.csv", "fingerprint": "<sha1>", "rows": 10508}
+    {"type": "batch", "batch": 7, "rows": {"90": {"name": ..., "brand": ..., "productDesc": ...}, ...},
+     "report": [<report rows of that batch>]}
+
+On startup `replay()` re-applies every journaled batch to the DataFrame and the
+report and returns the row ids that are already done, so the run continues
+from the first unfinished batch. A journal written for a different input file
+(fingerprint mismatch) is moved aside to *.stale instead of being replayed.
+A torn last line (crash mid-write) is cut off before appending.
+
+Failed batches are NOT journaled — a restart retries them.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import pandas as pd
+
+MERGED_COLS = ("name", "brand", "productDesc")
+
+
+def cell_text(v) -> str:
+    """Merged cell as stored in the journal/queue: None/NaN become "", never the string "None"."""
+    return "" if v is None or pd.isna(v) else str(v)
+
+
+def file_fingerprint(path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class BatchJournal:
+    def __init__(self, path, input_path):
+        self.path = Path(path)
+        self.input_path = str(input_path)
+        self.fingerprint = file_fingerprint(input_path)
+        self.f = None
+        self.last_batch = 0
+
+    def _write(self, record: dict):
+        self.f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def replay(self, df, report_rows) -> set:
+        """Apply journaled batches to df/report_rows; return ids (str) already done."""
+        done = set()
+        good_end = 0
+        header_ok = False
+        if self.path.exists():
+            with open(self.path, "rb") as f:
+                data = f.read()
+            pos = 0
+            for line in data.splitlines(keepends=True):
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    break  # torn tail from a crash — everything after is dropped
+                if not line.endswith(b"\n"):
+                    break
+                pos += len(line)
+                if rec.get("type") == "header":
+                    if rec.get("fingerprint") != self.fingerprint:
+                        stale = self.path.with_suffix(self.path.suffix + ".stale")
+                        os.replace(self.path, stale)
+                        print(f"[warn] journal {self.path} is for a different input — moved to {stale}")
+                        done.clear(); report_rows.clear()
+                        break
+                    header_ok = True
+                elif rec.get("type") == "batch" and header_ok:
+                    self.last_batch = max(self.last_batch, int(rec.get("batch", 0)))
+                    for sid, vals in rec["rows"].items():
+                        i = int(sid)
+                        for col in MERGED_COLS:
+                            df.at[i, col] = vals[col]
+                        done.add(sid)
+                    report_rows.extend(rec.get("report", []))
+                good_end = pos
+
+        if header_ok:
+            with open(self.path, "r+b") as f:
+                f.truncate(good_end)
+            self.f = open(self.path, "a", encoding="utf-8")
+            if done:
+                print(f"[info] journal: resumed {len(done)} rows from {self.path}")
+        else:
+            self.f = open(self.path, "w", encoding="utf-8")
+            self._write({"type": "header", "input": self.input_path,
+                         "fingerprint": self.fingerprint, "rows": len(df)})
+        return done
+
+    def commit(self, bi: int, df, ids, report_slice):
+        """Record one completed batch (merged values + its report rows)."""
+        rows = {}
+        for sid in ids:
+            i = int(sid)
+            rows[str(sid)] = {col: cell_text(df.at[i, col]) for col in MERGED_COLS}
+        self._write({"type": "batch", "batch": bi, "rows": rows, "report": report_slice})
+
+    def close(self, remove: bool = False):
+        if self.f:
+            self.f.close()
+            self.f = None
+        if remove and self.path.exists():
+            self.path.unlink()
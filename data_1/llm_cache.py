@@ -0,0 +1,133 @@
+# llm_cache.py
+"""
+Persistent, content-addressed cache of per-row model results for modifier_1_0.
+
+- Storage: one SQLite file (WAL, safe to share between shard processes;
+  SQLITE_JOURNAL_MODE=DELETE when it lives on a network share).
+- Key: sha256 over (model, hash(SYSTEM_PROMPT), hash(response schema),
+  normalized name, barcode). Changing the prompt, schema or model therefore
+  never serves stale answers — old entries simply stop being hit and age out.
+- Value: the model's row object as JSON (without the echo `id`), so the usual
+  merge/validation in modifier_1_0 runs on cached rows exactly as on fresh ones.
+- Eviction: TTL on creation time + LRU (last_used) once over max_rows.
+
+Usage:
+    cache = ResponseCache("llm_cache.sqlite", namespace=cache_namespace(MODEL, SYSTEM_PROMPT, SCHEMA))
+    hits = cache.get_many(items)            # {id: row}
+    cache.put_many(items, rows_by_id)
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+import unicodedata
+
+from work_queue import sqlite_journal_mode
+
+
+def text_hash(s: str) -> str:
+    return hashlib.sha256((s or "").encode("utf-8")).hexdigest()
+
+
+def cache_namespace(model: str, system_prompt: str, schema: dict) -> str:
+    """Everything that changes the answer besides the row itself."""
+    schema_json = json.dumps(schema, ensure_ascii=False, sort_keys=True)
+    return f"{model}|{text_hash(system_prompt)}|{text_hash(schema_json)}"
+
+
+def normalize_name(name: str) -> str:
+    """NFC + collapsed whitespace: '  Молоко   3,2% ' and 'Молоко 3,2%' share one entry."""
+    return " ".join(unicodedata.normalize("NFC", name or "").split())
+
+
+class ResponseCache:
+    def __init__(self, path, namespace: str, ttl_sec: float | None = None, max_rows: int | None = None):
+        self.path = str(path)
+        self.namespace = namespace
+        self.ttl_sec = ttl_sec
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute(f"PRAGMA journal_mode={sqlite_journal_mode()}")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+        self.conn.commit()
+        self.evict()
+
+    def key(self, barcode: str, name: str) -> str:
+        raw = "\x1f".join([self.namespace, normalize_name(name), str(barcode or "").strip()])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_many(self, items) -> dict:
+        """items: [{id, barcode, name}] → {id: cached row (with id set)} for hits only."""
+        if not items:
+            return {}
+        keys = {self.key(it["barcode"], it["name"]): it["id"] for it in items}
+        now = time.time()
+        min_created = now - self.ttl_sec if self.ttl_sec else 0
+        found = {}
+        key_list = list(keys)
+        for i in range(0, len(key_list), 500):  # stay under SQLite's variable limit
+            chunk = key_list[i:i + 500]
+            q = ",".join("?" * len(chunk))
+            for k, value in self.conn.execute(
+                f"SELECT key, value FROM responses WHERE created_at >= ? AND key IN ({q})",
+                [min_created, *chunk],
+            ):
+                row = json.loads(value)
+                row["id"] = keys[k]
+                found[keys[k]] = row
+        if found:
+            hit_keys = [(now, k) for k, i in keys.items() if i in found]
+            self.conn.executemany("UPDATE responses SET last_used=? WHERE key=?", hit_keys)
+            self.conn.commit()
+        self.hits += len(found)
+        self.misses += len(items) - len(found)
+        return found
+
+    def put_many(self, items, rows_by_id: dict):
+        """Store model rows for the items that got one back."""
+        now = time.time()
+        records = []
+        for it in items:
+            row = rows_by_id.get(it["id"])
+            if not isinstance(row, dict):
+                continue
+            value = {k: v for k, v in row.items() if k != "id"}
+            records.append((self.key(it["barcode"], it["name"]), json.dumps(value, ensure_ascii=False), now, now))
+        if records:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO responses(key, value, created_at, last_used) VALUES (?,?,?,?)", records
+            )
+            self.conn.commit()
+
+    def evict(self):
+        """Drop expired rows, then least-recently-used rows above max_rows."""
+        if self.ttl_sec:
+            self.conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_sec,))
+        if self.max_rows:
+            (n,) = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+            if n > self.max_rows:
+                self.conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY last_used ASC LIMIT ?)",
+                    (n - self.max_rows,),
+                )
+        self.conn.commit()
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100) if total else 0.0
+        return f"cache hits={self.hits} misses={self.misses} ({rate:.1f}% hit rate) → {self.path}"
+
+    def close(self):
+        self.conn.close()
@@ -1,9 +1,19 @@
 # normalize_catalog_oneclick.py
-import os, json, time, re, math, random
+import os, sys, json, time, re, math, random, asyncio, argparse, socket
+from collections import Counter, deque
 import pandas as pd
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, APITimeoutError, APIConnectionError, InternalServerError, RateLimitError
 import httpx
 from dotenv import load_dotenv
+from llm_cache import ResponseCache, cache_namespace, normalize_name, text_hash
+from translation_memory import TranslationMemory
+from brand_lexicon import BrandLexicon
+from rate_limit import RateLimiter, SharedRateGate
+from journal import BatchJournal, file_fingerprint, cell_text, MERGED_COLS
+from work_queue import WorkQueue, LeaseKeeper
+from csv_ranges import read_rows
+from batcher import AdaptiveBatcher
+from progress import ProgressReporter
 
 
 # --- imports unchanged ---
@@ -22,6 +32,61 @@ RETRIES    = int(os.getenv("RETRIES", "5"))
 PAUSE_BASE = float(os.getenv("PAUSE", "0.4"))
 BATCH_SIZE = int(os.getenv("BATCH_SIZE", "15"))
 READ_TIMEOUT_SEC = float(os.getenv("READ_TIMEOUT_SEC", "45"))
+# On-disk response cache (empty CACHE_PATH disables it)
+CACHE_PATH     = os.getenv("CACHE_PATH", "llm_cache.sqlite")
+CACHE_TTL_DAYS = float(os.getenv("CACHE_TTL_DAYS", "30"))
+CACHE_MAX_ROWS = int(os.getenv("CACHE_MAX_ROWS", "500000"))
+# Translation memory (opt-in): accepted high-confidence rows of the reports listed in TM_REPORTS
+# (comma-separated, later files win) answer exact names without the model. Only rows the model
+# answered under the current model/prompt/schema are used (report column `namespace`). Keep the
+# reports you trust aside: REPORT_CSV itself is overwritten by every run. TM_FUZZY=1 also looks up
+# near-identical names; those still go to the model, with the neighbour's edit as a hint.
+TRANSLATION_MEMORY = os.getenv("TRANSLATION_MEMORY", "1") == "1"
+TM_REPORTS  = os.getenv("TM_REPORTS", "")
+TM_FUZZY    = os.getenv("TM_FUZZY", "0") == "1"
+TM_MAX_DIST = int(os.getenv("TM_MAX_DIST", "2"))
+# Offline brand lexicon: brand typos in names are fixed and `brand` is filled locally before the model pass.
+# BRAND_SOURCES: comma-separated CSVs with a brand column (or headerless manual extractions); INPUT_CSV's
+# own brands are always added, BRAND_SEED adds the brands the prompt names explicitly.
+_OTHER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Other")
+BRAND_LEXICON  = os.getenv("BRAND_LEXICON", "1") == "1"
+BRAND_SOURCES  = os.getenv("BRAND_SOURCES", ",".join(
+    os.path.join(_OTHER_DIR, f) for f in ("barcodes_enriched.csv", "barcodes_enriched_2_old.csv", "manual_extractions_1.csv")
+))
+BRAND_SEED     = os.getenv("BRAND_SEED", "Hochland,Huggies,Président,Президент,Danone,NEMOLOKO,Lipton,Monster,7UP")
+BRAND_MAX_DIST = int(os.getenv("BRAND_MAX_DIST", "2"))
+# Adaptive batching: BATCH_SIZE is the starting size, rows are packed by estimated tokens
+ADAPTIVE_BATCH          = os.getenv("ADAPTIVE_BATCH", "1") == "1"
+BATCH_MIN               = int(os.getenv("BATCH_MIN", "5"))
+BATCH_MAX               = int(os.getenv("BATCH_MAX", "60"))
+BATCH_MAX_INPUT_TOKENS  = int(os.getenv("BATCH_MAX_INPUT_TOKENS", "4000"))   # payload only, prompt excluded
+BATCH_MAX_OUTPUT_TOKENS = int(os.getenv("BATCH_MAX_OUTPUT_TOKENS", "6000"))
+BATCH_TARGET_LATENCY    = float(os.getenv("BATCH_TARGET_LATENCY", str(READ_TIMEOUT_SEC / 3)))
+BATCH_STATS_CSV         = os.getenv("BATCH_STATS_CSV", OUTPUT_CSV.replace(".csv", ".batch_stats.csv"))
+# Send each case/whitespace-equivalent name to the model once and fan the result out
+DEDUP_NAMES = os.getenv("DEDUP_NAMES", "1") == "1"
+# Work-queue worker mode (set by run_parallel, or by hand on other hosts): shared queue file,
+# this worker's id (unique across hosts) and how long a claimed unit stays leased without a heartbeat
+WORK_QUEUE = os.getenv("WORK_QUEUE", "")
+WORKER_ID  = os.getenv("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+LEASE_SEC  = float(os.getenv("LEASE_SEC", "300"))
+# Pipe fd for structured progress lines to the run_parallel supervisor (unset = no reporting)
+PROGRESS_FD = os.getenv("PROGRESS_FD", "")
+# Checkpoint journal of completed batches (empty JOURNAL_PATH disables it)
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", OUTPUT_CSV.replace(".csv", ".journal.jsonl"))
+# Async mode: CONCURRENCY > 1 keeps that many batches in flight on one process
+CONCURRENCY = int(os.getenv("CONCURRENCY", "1"))
+RPM_LIMIT   = float(os.getenv("RPM_LIMIT", "0"))      # requests/min, 0 = unlimited
+TPM_LIMIT   = float(os.getenv("TPM_LIMIT", "0"))      # tokens/min, 0 = unlimited
+# Cross-process rate gate (set by run_parallel): RPM/TPM become one budget for all workers,
+# 429s pause everyone for Retry-After, and a circuit breaker stops calls after repeated failures
+RATE_STATE_PATH      = os.getenv("RATE_STATE_PATH", "")
+BREAKER_THRESHOLD    = int(os.getenv("BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN_SEC = float(os.getenv("BREAKER_COOLDOWN_SEC", "15"))
+RATE_LIMIT_MAX_WAITS = int(os.getenv("RATE_LIMIT_MAX_WAITS", "50"))  # 429s per batch before it counts as failed
+RATE_STATE_TTL_SEC   = float(os.getenv("RATE_STATE_TTL_SEC", "600"))  # older gate state (earlier run) is reset
+# The SDK's own retries are invisible to the batch stats; with the shared gate, 429s must not be retried privately
+CLIENT_MAX_RETRIES   = int(os.getenv("OPENAI_MAX_RETRIES", "0" if RATE_STATE_PATH else "2"))
 
 
 # ---- OpenAI client with strict timeouts ----
@@ -30,14 +95,23 @@ HTTP_LIMITS  = httpx.Limits(max_keepalive_connections=5, max_connections=10)
 client = OpenAI(
     api_key=os.environ.get("OPENAI_API_KEY"),
     base_url=BASE_URL if BASE_URL else None,
-    http_client=httpx.Client(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+    http_client=httpx.Client(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS),
+    max_retries=CLIENT_MAX_RETRIES,
 )
+aclient = None   # AsyncOpenAI, created by run_batches_async
+LIMITER = None
+GATE    = None   # SharedRateGate, opened in init_runtime when RATE_STATE_PATH is set
+JOURNAL = None   # BatchJournal, opened in main
+BATCHER = None   # AdaptiveBatcher, created in main when ADAPTIVE_BATCH=1
+GROUPS  = {}     # representative row id -> duplicate-name member ids (DEDUP_NAMES)
 
 SYSTEM_PROMPT = """
 Ты — строгий редактор товарного каталога. На входе массив объектов:
 - id (строка) — эхо-идентификатор (НЕ МЕНЯТЬ);
 - barcode (строка) — НЕ МЕНЯТЬ;
-- name (строка) — нормализовать ТОЛЬКО безопасно.
+- name (строка) — нормализовать ТОЛЬКО безопасно;
+- hint (необязательно) — похожая позиция из прошлых правок: similar (её исходное name) → edited, brand.
+  Это лишь ориентир по написанию бренда/слов: товар может быть другим, размер/вариант/вкус/числа бери ТОЛЬКО из name.
 
 ГЛАВНЫЙ ПРИНЦИП
 — Если есть малейшее сомнение — МИНИМУМ изменений; confidence≠high; productDesc=null.
@@ -141,190 +215,814 @@ def clamp_desc(desc, max_len=300):
         return " ".join(desc.split())[:max_len]
     return None
 
-def call_model_batch(items):
-    # items: list of dicts {id, barcode, name}
-    messages = [
-        {"role":"system","content": SYSTEM_PROMPT},
-        {"role":"user",  "content": json.dumps(items, ensure_ascii=False)}
-    ]
-    resp = client.chat.completions.create(
-        model=MODEL,
-        temperature=0,
-        response_format={
-            "type": "json_schema",
-            "json_schema": {
-                "name": "NormalizedRowsEnvelope",
-                "schema": {
-                    "type": "object",
-                    "additionalProperties": False,
-                    "properties": {
-                        "rows": {
-                            "type": "array",
-                            "items": {
-                                "type": "object",
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "NormalizedRowsEnvelope",
+        "schema": {
+            "type": "object",
+            "additionalProperties": False,
+            "properties": {
+                "rows": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "additionalProperties": False,
+                        "properties": {
+                            "id": {"type":"string"},
+                            "barcode": {"type":"string"},
+                            "name": {"type":"string"},
+                            "brand": {"type":["string","null"]},
+                            "productDesc": {"type":["string","null"]},
+                            "changed": {"type":"boolean"},
+                            "changes": {
+                                "type":"object",
                                 "additionalProperties": False,
                                 "properties": {
-                                    "id": {"type":"string"},
-                                    "barcode": {"type":"string"},
-                                    "name": {"type":"string"},
-                                    "brand": {"type":["string","null"]},
-                                    "productDesc": {"type":["string","null"]},
-                                    "changed": {"type":"boolean"},
-                                    "changes": {
-                                        "type":"object",
-                                        "additionalProperties": False,
-                                        "properties": {
-                                            "spelling":{"type":"boolean"},
-                                            "units":{"type":"boolean"},
-                                            "punctuation":{"type":"boolean"},
-                                            "brandFix":{"type":"boolean"},
-                                            "other":{"type":"boolean"}
-                                        },
-                                        "required":["spelling","units","punctuation","brandFix","other"]
-                                    },
-                                    "confidence": {"enum":["high","medium","low"]}
+                                    "spelling":{"type":"boolean"},
+                                    "units":{"type":"boolean"},
+                                    "punctuation":{"type":"boolean"},
+                                    "brandFix":{"type":"boolean"},
+                                    "other":{"type":"boolean"}
                                 },
-                                "required": ["id","barcode","name","brand","productDesc","changed","changes","confidence"]
-                            }
-                        }
-                    },
-                    "required": ["rows"]
+                                "required":["spelling","units","punctuation","brandFix","other"]
+                            },
+                            "confidence": {"enum":["high","medium","low"]}
+                        },
+                        "required": ["id","barcode","name","brand","productDesc","changed","changes","confidence"]
+                    }
                 }
-            }
-        },
-        messages=messages,
-        timeout=READ_TIMEOUT_SEC
+            },
+            "required": ["rows"]
+        }
+    }
+}
+# everything besides the row that changes the answer: keys the cache, tags report rows for the memory
+NAMESPACE = cache_namespace(MODEL, SYSTEM_PROMPT, RESPONSE_FORMAT)
+NAMESPACE_ID = text_hash(NAMESPACE)[:16]
+
+
+# ---- Response cache (opened in main) ----
+CACHE = None
+MEMORY = None
+LEXICON = None
+LEXICON_BRANDS = {}  # row index -> brand found by the lexicon (used when the model gives none)
+ORIGINAL_NAMES = {}  # row index -> name before the lexicon's typo fixes (report old_name, memory key)
+LEXICON_FIXES = {}   # row index -> "Hohland→Hochland; ..." for the report
+API_CALLS = 0
+PROGRESS = ProgressReporter(None, WORKER_ID)  # replaced in init_runtime when PROGRESS_FD is set
+
+def open_cache():
+    if not CACHE_PATH:
+        return None
+    return ResponseCache(
+        CACHE_PATH,
+        namespace=NAMESPACE,
+        ttl_sec=CACHE_TTL_DAYS * 86400 if CACHE_TTL_DAYS > 0 else None,
+        max_rows=CACHE_MAX_ROWS if CACHE_MAX_ROWS > 0 else None,
     )
-    data = json.loads(resp.choices[0].message.content)
-    return data.get("rows", [])
 
-def iter_batches(indices, size):
-    for i in range(0, len(indices), size):
-        yield indices[i:i+size]
+def open_memory():
+    if not (TRANSLATION_MEMORY and TM_REPORTS):
+        return None
+    tm = TranslationMemory.from_reports(
+        [p.strip() for p in TM_REPORTS.split(",") if p.strip()], max_dist=TM_MAX_DIST, fuzzy=TM_FUZZY,
+        namespace=NAMESPACE_ID,
+    )
+    print(f"[info] translation memory: {len(tm)} entries from {TM_REPORTS}"
+          + (f" ({tm.stale} rows from another model/prompt/schema or the memory itself skipped)" if tm.stale else ""))
+    return tm if len(tm) else None
 
-def main():
-    # Read CSV as strings to avoid NaN surprises
-    df = pd.read_csv(INPUT_CSV, dtype=str).fillna("")
-    if "brand" not in df.columns: df["brand"] = ""
-    if "productDesc" not in df.columns: df["productDesc"] = ""
+def open_lexicon():
+    if not BRAND_LEXICON:
+        return None
+    paths = [p.strip() for p in BRAND_SOURCES.split(",") if p.strip()] + [INPUT_CSV]
+    lex = BrandLexicon.from_sources(paths, extra_brands=BRAND_SEED.split(","), max_dist=BRAND_MAX_DIST)
+    if os.path.exists(INPUT_CSV):
+        # catalog-wide word counts: the same guard in single-process and work-queue (per unit) runs
+        lex.count_words(pd.read_csv(INPUT_CSV, dtype=str, usecols=["name"])["name"].fillna(""))
+    print(f"[info] brand lexicon: {len(lex)} brands")
+    return lex if len(lex) else None
 
-    report_rows = []
-    idx_all = df.index.tolist()
+def apply_lexicon(df):
+    """Fix brand typos in df["name"] and fill empty brands from the lexicon, in one pass over the column."""
+    if LEXICON is None or df.empty:
+        return
+    t0 = time.time()
+    names, brands, fixes = LEXICON.correct_names(df["name"])
+    names = pd.Series(names, index=df.index)
+    brands = pd.Series(brands, index=df.index)
+    fixed = names != df["name"]
+    filled = (brands != "") & (df["brand"] == "")
+    ORIGINAL_NAMES.update(df.loc[fixed, "name"].to_dict())
+    seen = Counter()
+    for i, row_fixes in zip(df.index, fixes):
+        if row_fixes:
+            LEXICON_FIXES[i] = "; ".join(f"{a}→{b}" for a, b in row_fixes)
+            seen.update(row_fixes)
+    df["name"] = names
+    df.loc[filled, "brand"] = brands[filled]
+    LEXICON_BRANDS.update(brands[brands != ""].to_dict())
+    print(f"[info] brand lexicon: {int(fixed.sum())} brand typos fixed, {int(filled.sum())} brands filled "
+          f"in {len(df)} rows ({time.time() - t0:.2f}s)")
+    for (a, b), n in seen.most_common(10):
+        print(f"[info]   {a} → {b} ×{n}")
+
+def print_run_summary():
+    print(f"[info] API calls: {API_CALLS}")
+    if MEMORY is not None:
+        print(f"[info] {MEMORY.summary()}")
+    if GATE is not None:
+        print(f"[info] {GATE.summary()}")
+    if CACHE is not None:
+        print(f"[info] {CACHE.summary()}")
+    if BATCHER is not None:
+        BATCHER.close()
+        print(f"[info] {BATCHER.summary()}" + (f" → {BATCH_STATS_CSV}" if BATCH_STATS_CSV else ""))
 
+def _messages(items):
+    return [
+        {"role":"system","content": SYSTEM_PROMPT},
+        {"role":"user",  "content": json.dumps(items, ensure_ascii=False)}
+    ]
+
+class BadResponse(ValueError):
+    """The response is not a complete {"rows": [...]} object; `rows` holds the complete rows salvaged from it."""
+    def __init__(self, msg, rows=None):
+        super().__init__(msg)
+        self.rows = rows or []
+
+class TruncatedResponse(BadResponse):
+    """The model stopped at max tokens — the rows array is incomplete."""
+
+_ROWS_START_RE = re.compile(r'"rows"\s*:\s*\[')
+
+def salvage_rows(content):
+    """Every complete row object of a cut-off or malformed {"rows": [...]} response.
+
+    Walks the array with JSONDecoder.raw_decode one element at a time and stops
+    at the first element that does not parse (the truncation point).
+    """
+    m = _ROWS_START_RE.search(content or "")
+    if not m:
+        return []
+    decoder = json.JSONDecoder()
+    pos, n, rows = m.end(), len(content), []
+    while True:
+        while pos < n and content[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= n or content[pos] == "]":
+            break
+        try:
+            obj, pos = decoder.raw_decode(content, pos)
+        except ValueError:
+            break
+        if isinstance(obj, dict):
+            rows.append(obj)
+    return rows
+
+def _parse_response(resp, meta):
+    choice = resp.choices[0]
+    if meta is not None:
+        usage = getattr(resp, "usage", None)
+        meta["usage"] = {
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+        } if usage else None
+    content = choice.message.content
+    if choice.finish_reason == "length":
+        raise TruncatedResponse("response truncated at max tokens", salvage_rows(content))
     try:
-        for bi, batch_idx in enumerate(iter_batches(idx_all, BATCH_SIZE), start=1):
-            t0 = time.time()
-            # Build batch payload
-            batch_payload = []
-            for i in batch_idx:
-                row = df.loc[i]
-                # skip rows without mandatory fields
-                if "barcode" not in row or "name" not in row:
-                    continue
-                batch_payload.append({
-                    "id": str(i),
-                    "barcode": str(row["barcode"]),
-                    "name": str(row["name"])
-                })
-
-            if not batch_payload:
+        data = json.loads(content)
+    except ValueError as e:
+        raise BadResponse(f"invalid JSON: {e}", salvage_rows(content)) from e
+    rows = data.get("rows", []) if isinstance(data, dict) else None
+    if not isinstance(rows, list):
+        raise BadResponse("response has no rows array")
+    return rows
+
+def _gate_report(raw=None, err=None):
+    """Tell the shared gate how a call went (headers carry the server's view of our budget)."""
+    if GATE is None:
+        return
+    if isinstance(err, RateLimitError):
+        GATE.on_rate_limited(getattr(getattr(err, "response", None), "headers", None))
+    elif isinstance(err, InternalServerError) or (
+            isinstance(err, APIConnectionError) and not isinstance(err, APITimeoutError)):
+        GATE.on_overload()
+    elif err is None:
+        GATE.on_success(raw.headers)
+
+async def _agate_report(raw=None, err=None):
+    """_gate_report off the event loop: the gate's transaction may wait on another worker's lock."""
+    if GATE is not None:
+        await asyncio.to_thread(_gate_report, raw, err)
+
+def _request_rows(items, meta=None):
+    # items: list of dicts {id, barcode, name}
+    global API_CALLS
+    if GATE is not None:
+        GATE.acquire(estimate_tokens(items))
+    if meta is not None:
+        meta["t_sent"] = time.time()  # latency for the batcher excludes time spent at the gate
+    API_CALLS += 1
+    try:
+        raw = client.chat.completions.with_raw_response.create(
+            model=MODEL,
+            temperature=0,
+            response_format=RESPONSE_FORMAT,
+            messages=_messages(items),
+            timeout=READ_TIMEOUT_SEC
+        )
+    except Exception as e:
+        _gate_report(err=e)
+        raise
+    _gate_report(raw)
+    return _parse_response(raw.parse(), meta)
+
+async def _arequest_rows(items, meta=None):
+    global API_CALLS
+    if GATE is not None:
+        await GATE.aacquire(estimate_tokens(items))
+    if meta is not None:
+        meta["t_sent"] = time.time()
+    API_CALLS += 1
+    try:
+        raw = await aclient.chat.completions.with_raw_response.create(
+            model=MODEL,
+            temperature=0,
+            response_format=RESPONSE_FORMAT,
+            messages=_messages(items),
+            timeout=READ_TIMEOUT_SEC
+        )
+    except Exception as e:
+        await _agate_report(err=e)
+        raise
+    await _agate_report(raw)
+    return _parse_response(raw.parse(), meta)
+
+def _cache_split(items):
+    """(cached rows, items still to send)."""
+    if CACHE is None:
+        return [], items
+    cached = CACHE.get_many(items)
+    for r in cached.values():
+        r["_source"] = "cache"
+    return list(cached.values()), [it for it in items if it["id"] not in cached]
+
+def _memory_split(items):
+    """(rows answered by the translation memory, items still to send; fuzzy neighbours ride along as a hint)."""
+    if MEMORY is None:
+        return [], items
+    found, rest = [], []
+    for it in items:
+        # memory keys are report old_names, i.e. names before the lexicon's fixes
+        row, kind = MEMORY.lookup(ORIGINAL_NAMES.get(int(it["id"]), it["name"]))
+        if kind == "exact":
+            found.append({"id": it["id"], "barcode": it["barcode"], **row, "_source": "tm-exact"})
+        elif kind == "fuzzy":
+            rest.append({**it, "hint": row})
+        else:
+            rest.append(it)
+    return found, rest
+
+def _mark_hinted(misses, fresh):
+    """Report rows answered by the model with a translation-memory hint."""
+    hinted = {it["id"] for it in misses if "hint" in it}
+    for r in fresh:
+        if isinstance(r, dict) and r.get("id") in hinted:
+            r["_source"] = "model+tm-hint"
+
+def _local_split(items):
+    """Cache first, then translation memory: (answered rows, items for the model)."""
+    results, misses = _cache_split(items)
+    remembered, misses = _memory_split(misses)
+    return results + remembered, misses
+
+def _cache_store(misses, fresh):
+    if CACHE is None:
+        return
+    # cache only rows that echo the barcode we sent (the same check merge applies)
+    sent = {it["id"]: it["barcode"] for it in misses}
+    by_id = {r["id"]: r for r in fresh
+             if isinstance(r, dict) and "id" in r and str(r.get("barcode", "")) == sent.get(r["id"])}
+    CACHE.put_many(misses, by_id)
+
+def call_model_batch(items, meta=None):
+    # Serve what we can from the cache / translation memory, send only the misses to the model.
+    # meta (optional dict) receives "sent" (items sent to the API) and "usage".
+    results, misses = _local_split(items)
+    if meta is not None:
+        meta["sent"] = misses
+    if misses:
+        try:
+            fresh = _request_rows(misses, meta)
+        except BadResponse as e:
+            _cache_store(misses, e.rows)
+            _mark_hinted(misses, e.rows)
+            e.rows = results + e.rows  # cache hits + salvaged rows travel with the error
+            raise
+        _cache_store(misses, fresh)
+        _mark_hinted(misses, fresh)
+        results.extend(fresh)
+    return results
+
+async def acall_model_batch(items, meta=None):
+    results, misses = _local_split(items)
+    if meta is not None:
+        meta["sent"] = misses
+    if misses:
+        try:
+            fresh = await _arequest_rows(misses, meta)
+        except BadResponse as e:
+            _cache_store(misses, e.rows)
+            _mark_hinted(misses, e.rows)
+            e.rows = results + e.rows
+            raise
+        _cache_store(misses, fresh)
+        _mark_hinted(misses, fresh)
+        results.extend(fresh)
+    return results
+
+def estimate_tokens(items):
+    """Rough input+output token estimate for the rate limiter (~3 chars/token for Cyrillic JSON)."""
+    payload = len(json.dumps(items, ensure_ascii=False))
+    return (len(SYSTEM_PROMPT) + payload) // 3 + payload // 2
+
+def classify_error(e) -> str:
+    """'truncated' / 'timeout' shrink the adaptive batch hard, 'error' only a little, 'throttled' (429) not at all."""
+    if isinstance(e, (BadResponse, json.JSONDecodeError)):
+        return "truncated"
+    if isinstance(e, (APITimeoutError, httpx.TimeoutException)) or "timed out" in str(e).lower():
+        return "timeout"
+    if isinstance(e, RateLimitError):
+        return "throttled"
+    return "error"
+
+class RequeueBatch(Exception):
+    """The batch was too big for the model: put its rows back and retry them smaller."""
+
+def build_payload(df, batch_idx):
+    batch_payload = []
+    for i in batch_idx:
+        row = df.loc[i]
+        # skip rows without mandatory fields
+        if "barcode" not in row or "name" not in row:
+            continue
+        batch_payload.append({
+            "id": str(i),
+            "barcode": str(row["barcode"]),
+            "name": str(row["name"])
+        })
+    return batch_payload
+
+def _record_attempt(bi, batch_payload, meta, t0, err=None):
+    """Feed one attempt into the adaptive batcher; True if the batch should be requeued smaller."""
+    usage = meta.get("usage") or {}
+    PROGRESS.add(emit=False, tokens=(usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0),
+                 retries=int(err is not None), throttled=int(isinstance(err, RateLimitError)))
+    if BATCHER is None:
+        return False
+    t0 = meta.get("t_sent", t0)
+    sent = meta.get("sent", batch_payload)
+    if err is None:
+        if sent:  # all-cache batches say nothing about the API
+            chars = len(json.dumps(sent, ensure_ascii=False))
+            BATCHER.record(bi, len(sent), chars, time.time() - t0, usage=meta.get("usage"))
+        return False
+    kind = classify_error(err)
+    chars = len(json.dumps(sent, ensure_ascii=False))
+    BATCHER.record(bi, len(sent), chars, time.time() - t0, error=kind)
+    return kind in ("timeout", "truncated") and len(batch_payload) > BATCHER.size
+
+def call_with_retries(batch_payload, bi):
+    """(results, None) on success, (None, last error) once RETRIES are used up.
+
+    A malformed/truncated response is returned at once (BadResponse with the
+    salvaged rows) for call_isolating to split; only transient errors are retried.
+    With the shared gate a 429 does not use up a retry: the gate already holds
+    every worker back for the server's Retry-After, so the batch just asks again.
+    """
+    last_err = None
+    attempt = waits = 0
+    while attempt <= RETRIES:
+        meta, t0 = {}, time.time()
+        try:
+            results = call_model_batch(batch_payload, meta)
+            _record_attempt(bi, batch_payload, meta, t0)
+            return results, None
+        except KeyboardInterrupt:
+            raise
+        except Exception as e:
+            last_err = e
+            too_large = _record_attempt(bi, batch_payload, meta, t0, e)
+            if isinstance(e, BadResponse):
+                return None, e  # same prompt at temperature 0 gives the same answer: salvage + split instead
+            if too_large:
+                print(f"[warn] batch {bi} too large ({e}) — requeued, next size {BATCHER.size}")
+                return None, RequeueBatch(str(e))
+            if GATE is not None and isinstance(e, RateLimitError) and waits < RATE_LIMIT_MAX_WAITS:
+                waits += 1
+                print(f"[warn] batch {bi} rate-limited — waiting at the shared gate")
                 continue
+            if attempt < RETRIES:
+                sleep_s = PAUSE_BASE * (attempt + 1) + random.uniform(0, 0.3)
+                print(f"[warn] batch {bi} failed (attempt {attempt+1}): {e} — retry in {sleep_s:.1f}s")
+                time.sleep(sleep_s)
+            attempt += 1
+    return None, last_err
 
-            # Call with retries
-            last_err = None
-            for attempt in range(RETRIES + 1):
-                try:
-                    results = call_model_batch(batch_payload)
-                    last_err = None
-                    break
-                except KeyboardInterrupt:
-                    raise
-                except Exception as e:
-                    last_err = e
-                    if attempt < RETRIES:
-                        sleep_s = PAUSE_BASE * (attempt + 1) + random.uniform(0, 0.3)
-                        print(f"[warn] batch {bi} failed (attempt {attempt+1}): {e} — retry in {sleep_s:.1f}s")
-                        time.sleep(sleep_s)
-
-            if last_err:
-                # On failure keep originals, log to report
-                for item in batch_payload:
-                    i = int(item["id"])
-                    report_rows.append({
-                        "barcode": item["barcode"],
-                        "old_name": item["name"],
-                        "new_name": item["name"],
-                        "brand": df.at[i, "brand"],
-                        "productDesc": df.at[i, "productDesc"],
-                        "confidence": "low",
-                        "changes": json.dumps({"other": True}, ensure_ascii=False),
-                        "error": str(last_err)
-                    })
+async def acall_with_retries(batch_payload, bi):
+    last_err = None
+    attempt = waits = 0
+    while attempt <= RETRIES:
+        meta, t0 = {}, time.time()
+        try:
+            await LIMITER.acquire(estimate_tokens(batch_payload))
+            t0 = time.time()
+            results = await acall_model_batch(batch_payload, meta)
+            _record_attempt(bi, batch_payload, meta, t0)
+            return results, None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            last_err = e
+            too_large = _record_attempt(bi, batch_payload, meta, t0, e)
+            if isinstance(e, BadResponse):
+                return None, e  # same prompt at temperature 0 gives the same answer: salvage + split instead
+            if too_large:
+                print(f"[warn] batch {bi} too large ({e}) — requeued, next size {BATCHER.size}")
+                return None, RequeueBatch(str(e))
+            if GATE is not None and isinstance(e, RateLimitError) and waits < RATE_LIMIT_MAX_WAITS:
+                waits += 1
+                print(f"[warn] batch {bi} rate-limited — waiting at the shared gate")
                 continue
+            if attempt < RETRIES:
+                sleep_s = PAUSE_BASE * (attempt + 1) + random.uniform(0, 0.3)
+                print(f"[warn] batch {bi} failed (attempt {attempt+1}): {e} — retry in {sleep_s:.1f}s")
+                await asyncio.sleep(sleep_s)
+            attempt += 1
+    return None, last_err
+
+# ---- Salvage + bisection ----
+# A batch that comes back truncated or malformed keeps every complete row of
+# the response; the rows still missing are split in halves and sent again,
+# recursively, until the rows that really fail are isolated. Only those fall
+# back to their originals. Halves are sent one after the other (also in async
+# mode), so bisection never exceeds CONCURRENCY. If the adaptive batcher shrank
+# below the rest, the rest is requeued instead and goes out in normally sized batches.
+# Outcome of a batch: (results, failed items, last error, items to requeue).
+
+def _salvage_split(batch_payload, err):
+    """(salvaged results for this payload, payload items still unanswered)."""
+    ids = {it["id"] for it in batch_payload}
+    got = {r["id"]: r for r in err.rows if isinstance(r, dict) and r.get("id") in ids}
+    return list(got.values()), [it for it in batch_payload if it["id"] not in got]
+
+def _isolate_plan(batch_payload, bi, results, err):
+    """Outcome if no further call is needed, else (salvaged, rest) to bisect."""
+    if err is None:
+        return (results, [], None, []), None
+    if isinstance(err, RequeueBatch):
+        return ([], [], None, batch_payload), None
+    if not isinstance(err, BadResponse):
+        return ([], batch_payload, err, []), None
+    good, rest = _salvage_split(batch_payload, err)
+    if not rest:
+        return (good, [], None, []), None
+    if len(batch_payload) == 1:
+        return (good, rest, err, []), None
+    if BATCHER is not None and len(rest) > BATCHER.size:
+        print(f"[warn] batch {bi}: salvaged {len(good)} rows, requeued {len(rest)} ({err})")
+        return (good, [], None, rest), None
+    print(f"[warn] batch {bi}: salvaged {len(good)} rows, bisecting {len(rest)} ({err})")
+    return None, (good, rest)
+
+def _halves(items):
+    mid = (len(items) + 1) // 2
+    return [items[:mid], items[mid:]] if len(items) > 1 else [items]
+
+def _merge_outcomes(good, outcomes):
+    failed, last_err, requeue = [], None, []
+    for r, f, e, q in outcomes:
+        good = good + r
+        failed += f
+        requeue += q
+        last_err = e or last_err
+    return good, failed, last_err, requeue
+
+def call_isolating(batch_payload, bi):
+    results, err = call_with_retries(batch_payload, bi)
+    outcome, split = _isolate_plan(batch_payload, bi, results, err)
+    if outcome is not None:
+        return outcome
+    good, rest = split
+    return _merge_outcomes(good, [call_isolating(half, bi) for half in _halves(rest)])
+
+async def acall_isolating(batch_payload, bi):
+    results, err = await acall_with_retries(batch_payload, bi)
+    outcome, split = _isolate_plan(batch_payload, bi, results, err)
+    if outcome is not None:
+        return outcome
+    good, rest = split
+    # one half after the other: a batch never holds more than its one CONCURRENCY slot
+    return _merge_outcomes(good, [await acall_isolating(half, bi) for half in _halves(rest)])
+
+def batch_rows(df, batch_payload):
+    """(row id, barcode, original name, barcode sent to the model) for every row a batch covers.
+
+    With DEDUP_NAMES the payload holds one representative per name group;
+    its members share the representative's result but keep their own
+    barcode and original name for the per-row checks and the report.
+    """
+    for item in batch_payload:
+        i = int(item["id"])
+        yield i, item["barcode"], item["name"], item["barcode"]
+        for m in GROUPS.get(i, ()):
+            yield m, str(df.at[m, "barcode"]), str(df.at[m, "name"]), item["barcode"]
 
-            # Merge results
-            by_id = {r["id"]: r for r in results if isinstance(r, dict) and "id" in r}
-            for item in batch_payload:
-                i = int(item["id"])
-                orig_name = item["name"]
-                res = by_id.get(str(i))
-                if not res:
-                    # no change
-                    report_rows.append({
-                        "barcode": item["barcode"],
-                        "old_name": orig_name,
-                        "new_name": orig_name,
-                        "brand": df.at[i, "brand"],
-                        "productDesc": df.at[i, "productDesc"],
-                        "confidence": "low",
-                        "changes": json.dumps({"other": True}, ensure_ascii=False),
-                    })
-                    continue
-
-                # 1) barcode must match
-                if str(res.get("barcode","")) != item["barcode"]:
-                    # ignore model output for safety
-                    new_name = orig_name
-                    new_brand = df.at[i, "brand"]
-                    new_desc = df.at[i, "productDesc"]
-                    conf = "low"
-                    chg = {"other": True}
-                else:
-                    # 2) safe name choose with confidence & unit-loss guard
-                    proposed = res.get("name", orig_name)
-                    conf = res.get("confidence", "low")
-                    if conf != "high" or looks_suspicious(orig_name, proposed):
-                        new_name = orig_name
-                    else:
-                        new_name = proposed
-
-                    # 3) brand only if literally present in ORIGINAL name
-                    new_brand = brand_from_model_if_in_name(res.get("brand"), orig_name) or ""
-
-                    # 4) productDesc only when high confidence
-                    new_desc = clamp_desc(res.get("productDesc")) if conf == "high" else ""
-
-                    chg = res.get("changes", {})
-
-                # Apply
-                df.at[i, "name"] = new_name
-                df.at[i, "brand"] = new_brand
-                df.at[i, "productDesc"] = new_desc
-
-                # Report
-                report_rows.append({
-                    "barcode": item["barcode"],
-                    "old_name": orig_name,
-                    "new_name": new_name,
-                    "brand": new_brand,
-                    "productDesc": new_desc,
-                    "confidence": conf,
-                    "changes": json.dumps(chg, ensure_ascii=False)
-                })
+def apply_failure(df, batch_payload, last_err, report_rows):
+    # On failure keep originals, log to report
+    for i, barcode, orig_name, _ in batch_rows(df, batch_payload):
+        report_rows.append({
+            "barcode": barcode,
+            "old_name": ORIGINAL_NAMES.get(i, orig_name),
+            "new_name": orig_name,
+            "brand": df.at[i, "brand"],
+            "productDesc": df.at[i, "productDesc"],
+            "confidence": "low",
+            "changes": json.dumps({"other": True}, ensure_ascii=False),
+            "source": "fallback",
+            "lexicon": LEXICON_FIXES.get(i, ""),
+            "namespace": NAMESPACE_ID,
+            "error": str(last_err)
+        })
 
+def merge_row(df, i, barcode, orig_name, res, sent_barcode, report_rows):
+    """Validate one model row against row i and apply it."""
+    if not res:
+        # no change
+        report_rows.append({
+            "barcode": barcode,
+            "old_name": ORIGINAL_NAMES.get(i, orig_name),
+            "new_name": orig_name,
+            "brand": df.at[i, "brand"],
+            "productDesc": df.at[i, "productDesc"],
+            "confidence": "low",
+            "changes": json.dumps({"other": True}, ensure_ascii=False),
+            "source": "model",
+            "lexicon": LEXICON_FIXES.get(i, ""),
+            "namespace": NAMESPACE_ID,
+        })
+        return
+
+    # 1) barcode must match
+    if str(res.get("barcode","")) != sent_barcode:
+        # ignore model output for safety
+        new_name = orig_name
+        new_brand = df.at[i, "brand"]
+        new_desc = df.at[i, "productDesc"]
+        conf = "low"
+        chg = {"other": True}
+    else:
+        # 2) safe name choose with confidence & unit-loss guard
+        proposed = res.get("name", orig_name)
+        conf = res.get("confidence", "low")
+        if conf != "high" or looks_suspicious(orig_name, proposed):
+            new_name = orig_name
+        else:
+            new_name = proposed
+
+        # 3) the model's brand if literally present in the name, else the lexicon's
+        new_brand = brand_from_model_if_in_name(res.get("brand"), orig_name) or LEXICON_BRANDS.get(i) or ""
+
+        # 4) productDesc only when high confidence
+        new_desc = clamp_desc(res.get("productDesc")) if conf == "high" else ""
+
+        chg = res.get("changes", {})
+
+    # Apply
+    df.at[i, "name"] = new_name
+    df.at[i, "brand"] = new_brand
+    df.at[i, "productDesc"] = new_desc
+
+    # Report
+    report_rows.append({
+        "barcode": barcode,
+        "old_name": ORIGINAL_NAMES.get(i, orig_name),
+        "new_name": new_name,
+        "brand": new_brand,
+        "productDesc": new_desc,
+        "confidence": conf,
+        "changes": json.dumps(chg, ensure_ascii=False),
+        "source": res.get("_source", "model"),
+        "lexicon": LEXICON_FIXES.get(i, ""),
+        "namespace": NAMESPACE_ID,
+    })
+
+def apply_results(df, batch_payload, results, report_rows):
+    # Merge results (representative result fans out to its name group)
+    by_id = {r["id"]: r for r in results if isinstance(r, dict) and "id" in r}
+    for item in batch_payload:
+        res = by_id.get(item["id"])
+        for i, barcode, orig_name, sent_barcode in batch_rows(df, [item]):
+            merge_row(df, i, barcode, orig_name, res, sent_barcode, report_rows)
+
+def group_duplicate_names(df, ids):
+    """{representative id: [member ids]} for rows whose names match up to case/whitespace."""
+    first, groups = {}, {}
+    for i in ids:
+        key = normalize_name(df.at[i, "name"]).casefold()
+        rep = first.setdefault(key, i)
+        if rep != i:
+            groups.setdefault(rep, []).append(i)
+    return groups
+
+def finish_batch(df, bi, batch_payload, outcome, report_rows, pending):
+    """Apply one batch outcome; answered rows are checkpointed. Returns True if every row was answered.
+
+    outcome = (results, failed items, last error, items to requeue) from call_isolating.
+    """
+    results, failed, last_err, requeue = outcome
+    if requeue:
+        pending.extendleft(reversed([int(item["id"]) for item in requeue]))
+    skip = {item["id"] for item in requeue}
+    failed_ids = {item["id"] for item in failed}
+    done = [item for item in batch_payload if item["id"] not in skip]
+    if not done:
+        PROGRESS.emit()
+        return False
+    n0 = len(report_rows)
+    by_id = {r["id"]: r for r in results if isinstance(r, dict) and "id" in r}
+    for item in done:
+        if item["id"] in failed_ids:
+            apply_failure(df, [item], last_err, report_rows)
+        else:
+            apply_results(df, [item], [by_id[item["id"]]] if item["id"] in by_id else [], report_rows)
+    ids = [i for i, *_ in batch_rows(df, done)]
+    n_failed = sum(1 for _ in batch_rows(df, failed))
+    if JOURNAL is not None and len(ids) > n_failed:
+        # failed rows stay out of the journal so a restart retries them
+        ok = [item for item in done if item["id"] not in failed_ids]
+        JOURNAL.commit(bi, df, [i for i, *_ in batch_rows(df, ok)],
+                       [r for r in report_rows[n0:] if "error" not in r])
+    PROGRESS.add(rows=len(ids), batches=1, failed=n_failed)
+    return not failed and not requeue
+
+def next_batch(df, pending):
+    """Row ids of the next batch: token-aware when adaptive, else BATCH_SIZE rows."""
+    if BATCHER is not None:
+        return BATCHER.take(pending, lambda i: len(df.at[i, "name"]) + len(df.at[i, "barcode"]) + 40)
+    return [pending.popleft() for _ in range(min(BATCH_SIZE, len(pending)))]
+
+def run_batches(df, pending, report_rows, bi, abandon=None):
+    """Synchronous mode: one batch at a time; stops between batches once abandon() is true."""
+    while pending:
+        if abandon is not None and abandon():
+            return
+        bi += 1
+        t0 = time.time()
+        batch_payload = build_payload(df, next_batch(df, pending))
+        if not batch_payload:
+            continue
+
+        outcome = call_isolating(batch_payload, bi)
+        if finish_batch(df, bi, batch_payload, outcome, report_rows, pending):
             dt = time.time() - t0
             print(f"[ok] batch {bi}: {len(batch_payload)} rows in {dt:.1f}s")
 
+async def run_batches_async(df, pending, report_rows, bi, abandon=None):
+    """Async mode: up to CONCURRENCY batches in flight, results applied in batch order.
+
+    Once abandon() is true, no new batch starts and the ones in flight are cancelled.
+    """
+    global aclient, LIMITER
+    aclient = AsyncOpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        base_url=BASE_URL if BASE_URL else None,
+        http_client=httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_keepalive_connections=CONCURRENCY, max_connections=CONCURRENCY * 2),
+        ),
+        max_retries=CLIENT_MAX_RETRIES,
+    )
+    # with the shared gate the RPM/TPM budget is enforced there, across processes
+    LIMITER = RateLimiter() if GATE is not None else RateLimiter(rpm=RPM_LIMIT, tpm=TPM_LIMIT)
+
+    async def run_one(bi, batch_payload):
+        t0 = time.time()
+        outcome = await acall_isolating(batch_payload, bi)
+        return bi, batch_payload, outcome, time.time() - t0
+
+    # batches are cut when a slot frees up, so adaptive sizes follow recent feedback;
+    # only running tasks hold a slot: finished outcomes wait in `finished` (keyed by batch
+    # number) and the contiguous prefix is applied, so results apply strictly in batch order
+    running, finished = set(), {}
+    next_bi = bi + 1
+    try:
+        while pending or running or finished:
+            if abandon is not None and abandon():
+                return
+            while pending and len(running) < CONCURRENCY:
+                batch_payload = build_payload(df, next_batch(df, pending))
+                if batch_payload:
+                    bi += 1
+                    running.add(asyncio.create_task(run_one(bi, batch_payload)))
+            if running:
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    b, batch_payload, outcome, dt = t.result()
+                    finished[b] = (batch_payload, outcome, dt)
+            elif not finished:
+                continue
+            while next_bi in finished:
+                batch_payload, outcome, dt = finished.pop(next_bi)
+                if finish_batch(df, next_bi, batch_payload, outcome, report_rows, pending):
+                    print(f"[ok] batch {next_bi}: {len(batch_payload)} rows in {dt:.1f}s")
+                next_bi += 1
+    finally:
+        for t in running:
+            t.cancel()
+        await aclient.close()
+
+def load_input(byte_range=None):
+    # Read CSV as strings to avoid NaN surprises.
+    # byte_range=(header_bytes, byte_start, byte_stop, start_row) reads one work-queue unit only.
+    if byte_range:
+        df = read_rows(INPUT_CSV, *byte_range)
+    else:
+        df = pd.read_csv(INPUT_CSV, dtype=str).fillna("")
+    if "brand" not in df.columns: df["brand"] = ""
+    if "productDesc" not in df.columns: df["productDesc"] = ""
+    apply_lexicon(df)
+    return df
+
+def dedup_pending(df, pending):
+    # Send one representative per name group; members get its result in apply_results
+    if not DEDUP_NAMES:
+        return pending
+    GROUPS.update(group_duplicate_names(df, pending))
+    members = {m for ms in GROUPS.values() for m in ms}
+    if members:
+        print(f"[info] dedup: {len(members)} duplicate-name rows ride along with {len(GROUPS)} representatives")
+    return deque(i for i in pending if i not in members)
+
+def save_outputs(df, report_rows):
+    df.to_csv(OUTPUT_CSV, index=False)
+    pd.DataFrame(report_rows).to_csv(REPORT_CSV, index=False)
+    print(f"Updated: {OUTPUT_CSV}\nReport:  {REPORT_CSV}")
+
+def init_runtime():
+    global CACHE, MEMORY, LEXICON, BATCHER, PROGRESS, GATE
+    CACHE = open_cache()
+    MEMORY = open_memory()
+    LEXICON = open_lexicon()
+    if RATE_STATE_PATH:
+        GATE = SharedRateGate(
+            RATE_STATE_PATH, WORKER_ID, rpm=RPM_LIMIT, tpm=TPM_LIMIT,
+            breaker_threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN_SEC,
+            probe_timeout=READ_TIMEOUT_SEC * 2, state_ttl=RATE_STATE_TTL_SEC,
+        )
+    PROGRESS = ProgressReporter(PROGRESS_FD, WORKER_ID)
+    if ADAPTIVE_BATCH:
+        BATCHER = AdaptiveBatcher(
+            start=BATCH_SIZE, min_rows=BATCH_MIN, max_rows=BATCH_MAX,
+            max_input_tokens=BATCH_MAX_INPUT_TOKENS, max_output_tokens=BATCH_MAX_OUTPUT_TOKENS,
+            target_latency=BATCH_TARGET_LATENCY, prompt_chars=len(SYSTEM_PROMPT),
+            stats_path=BATCH_STATS_CSV or None,
+        )
+
+def process_rows(df, pending, report_rows, last_bi=0, abandon=None):
+    if CONCURRENCY > 1:
+        asyncio.run(run_batches_async(df, pending, report_rows, last_bi, abandon))
+    else:
+        run_batches(df, pending, report_rows, last_bi, abandon)
+
+def main():
+    global JOURNAL
+    init_runtime()
+
+    df = load_input()
+    report_rows = []
+    pending = deque(df.index.tolist())
+    last_bi = 0
+
+    # Replay the checkpoint journal and skip rows a previous (crashed) run finished
+    if JOURNAL_PATH:
+        JOURNAL = BatchJournal(JOURNAL_PATH, INPUT_CSV)
+        done = JOURNAL.replay(df, report_rows)
+        if done:
+            pending = deque(i for i in pending if str(i) not in done)
+            last_bi = JOURNAL.last_batch
+            print(f"[info] {len(pending)} rows left, continuing from batch {last_bi + 1}")
+
+    pending = dedup_pending(df, pending)
+
+    try:
+        if CONCURRENCY > 1:
+            print(f"[info] async mode: {CONCURRENCY} batches in flight, rpm={RPM_LIMIT or '∞'}, tpm={TPM_LIMIT or '∞'}")
+        process_rows(df, pending, report_rows, last_bi)
+
     except KeyboardInterrupt:
         # partial save
         print("\n[info] interrupted — writing partial files...")
@@ -332,12 +1030,238 @@ def main():
         pd.DataFrame(report_rows).to_csv(REPORT_CSV.replace(".csv", "_partial.csv"), index=False)
         print(f"[info] Partial: {OUTPUT_CSV.replace('.csv','_partial.csv')}")
         print(f"[info] Partial: {REPORT_CSV.replace('.csv','_partial.csv')}")
+        print_run_summary()
         return
 
     # Final save
-    df.to_csv(OUTPUT_CSV, index=False)
-    pd.DataFrame(report_rows).to_csv(REPORT_CSV, index=False)
-    print(f"Updated: {OUTPUT_CSV}\nReport:  {REPORT_CSV}")
+    save_outputs(df, report_rows)
+    if JOURNAL is not None:
+        JOURNAL.close(remove=True)  # outputs are complete, nothing to resume
+    print_run_summary()
+
+# ---- Work-queue worker (run_parallel) ----
+# With WORK_QUEUE set, the script pulls row ranges from the shared queue until
+# none are claimable and commits each range's merged values + report rows there.
+# The queue is the checkpoint, so the journal is not used in this mode.
+# Workers on other hosts just need the same queue file and input CSV (shared
+# filesystem); a heartbeat thread keeps the current unit's lease alive.
+# Each unit's rows are read from their byte range in the input, so a worker
+# never holds more than one unit of the catalog.
+
+def queue_worker():
+    init_runtime()
+    queue = WorkQueue(WORK_QUEUE, LEASE_SEC)
+    header_bytes = int(queue.meta("header_bytes") or 0)
+    fingerprint = queue.meta("fingerprint")
+    if fingerprint != file_fingerprint(INPUT_CSV):
+        print(f"[error] {INPUT_CSV} does not match the input the queue {WORK_QUEUE} was built for")
+        sys.exit(2)
+    keeper = LeaseKeeper(WORK_QUEUE, LEASE_SEC)
+    units = 0
+    print(f"[info] worker {WORKER_ID}: pulling from {WORK_QUEUE} (lease {LEASE_SEC:.0f}s)")
+    while True:
+        unit = queue.claim(WORKER_ID)
+        if unit is None:
+            break
+        unit_id, start, stop, byte_start, byte_stop = unit
+        t0 = time.time()
+        df = load_input((header_bytes, byte_start, byte_stop, start))
+        GROUPS.clear()
+        pending = dedup_pending(df, deque(range(start, stop)))
+        report_rows = []
+        PROGRESS.unit = unit_id
+        PROGRESS.emit()
+        keeper.start(unit_id, WORKER_ID)
+        try:
+            # a lost lease means another worker owns the unit: stop paying for it
+            process_rows(df, pending, report_rows, abandon=lambda: keeper.lost)
+        finally:
+            keeper.stop()
+        if keeper.lost:
+            print(f"[warn] unit {unit_id} abandoned: lease lost to another worker")
+            continue
+        rows = {str(i): {col: cell_text(df.at[i, col]) for col in MERGED_COLS} for i in range(start, stop)}
+        if queue.complete(unit_id, WORKER_ID, rows, report_rows):
+            units += 1
+            print(f"[ok] unit {unit_id}: rows {start}-{stop - 1} in {time.time() - t0:.1f}s")
+        else:
+            print(f"[warn] unit {unit_id} was already committed by another worker; result dropped")
+    queue.close()
+    print(f"[info] worker {WORKER_ID}: queue drained after {units} units")
+    print_run_summary()
+
+# ---- Offline batch-job mode (Batch API JSONL) ----
+# batch-export writes one /v1/chat/completions request per batch; the provider
+# runs them as a bulk job. batch-import reads the request file back (to know
+# which rows each custom_id covered) plus the provider's output file and runs
+# every answer through the same merge/validation as the live loop.
+
+def _batch_custom_id(fingerprint, bi):
+    return f"{fingerprint[:12]}-b{bi:06d}"
+
+def batch_export(requests_path):
+    global CACHE, MEMORY, LEXICON
+    CACHE = open_cache()
+    MEMORY = open_memory()
+    LEXICON = open_lexicon()
+    df = load_input()
+    pending = dedup_pending(df, deque(df.index.tolist()))
+    fingerprint = file_fingerprint(INPUT_CSV)
+
+    n_req = n_rows = n_cached = bi = 0
+    with open(requests_path, "w", encoding="utf-8") as f:
+        while pending:
+            bi += 1
+            batch_payload = build_payload(df, [pending.popleft() for _ in range(min(BATCH_SIZE, len(pending)))])
+            _, misses = _local_split(batch_payload)  # cached/remembered rows are applied at import
+            n_cached += len(batch_payload) - len(misses)
+            if not misses:
+                continue
+            f.write(json.dumps({
+                "custom_id": _batch_custom_id(fingerprint, bi),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": MODEL,
+                    "temperature": 0,
+                    "response_format": RESPONSE_FORMAT,
+                    "messages": _messages(misses),
+                },
+            }, ensure_ascii=False) + "\n")
+            n_req += 1
+            n_rows += len(misses)
+    print(f"[ok] batch requests: {requests_path} ({n_req} requests, {n_rows} rows, {n_cached} already cached or in translation memory)")
+
+def _read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def batch_import(requests_path, responses_path):
+    global CACHE, MEMORY, LEXICON
+    CACHE = open_cache()
+    MEMORY = open_memory()
+    LEXICON = open_lexicon()
+    df = load_input()
+    pending = dedup_pending(df, deque(df.index.tolist()))
+    fingerprint = file_fingerprint(INPUT_CSV)
+
+    # payload of every request, keyed by custom_id
+    sent = {}
+    for req in _read_jsonl(requests_path):
+        cid = req["custom_id"]
+        if not cid.startswith(fingerprint[:12]):
+            print(f"[error] {requests_path} was exported from a different {INPUT_CSV}", file=sys.stderr)
+            sys.exit(2)
+        sent[cid] = json.loads(req["body"]["messages"][-1]["content"])
+    answers = {cid: (None, RuntimeError(f"no response for {cid}")) for cid in sent}
+    for out in _read_jsonl(responses_path):
+        resp, err = out.get("response") or {}, out.get("error")
+        if err or resp.get("status_code") != 200:
+            answers[out["custom_id"]] = (None, RuntimeError(f"batch error: {err or resp.get('status_code')}"))
+            continue
+        content = None
+        try:
+            choice = resp["body"]["choices"][0]
+            content = choice["message"].get("content")
+            if choice.get("finish_reason") == "length":
+                raise TruncatedResponse("response truncated at max tokens", salvage_rows(content))
+            if content is None:
+                raise BadResponse(f"no content (refusal: {choice['message'].get('refusal') or '?'})")
+            rows = json.loads(content).get("rows", [])
+            if not isinstance(rows, list):
+                raise BadResponse('"rows" is not an array')
+            answers[out["custom_id"]] = (rows, None)
+        except BadResponse as e:
+            answers[out["custom_id"]] = (e.rows, e)
+        except (KeyError, IndexError, TypeError, AttributeError, ValueError) as e:
+            # missing body/choices, a refusal (content null), JSON that is not an object: this request only
+            rows = salvage_rows(content) if isinstance(content, str) else []
+            answers[out["custom_id"]] = (rows, RuntimeError(f"bad batch output: {type(e).__name__}: {e}"))
+
+    # per row: the model's answer, or the error of the request that covered it;
+    # complete rows salvaged from a truncated/malformed answer still count
+    rows_by_id, err_by_id = {}, {}
+    for cid, items in sent.items():
+        rows, err = answers[cid]
+        rows = rows or []
+        _cache_store(items, rows)
+        answered = {r["id"]: r for r in rows if isinstance(r, dict) and "id" in r}
+        for it in items:
+            if not err:
+                rows_by_id[it["id"]] = answered.get(it["id"])
+            elif it["id"] in answered:
+                rows_by_id[it["id"]] = answered[it["id"]]
+            else:
+                err_by_id[it["id"]] = err
+
+    # replay in row order; rows cached or remembered at export time were not sent at all
+    report_rows = []
+    n_ok = n_failed = 0
+    for item in build_payload(df, list(pending)):
+        if item["id"] in rows_by_id:
+            res = rows_by_id[item["id"]]
+            apply_results(df, [item], [res] if res else [], report_rows)
+            n_ok += 1
+            continue
+        cached, _ = _local_split([item])
+        if cached:
+            apply_results(df, [item], cached, report_rows)
+            n_ok += 1
+        else:
+            apply_failure(df, [item], err_by_id.get(item["id"], "row not in request file"), report_rows)
+            n_failed += 1
+
+    save_outputs(df, report_rows)
+    print(f"[info] batch import: {n_ok} representative rows merged, {n_failed} kept original")
+    print_run_summary()
+
+def batch_echo(requests_path, responses_path):
+    """Write a local response file that echoes every row unchanged (for testing batch-import)."""
+    with open(responses_path, "w", encoding="utf-8") as f:
+        for req in _read_jsonl(requests_path):
+            items = json.loads(req["body"]["messages"][-1]["content"])
+            rows = [{
+                "id": it["id"], "barcode": it["barcode"], "name": it["name"],
+                "brand": None, "productDesc": None, "changed": False,
+                "changes": {"spelling": False, "units": False, "punctuation": False, "brandFix": False, "other": False},
+                "confidence": "medium",
+            } for it in items]
+            f.write(json.dumps({
+                "id": f"echo-{req['custom_id']}",
+                "custom_id": req["custom_id"],
+                "response": {"status_code": 200, "body": {"choices": [{
+                    "index": 0, "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": json.dumps({"rows": rows}, ensure_ascii=False)},
+                }]}},
+                "error": None,
+            }, ensure_ascii=False) + "\n")
+    print(f"[ok] echo responses: {responses_path}")
+
+def build_cli():
+    p = argparse.ArgumentParser(description="Normalize catalog names with the model (live loop or offline batch job).")
+    sub = p.add_subparsers(dest="cmd")
+    sub.add_parser("run", help="Live request loop (default)")
+    e = sub.add_parser("batch-export", help="Write all batches as a Batch-API JSONL request file")
+    e.add_argument("requests", nargs="?", default="batch_requests.jsonl")
+    i = sub.add_parser("batch-import", help="Merge a Batch-API output file into OUTPUT_CSV/REPORT_CSV")
+    i.add_argument("responses")
+    i.add_argument("--requests", default="batch_requests.jsonl", help="Request file the job was created from")
+    t = sub.add_parser("batch-echo", help="Generate an echo response file locally (to test batch-import)")
+    t.add_argument("requests")
+    t.add_argument("responses")
+    return p
 
 if __name__ == "__main__":
-    main()
+    args = build_cli().parse_args()
+    if args.cmd == "batch-export":
+        batch_export(args.requests)
+    elif args.cmd == "batch-import":
+        batch_import(args.requests, args.responses)
+    elif args.cmd == "batch-echo":
+        batch_echo(args.requests, args.responses)
+    elif WORK_QUEUE:
+        queue_worker()
+    else:
+        main()
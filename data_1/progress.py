@@ -0,0 +1,142 @@
+# progress.py
+"""
+Structured progress from modifier_1_0 workers to the run_parallel supervisor.
+
+Worker side: ProgressReporter writes one JSON line with its cumulative
+counters to the pipe fd given in PROGRESS_FD after every batch:
+    {"worker": "host-w0", "unit": 3, "rows": 450, "batches": 12, "failed": 0,
+     "retries": 2, "throttled": 1, "tokens": 48213, "ts": 1718000000.0}
+Cumulative snapshots make a lost or partial line harmless. Without
+PROGRESS_FD (plain single-process runs) nothing is written.
+
+Supervisor side: ProgressBoard keeps the last snapshot per worker slot and
+renders one aggregated view: rows/s over the last minute, ETA, and per worker
+rows/s, lag since its last report, failures, retries and 429s.
+"""
+
+import json
+import os
+import time
+from collections import deque
+
+COUNTERS = ("rows", "batches", "failed", "retries", "throttled", "tokens")
+
+
+class ProgressReporter:
+    def __init__(self, fd: str | int | None, worker: str):
+        self.worker = worker
+        self.unit = None
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.f = None
+        if fd not in (None, ""):
+            try:
+                self.f = os.fdopen(int(fd), "w", buffering=1, encoding="utf-8")
+            except OSError:
+                self.f = None
+
+    def add(self, emit: bool = True, **deltas):
+        for k, v in deltas.items():
+            self.counts[k] += v
+        if emit:
+            self.emit()
+
+    def emit(self):
+        if self.f is None:
+            return
+        try:
+            self.f.write(json.dumps({"worker": self.worker, "unit": self.unit, **self.counts,
+                                     "ts": time.time()}) + "\n")
+        except (BrokenPipeError, OSError):
+            self.f = None  # supervisor went away; keep working without reporting
+
+
+class ProgressBoard:
+    def __init__(self, total_rows: int, done_rows: int = 0, window_sec: float = 60.0):
+        self.total_rows = total_rows
+        self.base_rows = done_rows        # rows already committed before this run
+        self.window_sec = window_sec
+        self.started = time.time()
+        self.last = {}                    # slot -> latest snapshot
+        self.seen = {}                    # slot -> time of latest snapshot
+        self.carried = {}                 # slot -> counters of earlier (restarted) processes
+        self.history = deque()            # (t, rows done this run)
+        self.buffers = {}                 # fd -> partial line bytes
+
+    # ---- input ----
+    def feed(self, slot, fd: int, data: bytes):
+        buf = self.buffers.get(fd, b"") + data
+        *lines, self.buffers[fd] = buf.split(b"\n")
+        for line in lines:
+            try:
+                snap = json.loads(line)
+            except ValueError:
+                continue
+            self.last[slot] = snap
+            self.seen[slot] = time.time()
+
+    def restarted(self, slot):
+        """A worker slot got a new process: its counters start again from zero."""
+        snap = self.last.pop(slot, None)
+        if snap:
+            carried = self.carried.setdefault(slot, dict.fromkeys(COUNTERS, 0))
+            for k in COUNTERS:
+                carried[k] += snap.get(k, 0)
+
+    def close_fd(self, fd: int):
+        self.buffers.pop(fd, None)
+
+    # ---- aggregation ----
+    def slot_counts(self, slot) -> dict:
+        out = dict(self.carried.get(slot, dict.fromkeys(COUNTERS, 0)))
+        for k in COUNTERS:
+            out[k] += self.last.get(slot, {}).get(k, 0)
+        return out
+
+    def totals(self) -> dict:
+        out = dict.fromkeys(COUNTERS, 0)
+        for slot in set(self.last) | set(self.carried):
+            for k, v in self.slot_counts(slot).items():
+                out[k] += v
+        return out
+
+    def rate(self, now: float) -> float:
+        rows = self.totals()["rows"]
+        self.history.append((now, rows))
+        while len(self.history) > 2 and now - self.history[0][0] > self.window_sec:
+            self.history.popleft()
+        t0, r0 = self.history[0]
+        return (rows - r0) / (now - t0) if now > t0 else 0.0
+
+    def render(self, slots, states=None) -> str:
+        """Multi-line aggregated view; `states` maps slot -> short process state."""
+        now = time.time()
+        tot = self.totals()
+        rps = self.rate(now)
+        done = min(self.total_rows, self.base_rows + tot["rows"])
+        left = self.total_rows - done
+        eta = _fmt_dur(left / rps) if rps > 0 else "?"
+        pct = (100.0 * done / self.total_rows) if self.total_rows else 100.0
+        lines = [
+            f"[progress] {done}/{self.total_rows} rows ({pct:.1f}%) | {rps:.1f} rows/s | ETA {eta} | "
+            f"elapsed {_fmt_dur(now - self.started)} | failed {tot['failed']} | retries {tot['retries']} | "
+            f"429s {tot['throttled']} | tokens {tot['tokens']}"
+        ]
+        for slot in slots:
+            c = self.slot_counts(slot)
+            snap = self.last.get(slot, {})
+            seen = self.seen.get(slot)
+            lag = f"{now - seen:.0f}s" if seen else "-"
+            wall = now - self.started
+            lines.append(
+                f"    worker {slot}: {(states or {}).get(slot, 'done'):<9} unit {snap.get('unit', '-')!s:<4} "
+                f"rows {c['rows']:<6} {c['rows'] / wall if wall > 0 else 0:5.1f}/s  lag {lag:<5} "
+                f"failed {c['failed']} retries {c['retries']} 429s {c['throttled']}"
+            )
+        return "\n".join(lines)
+
+
+def _fmt_dur(sec: float) -> str:
+    sec = int(sec)
+    h, rem = divmod(sec, 3600)
+    m, s = divmod(rem, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m}:{s:02d}"
@@ -0,0 +1,335 @@
+# rate_limit.py
+"""
+Token-bucket limiters for modifier_1_0.
+
+- TokenBucket: `capacity` units per minute, refilled continuously.
+- RateLimiter: one bucket for requests/min and one for tokens/min; a request
+  waits until both have room. A limit <= 0 disables that bucket.
+
+- SharedRateGate: the same budget shared by all worker processes through a
+  SQLite row, plus 429 pauses (Retry-After / x-ratelimit-* headers) and a
+  circuit breaker; see the section below.
+
+Usage:
+    limiter = RateLimiter(rpm=500, tpm=200_000)
+    await limiter.acquire(tokens=estimated_tokens)
+"""
+
+import asyncio
+import re
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from work_queue import sqlite_journal_mode
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0     # units per second
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 if they are now)."""
+        self._refill()
+        amount = min(amount, self.capacity)  # a single oversized request must still pass eventually
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 0):
+        # the lock keeps waiters FIFO so a big batch is not starved by small ones
+        async with self._lock:
+            while True:
+                wait = 0.0
+                if self.requests:
+                    wait = max(wait, self.requests.wait_time(1))
+                if self.tokens and tokens:
+                    wait = max(wait, self.tokens.wait_time(tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens and tokens:
+                self.tokens.take(tokens)
+
+
+# ---- Cross-process gate (run_parallel workers) ----
+# One SQLite row shared by every worker process on the host (or share):
+#   - token buckets for requests/min and tokens/min (the *global* budget),
+#   - paused_until: set from Retry-After / x-ratelimit-reset-* on a 429, or
+#     when x-ratelimit-remaining-* reaches zero, so all workers wait together,
+#   - a learned request rate (AIMD, only under an RPM budget): a 429 sets it to
+#     70% of the rate actually achieved just before (never below 10% of the
+#     budget), every success adds 1 rpm back — so after a pause the workers do
+#     not all burst into the next 429. Without a budget a 429 only pauses
+#     (Retry-After) and counts toward the breaker,
+#   - a circuit breaker: after BREAKER_THRESHOLD consecutive 429s/overloads it
+#     opens and nobody calls the API for `cooldown` seconds; then one worker
+#     sends a probe (half-open). A good probe closes the breaker; a bad one
+#     reopens it with a doubled cooldown.
+# State untouched for `state_ttl` seconds (an earlier run) is reset on open, so
+# a learned rate, an open breaker or a pause never leaks into the next run.
+# The SQLite transactions block (busy timeout), so the async path runs them in
+# a worker thread (aacquire / areport) and never on the event loop.
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value) -> float | None:
+    """'1.5', '20ms', '6m0s', '1h2m' → seconds (None if unparseable)."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+
+
+def retry_after(headers) -> float | None:
+    """Seconds the server asked us to wait: retry-after-ms, retry-after, then the reset headers."""
+    if not headers:
+        return None
+    ms = headers.get("retry-after-ms")
+    if ms is not None:
+        try:
+            return float(ms) / 1000.0
+        except ValueError:
+            pass
+    ra = headers.get("retry-after")
+    if ra is not None:
+        sec = parse_duration(ra)
+        if sec is None:  # HTTP-date form
+            try:
+                sec = parsedate_to_datetime(ra).timestamp() - time.time()
+            except (TypeError, ValueError):
+                sec = None
+        if sec is not None:
+            return max(0.0, sec)
+    resets = [parse_duration(headers.get(h)) for h in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+    resets = [r for r in resets if r is not None]
+    return max(resets) if resets else None
+
+
+class SharedRateGate:
+    def __init__(self, path, worker: str, rpm: float = 0, tpm: float = 0,
+                 breaker_threshold: int = 5, cooldown: float = 15.0, cooldown_cap: float = 300.0,
+                 probe_timeout: float = 120.0, state_ttl: float = 600.0):
+        self.worker = worker
+        self.rpm, self.tpm = float(rpm), float(tpm)
+        self.breaker_threshold = breaker_threshold
+        self.base_cooldown, self.cooldown_cap = cooldown, cooldown_cap
+        self.probe_timeout = probe_timeout
+        self.waited = 0.0          # seconds this process spent waiting at the gate
+        self.rate_limited = 0      # 429s seen by this process
+        self.lock = threading.Lock()  # one connection, used from the loop's worker threads too
+        self.conn = sqlite3.connect(str(path), timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute(f"PRAGMA journal_mode={sqlite_journal_mode()}")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS gate ("
+            " id INTEGER PRIMARY KEY CHECK (id = 1),"
+            " req_level REAL, tok_level REAL, updated REAL,"
+            " paused_until REAL NOT NULL DEFAULT 0,"
+            " breaker TEXT NOT NULL DEFAULT 'closed',"
+            " open_until REAL NOT NULL DEFAULT 0,"
+            " cooldown REAL NOT NULL,"
+            " failures INTEGER NOT NULL DEFAULT 0,"
+            " probe_worker TEXT, probe_until REAL,"
+            " learned_rpm REAL NOT NULL DEFAULT 0,"
+            " win_start REAL NOT NULL DEFAULT 0,"
+            " win_calls INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.conn.execute(
+            "INSERT OR IGNORE INTO gate(id, req_level, tok_level, updated, cooldown) VALUES (1, ?, ?, ?, ?)",
+            (self.rpm, self.tpm, time.time(), self.base_cooldown),
+        )
+        self._txn(lambda st, now: self._reset_stale(st, now, state_ttl))
+
+    def _reset_stale(self, st, now, ttl):
+        if st["updated"] and now - st["updated"] <= ttl:
+            return  # other workers of this run are active
+        st.update(req_level=self.rpm, tok_level=self.tpm, paused_until=0, breaker="closed", open_until=0,
+                  cooldown=self.base_cooldown, failures=0, probe_worker=None, probe_until=None,
+                  learned_rpm=0, win_start=0, win_calls=0)
+        st["updated"] = now
+
+    def _txn(self, fn):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                cur = self.conn.execute("SELECT * FROM gate WHERE id=1")
+                cols = [d[0] for d in cur.description]
+                st = dict(zip(cols, cur.fetchone()))
+                out = fn(st, time.time())
+                self.conn.execute(
+                    "UPDATE gate SET " + ", ".join(f"{k}=?" for k in cols if k != "id") + " WHERE id=1",
+                    [st[k] for k in cols if k != "id"],
+                )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            return out
+
+    def _req_rate(self, st):
+        """(requests/min, bucket capacity); the learned rate only allows a ~2s burst."""
+        learned = st["learned_rpm"]
+        if learned > 0 and (self.rpm <= 0 or learned < self.rpm):
+            return learned, max(1.0, learned / 30.0)
+        return self.rpm, self.rpm
+
+    # ---- before a call ----
+    def _try_take(self, st, now, tokens):
+        """0 if the call may go now (budget taken), else seconds to wait before asking again."""
+        dt = max(0.0, now - (st["updated"] or now))
+        st["updated"] = now
+        rpm, cap = self._req_rate(st)
+        if rpm > 0:
+            st["req_level"] = min(cap, (st["req_level"] or 0) + dt * rpm / 60.0)
+        if self.tpm > 0:
+            st["tok_level"] = min(self.tpm, (st["tok_level"] or 0) + dt * self.tpm / 60.0)
+
+        if st["breaker"] == "open":
+            if now < st["open_until"]:
+                return st["open_until"] - now
+            st["breaker"], st["probe_worker"] = "half_open", None
+            print("[info] rate gate: circuit half-open, probing")
+        if now < st["paused_until"]:
+            return st["paused_until"] - now
+        if st["breaker"] == "half_open":
+            if st["probe_worker"] not in (None, self.worker) and (st["probe_until"] or 0) > now:
+                return 0.5  # someone else's probe is in flight
+            st["probe_worker"], st["probe_until"] = self.worker, now + self.probe_timeout
+
+        wait = 0.0
+        if rpm > 0 and st["req_level"] < 1:
+            wait = max(wait, (1 - st["req_level"]) * 60.0 / rpm)
+        need = min(tokens, self.tpm)
+        if self.tpm > 0 and need and st["tok_level"] < need:
+            wait = max(wait, (need - st["tok_level"]) * 60.0 / self.tpm)
+        if wait > 0:
+            return wait
+        if rpm > 0:
+            st["req_level"] -= 1
+        if self.tpm > 0:
+            st["tok_level"] -= need
+        if now - st["win_start"] > 30:
+            st["win_start"], st["win_calls"] = now, 0
+        st["win_calls"] += 1
+        return 0.0
+
+    def wait_time(self, tokens: float = 0) -> float:
+        return self._txn(lambda st, now: self._try_take(st, now, tokens))
+
+    def acquire(self, tokens: float = 0):
+        while (wait := self.wait_time(tokens)) > 0:
+            wait = min(wait, 5.0)  # re-check: the pause may be lifted or extended meanwhile
+            self.waited += wait
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: float = 0):
+        while (wait := await asyncio.to_thread(self.wait_time, tokens)) > 0:
+            wait = min(wait, 5.0)
+            self.waited += wait
+            await asyncio.sleep(wait)
+
+    # ---- after a call ----
+    def on_success(self, headers=None):
+        def fn(st, now):
+            st["failures"] = 0
+            if st["learned_rpm"] > 0:
+                st["learned_rpm"] += 1
+                if 0 < self.rpm <= st["learned_rpm"]:
+                    st["learned_rpm"] = 0
+            if st["breaker"] == "half_open" and st["probe_worker"] == self.worker:
+                st["breaker"], st["probe_worker"], st["cooldown"] = "closed", None, self.base_cooldown
+                print("[info] rate gate: probe OK, circuit closed")
+            if not headers:
+                return
+            rem_req = parse_duration(headers.get("x-ratelimit-remaining-requests"))
+            rem_tok = parse_duration(headers.get("x-ratelimit-remaining-tokens"))
+            if rem_req is not None:
+                if self._req_rate(st)[0] > 0:
+                    st["req_level"] = min(st["req_level"], rem_req)
+                if rem_req < 1:
+                    reset = parse_duration(headers.get("x-ratelimit-reset-requests")) or 1.0
+                    st["paused_until"] = max(st["paused_until"], now + reset)
+            if rem_tok is not None:
+                if self.tpm > 0:
+                    st["tok_level"] = min(st["tok_level"], rem_tok)
+                if rem_tok < 1:
+                    reset = parse_duration(headers.get("x-ratelimit-reset-tokens")) or 1.0
+                    st["paused_until"] = max(st["paused_until"], now + reset)
+        self._txn(fn)
+
+    def _failure(self, st, now, pause):
+        st["failures"] += 1
+        if pause:
+            st["paused_until"] = max(st["paused_until"], now + pause)
+        probe_failed = st["breaker"] == "half_open" and st["probe_worker"] == self.worker
+        if probe_failed or (st["breaker"] == "closed" and st["failures"] >= self.breaker_threshold):
+            if probe_failed:
+                st["cooldown"] = min(self.cooldown_cap, st["cooldown"] * 2)
+            st["breaker"], st["probe_worker"] = "open", None
+            st["open_until"] = now + max(st["cooldown"], pause or 0)
+            print(f"[warn] rate gate: circuit OPEN for {st['open_until'] - now:.0f}s "
+                  f"after {st['failures']} consecutive failures — all workers pause")
+
+    def _slow_down(self, st, now):
+        """Multiplicative decrease of the shared request rate after a 429."""
+        span = now - st["win_start"]
+        seen = st["win_calls"] * 60.0 / span if span >= 1 and st["win_calls"] else None
+        rates = [r for r in (seen, st["learned_rpm"] or None, self.rpm) if r]
+        if self.rpm > 0:  # no budget: nothing to shrink, Retry-After and the breaker handle it
+            st["learned_rpm"] = max(6.0, 0.1 * self.rpm, 0.7 * min(rates))
+            st["req_level"] = 0.0
+            print(f"[warn] rate gate: 429 — shared request rate now {st['learned_rpm']:.0f}/min")
+        st["win_start"], st["win_calls"] = now, 0
+
+    def on_rate_limited(self, headers=None):
+        self.rate_limited += 1
+        pause = retry_after(headers)
+
+        def fn(st, now):
+            self._slow_down(st, now)
+            self._failure(st, now, pause if pause is not None else min(60.0, 2.0 ** st["failures"]))
+        self._txn(fn)
+
+    def on_overload(self):
+        """5xx / connection trouble: counts toward the breaker, no explicit pause."""
+        self._txn(lambda st, now: self._failure(st, now, None))
+
+    def summary(self) -> str:
+        st = self.conn.execute("SELECT breaker, failures, learned_rpm FROM gate WHERE id=1").fetchone()
+        return (f"rate gate: waited {self.waited:.1f}s, 429s={self.rate_limited}, "
+                f"breaker={st[0]} (failures={st[1]})"
+                + (f", learned rate {st[2]:.0f}/min" if st[2] else ""))
+
+    def close(self):
+        self.conn.close()
@@ -1,19 +1,48 @@
 # run_parallel.py
+"""
+Supervisor for modifier_1_0 workers over a shared work queue (work_queue.sqlite).
+
+Single host (default): build the queue, run NUM_WORKERS local workers, merge.
+Local workers report progress over a pipe; the supervisor (POSIX: SIGCHLD +
+selectors) reacts to exits at once and shows one aggregated live view.
+
+Several hosts (queue + input on a shared filesystem). WAL does not work
+across machines, so every command uses --shared-fs (rollback journal; workers
+started by hand need SQLITE_JOURNAL_MODE=DELETE), see work_queue.py:
+    python run_parallel.py --shared-fs --init                  # once: build the queue
+    python run_parallel.py --shared-fs --workers 4 --no-merge  # on each host (or run
+        SQLITE_JOURNAL_MODE=DELETE WORK_QUEUE=/share/work_queue.sqlite python modifier_1_0.py  by hand)
+    python run_parallel.py --shared-fs --merge --wait          # once: merge when all units are committed
+    python run_parallel.py --shared-fs --status
+"""
+import argparse
 import os
+import selectors
+import signal
+import socket
 import sys
-import shutil
 import subprocess
 import time
 from pathlib import Path
 import pandas as pd
 
+from journal import file_fingerprint, MERGED_COLS
+from work_queue import WorkQueue, DEFAULT_LEASE_SEC
+from progress import ProgressBoard
+from csv_ranges import scan_units, read_rows
+
 # ========== SIMPLE CONFIG ==========
 BASE_DIR        = Path(".")            # run from data_1 folder
 SCRIPT_FILENAME = "modifier_1_0.py"    # your existing script
+CACHE_NAME      = "llm_cache.sqlite"   # one response cache shared by all workers
+QUEUE_NAME      = "work_queue.sqlite"  # shared queue of row ranges (progress survives restarts)
+RATE_STATE_NAME = "rate_state.sqlite"  # shared rate budget / 429 pause / circuit breaker for all workers
 INPUT_NAME      = "data_1_0.csv"
 OUTPUT_NAME     = "data_1_1.csv"
 REPORT_NAME     = "data_1_0_changes.csv"
-NUM_WORKERS     = 5                    # ← five shards
+NUM_WORKERS     = 5                    # ← five workers
+UNIT_ROWS       = 150                  # rows per queue unit (a few model batches)
+LEASE_SEC       = DEFAULT_LEASE_SEC    # a unit without heartbeat for this long is claimable again
 
 # Optional: override env vars your script reads (no script edits needed)
 SCRIPT_ENV_OVERRIDES = {
@@ -23,6 +52,9 @@ SCRIPT_ENV_OVERRIDES = {
     "RETRIES": "8",              # per-batch retries inside your script
     "READ_TIMEOUT_SEC": "90",    # longer HTTP read timeout
 }
+# Live progress view: redraw interval on a terminal / print interval when logging to a file
+PROGRESS_EVERY_SEC_TTY = 1
+PROGRESS_EVERY_SEC     = 30
 # Backoff for restarting whole workers if the process exits non-zero
 RESTART_BACKOFF_BASE_SEC = 20       # initial wait
 RESTART_BACKOFF_FACTOR   = 1.6      # exponential growth
@@ -30,206 +62,346 @@ RESTART_BACKOFF_CAP_SEC  = 300      # max 5 minutes between restarts
 # ===================================
 
 
-def copy_env_if_present(src_dir: Path, dst_dir: Path):
-    """Copy a .env into the shard dir if we find one nearby."""
-    for cand in [src_dir / ".env", Path(".") / ".env", Path("..") / ".env"]:
-        if cand.exists():
-            shutil.copy2(cand, dst_dir / ".env")
-            return cand
-    return None
-
+def launch_worker(worker_id: int, base_dir: Path, env: dict):
+    """Start one worker process with unbuffered output into its own log.
 
-def launch_worker(shard_id: int, shard_dir: Path, env: dict):
-    """Start one worker process with unbuffered output into its own log."""
-    log_path = shard_dir / "logs" / f"worker_{shard_id}.log"
+    The worker also gets the write end of a pipe (PROGRESS_FD) for its
+    structured progress lines; the read end is returned for the selector.
+    """
+    log_path = base_dir / "logs" / f"worker_{worker_id}.log"
     logf = open(log_path, "a", encoding="utf-8")
-    print(f"[info] Starting worker {shard_id} in {shard_dir} → log {log_path}")
+    progress_r, progress_w = os.pipe()
+    os.set_blocking(progress_r, False)
+    env = dict(env, PROGRESS_FD=str(progress_w))
     p = subprocess.Popen(
         [sys.executable, "-u", SCRIPT_FILENAME],
-        cwd=str(shard_dir),
+        cwd=str(base_dir),
         env=env,
         stdout=logf,
         stderr=subprocess.STDOUT,
+        pass_fds=(progress_w,),
     )
-    return p, logf, log_path
+    os.close(progress_w)  # only the child writes; EOF on progress_r once it exits
+    return p, logf, log_path, progress_r
 
 
-def main():
-    base_dir = BASE_DIR
-    base_dir.mkdir(exist_ok=True)
-
-    script_path = base_dir / SCRIPT_FILENAME
-    input_path  = base_dir / INPUT_NAME
-
-    if not script_path.exists():
-        print(f"[error] Could not find script: {script_path}")
-        sys.exit(1)
-    if not input_path.exists():
-        print(f"[error] Could not find input CSV: {input_path}")
-        sys.exit(1)
+def merge_outputs(base_dir: Path, queue: WorkQueue, input_path: Path) -> int:
+    """Stream every committed unit, in row order, into the merged output + report.
 
-    print(f"[info] Using script: {script_path}")
-    print(f"[info] Using input : {input_path}")
-
-    # Load full dataset
-    df = pd.read_csv(input_path, dtype=str).fillna("")
-    print(f"[info] Loaded {len(df)} rows from input")
-
-    # Add helper column if missing
-    if "global_row" not in df.columns:
-        df.insert(0, "global_row", range(len(df)))
-        print(f"[info] Added global_row column")
-
-    # Shard by modulo
-    shards = []
-    for w in range(NUM_WORKERS):
-        shard_df = df[df["global_row"].astype(int) % NUM_WORKERS == w].copy()
-        shards.append(shard_df)
-        print(f"[info] Prepared shard {w} with {len(shard_df)} rows")
-
-    # Create shard dirs & inputs
-    workdirs = []
-    for w, shard_df in enumerate(shards):
-        shard_dir = base_dir / f"shard_{w}"
-        shard_dir.mkdir(exist_ok=True)
-        workdirs.append(shard_dir)
-
-        shutil.copy2(script_path, shard_dir / SCRIPT_FILENAME)
-
-        # Optional: copy .env so load_dotenv() finds your keys
-        found_env = copy_env_if_present(base_dir, shard_dir)
-        if found_env:
-            print(f"[info] Copied .env from {found_env} → {shard_dir / '.env'}")
-
-        shard_input = shard_dir / INPUT_NAME
-        shard_df.to_csv(shard_input, index=False)
-        print(f"[info] Wrote input for shard {w} → {shard_input}")
-
-        (shard_dir / "logs").mkdir(exist_ok=True)
-
-    # Launch & supervise workers with auto-restart
-    # We keep retrying a shard process until it finishes with rc==0
-    active = {}
-    for w, shard_dir in enumerate(workdirs):
+    Each unit's input rows are read from their byte range, patched with the
+    unit's results and appended to the output, so memory stays at one unit
+    whatever the catalog size. Returns the number of rows written.
+    """
+    header_bytes = int(queue.meta("header_bytes") or 0)
+    merged_out_path = base_dir / (Path(OUTPUT_NAME).stem + ".merged.csv")
+    rep_path = base_dir / (Path(REPORT_NAME).stem + ".merged.csv")
+    rep_cols = queue.report_columns()
+    merged_n = 0
+    rep_n = 0
+    with open(merged_out_path, "w", newline="", encoding="utf-8") as out, \
+         open(rep_path, "w", newline="", encoding="utf-8") as rep:
+        for unit_id, start, stop, b0, b1, rows, report, worker in queue.iter_results():
+            chunk = read_rows(input_path, header_bytes, b0, b1, start)
+            for col in MERGED_COLS:
+                if col not in chunk.columns:
+                    chunk[col] = ""
+            for sid, vals in rows.items():
+                i = int(sid)
+                for col in MERGED_COLS:
+                    chunk.at[i, col] = vals[col]
+            chunk = chunk.drop(columns=["global_row"], errors="ignore")
+            chunk.to_csv(out, index=False, header=(merged_n == 0))
+            merged_n += len(chunk)
+            if report:
+                rep_df = pd.DataFrame(report, columns=rep_cols)
+                rep_df.insert(0, "worker_id", worker)
+                rep_df.to_csv(rep, index=False, header=(rep_n == 0))
+                rep_n += len(rep_df)
+    print(f"[ok] Merged data   → {merged_out_path}")
+    if rep_n:
+        print(f"[ok] Merged report → {rep_path}")
+    else:
+        rep_path.unlink()
+    return merged_n
+
+
+def print_status(queue: WorkQueue):
+    counts = queue.counts()
+    print(f"[info] Queue {queue.path}: {counts['done']} done, {counts['leased']} leased, {counts['pending']} pending")
+    for unit_id, worker, left in queue.leases():
+        state = f"{left:.0f}s left" if left > 0 else "expired"
+        print(f"       unit {unit_id}: {worker} ({state})")
+    return counts
+
+
+def supervise(base_dir: Path, queue: WorkQueue, queue_path: Path, n_workers: int, total_rows: int):
+    """Run n_workers local workers until none has anything left to claim.
+
+    Event-driven: SIGCHLD (via signal.set_wakeup_fd) wakes the selector the
+    moment a worker exits, and progress pipes wake it on every report. The
+    timeout only drives the live view refresh and restart backoff timers.
+    """
+    host = socket.gethostname()
+    (base_dir / "logs").mkdir(exist_ok=True)
+    board = ProgressBoard(total_rows, queue.done_rows())
+    live = sys.stdout.isatty()
+    shown = 0          # lines of the live view currently on screen (tty only)
+    last_render = 0.0
+
+    def say(msg):
+        nonlocal shown
+        if shown:
+            sys.stdout.write(f"\x1b[{shown}F\x1b[J")  # erase the live view, print above it
+            shown = 0
+        print(msg, flush=True)
+
+    def worker_env(w: int):
         env = os.environ.copy()
         env.update(SCRIPT_ENV_OVERRIDES)
         env["EVA_SHARD_ID"] = str(w)
+        env["WORKER_ID"] = f"{host}-w{w}"
+        env["WORK_QUEUE"] = str(queue_path)
+        env["LEASE_SEC"] = str(LEASE_SEC)
+        env["BATCH_STATS_CSV"] = str(base_dir / "logs" / f"worker_{w}.batch_stats.csv")
         env["PYTHONUNBUFFERED"] = "1"
+        env.setdefault("CACHE_PATH", str((base_dir / CACHE_NAME).resolve()))
+        env.setdefault("RATE_STATE_PATH", str((base_dir / RATE_STATE_NAME).resolve()))
+        return env
+
+    sel = selectors.DefaultSelector()
+    wake_r, wake_w = socket.socketpair()
+    wake_r.setblocking(False)
+    wake_w.setblocking(False)
+    sel.register(wake_r, selectors.EVENT_READ, ("sigchld", None))
+    old_wakeup = signal.set_wakeup_fd(wake_w.fileno())
+    old_handler = signal.signal(signal.SIGCHLD, lambda *_: None)  # a handler is needed for the wakeup byte
 
-        p, logf, log_path = launch_worker(w, shard_dir, env)
-        active[w] = {
-            "env": env,
-            "dir": shard_dir,
-            "proc": p,
-            "logf": logf,
-            "log_path": log_path,
-            "attempt": 1,
-            "backoff": RESTART_BACKOFF_BASE_SEC,
-        }
-
-    # Wait loop: restart failed workers until they succeed
-    failed_any = False
-    while active:
-        # Pull a snapshot to iterate
+    active = {}
+
+    def start(w: int, env: dict, rec: dict | None = None):
+        p, logf, log_path, progress_r = launch_worker(w, base_dir, env)
+        say(f"[info] Started worker {w} (pid {p.pid}) → log {log_path}")
+        sel.register(progress_r, selectors.EVENT_READ, ("progress", w))
+        rec = rec or {"env": env, "attempt": 1, "backoff": RESTART_BACKOFF_BASE_SEC}
+        rec.update(proc=p, logf=logf, log_path=log_path, progress_r=progress_r, restart_at=None)
+        active[w] = rec
+
+    def close_progress(w, rec):
+        fd = rec.get("progress_r")
+        if fd is not None:
+            # drain what the worker wrote before exiting
+            try:
+                while data := os.read(fd, 65536):
+                    board.feed(w, fd, data)
+            except BlockingIOError:
+                pass
+            sel.unregister(fd)
+            board.close_fd(fd)
+            os.close(fd)
+            rec["progress_r"] = None
+
+    def reap():
+        """Collect every worker that has exited (one SIGCHLD may stand for several)."""
+        nonlocal failed_any
         for w in list(active.keys()):
             rec = active[w]
-            p = rec["proc"]
-            rc = p.poll()
+            if rec["restart_at"] is not None:
+                continue
+            rc = rec["proc"].poll()  # waitpid(pid, WNOHANG)
             if rc is None:
                 continue  # still running
 
-            # closed; flush/close log handle
+            close_progress(w, rec)
             rec["logf"].flush()
             rec["logf"].close()
             if rc == 0:
-                print(f"[info] Worker {w} finished OK")
+                say(f"[info] Worker {w} finished OK (nothing left to claim)")
                 del active[w]
             else:
                 failed_any = True
-                attempt = rec["attempt"]
+                released = queue.release_worker(rec["env"]["WORKER_ID"])
                 backoff = rec["backoff"]
-                print(f"[warn] Worker {w} exited with code {rc} (attempt {attempt}). "
-                      f"Restarting in {int(backoff)}s. See log: {rec['log_path']}")
-
-                try:
-                    time.sleep(backoff)
-                except KeyboardInterrupt:
-                    print("\n[info] Interrupted during backoff; exiting.")
-                    sys.exit(130)
-
+                say(f"[warn] Worker {w} exited with code {rc} (attempt {rec['attempt']}); "
+                    f"{released} unit(s) back to the queue. Restarting in {int(backoff)}s. "
+                    f"See log: {rec['log_path']}")
+                board.restarted(w)
                 # Exponential backoff with cap
                 rec["attempt"] += 1
                 rec["backoff"] = min(int(backoff * RESTART_BACKOFF_FACTOR), RESTART_BACKOFF_CAP_SEC)
-
-                # Reopen log in append mode and relaunch
-                env = rec["env"]
-                p, logf, log_path = launch_worker(w, rec["dir"], env)
-                rec["proc"] = p
-                rec["logf"] = logf
-                rec["log_path"] = log_path
-
-        # Avoid busy loop
-        time.sleep(1)
-
+                rec["restart_at"] = time.time() + backoff
+
+    def render(final=False):
+        nonlocal shown, last_render
+        last_render = time.time()
+        states = {w: ("restart" if r["restart_at"] else "running") for w, r in active.items()}
+        view = board.render(sorted(set(board.last) | set(board.carried) | set(active)), states)
+        if live:
+            if shown:
+                sys.stdout.write(f"\x1b[{shown}F\x1b[J")
+            sys.stdout.write(view + "\n")
+            sys.stdout.flush()
+            shown = 0 if final else view.count("\n") + 1
+        else:
+            print(view, flush=True)
+
+    # Leases left by this host's workers from an earlier (killed) supervisor run are dead
+    for w in range(n_workers):
+        released = queue.release_worker(f"{host}-w{w}")
+        if released:
+            say(f"[info] Released {released} unit(s) left leased by {host}-w{w}")
+
+    # Launch & supervise workers with auto-restart.
+    # Workers pull units until the queue is drained; a dead worker's unit goes back to pending.
+    failed_any = False
+    try:
+        for w in range(n_workers):
+            start(w, worker_env(w))
+        reap()  # a worker may have died before the handler was in place
+
+        while active:
+            now = time.time()
+            # restart workers whose backoff ran out; others keep draining meanwhile
+            for w in list(active.keys()):
+                rec = active[w]
+                if rec["restart_at"] is None or now < rec["restart_at"]:
+                    continue
+                if queue.counts()["pending"] == 0:
+                    say(f"[info] Worker {w} not restarted: nothing left to pull")
+                    del active[w]
+                    continue
+                start(w, rec["env"], rec)
+
+            # Everyone exited OK but a released unit is still pending → bring one worker back
+            if not active and queue.counts()["pending"]:
+                say("[warn] Units still pending after all workers exited; relaunching worker 0")
+                start(0, worker_env(0))
+
+            interval = PROGRESS_EVERY_SEC_TTY if live else PROGRESS_EVERY_SEC
+            timeout = max(0.0, last_render + interval - time.time())
+            due = [r["restart_at"] for r in active.values() if r["restart_at"]]
+            if due:
+                timeout = min(timeout, max(0.0, min(due) - time.time()))
+
+            for key, _ in sel.select(timeout):
+                kind, w = key.data
+                if kind == "sigchld":
+                    try:
+                        while wake_r.recv(512):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    reap()
+                elif kind == "progress":
+                    try:
+                        data = os.read(key.fd, 65536)
+                    except BlockingIOError:
+                        continue
+                    if data:
+                        board.feed(w, key.fd, data)
+                    else:
+                        # EOF: the worker closed its end (normally because it exited)
+                        close_progress(w, active[w])
+                        reap()
+            if time.time() - last_render >= interval:
+                render()
+    finally:
+        signal.signal(signal.SIGCHLD, old_handler)
+        signal.set_wakeup_fd(old_wakeup)
+        sel.close()
+        wake_r.close()
+        wake_w.close()
+
+    render(final=True)
     if failed_any:
-        print("[info] Some shards needed restarts but all finished successfully.")
+        print("[info] Some workers needed restarts but the queue was fully drained.")
 
-    print("[info] All workers finished, merging outputs...")
 
-    # Merge outputs
-    merged_out_parts = []
-    merged_rep_parts = []
+def main():
+    ap = argparse.ArgumentParser(description="Run modifier_1_0 workers over a shared work queue")
+    ap.add_argument("--queue", default=str(BASE_DIR / QUEUE_NAME), help="queue file (shared path for multi-host)")
+    ap.add_argument("--workers", type=int, default=NUM_WORKERS, help="local workers to run (0 = none)")
+    ap.add_argument("--init", action="store_true", help="only build/refresh the queue, then exit")
+    ap.add_argument("--no-merge", action="store_true", help="do not merge after local workers finish")
+    ap.add_argument("--merge", action="store_true", help="only merge (no workers)")
+    ap.add_argument("--wait", action="store_true", help="with --merge: wait until every unit is committed")
+    ap.add_argument("--status", action="store_true", help="print queue progress and live leases, then exit")
+    ap.add_argument("--shared-fs", action="store_true",
+                    help="queue/rate state on NFS/SMB (multi-host): rollback journal instead of WAL")
+    args = ap.parse_args()
+    if args.shared_fs:
+        os.environ["SQLITE_JOURNAL_MODE"] = "DELETE"  # inherited by the workers
 
-    for w, shard_dir in enumerate(workdirs):
-        shard_out = shard_dir / OUTPUT_NAME
-        shard_rep = shard_dir / REPORT_NAME
+    base_dir = BASE_DIR
+    base_dir.mkdir(exist_ok=True)
 
-        if not shard_out.exists():
-            print(f"[error] Missing output for worker {w}: {shard_out}")
-            sys.exit(3)
+    script_path = base_dir / SCRIPT_FILENAME
+    input_path  = base_dir / INPUT_NAME
+    queue_path  = Path(args.queue).resolve()
 
-        print(f"[info] Reading shard {w} output {shard_out}")
-        out_df = pd.read_csv(shard_out, dtype=str).fillna("")
-        merged_out_parts.append(out_df)
+    if args.status:
+        print_status(WorkQueue(queue_path, LEASE_SEC))
+        return
 
-        if shard_rep.exists():
-            print(f"[info] Reading shard {w} report {shard_rep}")
-            rep_df = pd.read_csv(shard_rep, dtype=str).fillna("")
-            rep_df.insert(0, "shard_id", str(w))
-            merged_rep_parts.append(rep_df)
+    if not script_path.exists():
+        print(f"[error] Could not find script: {script_path}")
+        sys.exit(1)
+    if not input_path.exists():
+        print(f"[error] Could not find input CSV: {input_path}")
+        sys.exit(1)
 
-    # Final merge
-    merged_out = pd.concat(merged_out_parts, ignore_index=True)
-    merged_out["global_row"] = merged_out["global_row"].astype(int)
-    merged_out = merged_out.sort_values("global_row").reset_index(drop=True)
-    merged_out = merged_out.drop(columns=["global_row"], errors="ignore")
+    print(f"[info] Using script: {script_path}")
+    print(f"[info] Using input : {input_path}")
 
-    merged_out_path = base_dir / (Path(OUTPUT_NAME).stem + ".merged.csv")
-    merged_out.to_csv(merged_out_path, index=False)
-    print(f"[ok] Merged data   → {merged_out_path}")
+    # Index the input once: unit boundaries as byte offsets, no full load
+    header_bytes, units, n_rows = scan_units(input_path, UNIT_ROWS)
+    print(f"[info] Indexed {n_rows} rows from input")
 
-    if merged_rep_parts:
-        merged_rep = pd.concat(merged_rep_parts, ignore_index=True)
-        merged_rep_path = base_dir / (Path(REPORT_NAME).stem + ".merged.csv")
-        merged_rep.to_csv(merged_rep_path, index=False)
-        print(f"[ok] Merged report → {merged_rep_path}")
+    queue = WorkQueue(queue_path, LEASE_SEC)
+    if args.merge:
+        if queue.meta("fingerprint") != file_fingerprint(input_path):
+            print(f"[error] Queue {queue_path} was built for a different input")
+            sys.exit(2)
+        n_units = sum(queue.counts().values())
+    else:
+        # Build (or resume) the shared queue of row ranges
+        n_units = queue.create(units, file_fingerprint(input_path), INPUT_NAME, header_bytes)
+        expired = queue.expire_leases()
+        counts = queue.counts()
+        print(f"[info] Queue {queue_path}: {n_units} units of ≤{UNIT_ROWS} rows "
+              f"({counts['done']} done, {counts['leased']} leased, {counts['pending']} pending"
+              + (f", {expired} expired leases released" if expired else "") + ")")
+        if args.init:
+            return
+        n_workers = min(args.workers, counts["pending"])
+        if n_workers > 0:
+            supervise(base_dir, queue, queue_path, n_workers, n_rows)
+        if args.no_merge:
+            return
+
+    # Merge once every unit is committed (other hosts may still be finishing theirs)
+    counts = queue.counts()
+    while args.wait and counts["done"] < n_units:
+        time.sleep(10)
+        counts = queue.counts()
+    if counts["done"] != n_units:
+        print_status(queue)
+        print("[error] Queue not complete yet; rerun with --merge --wait (or check --status)")
+        sys.exit(3)
+
+    print("[info] All units committed, merging outputs...")
+    merged_n = merge_outputs(base_dir, queue, input_path)
+    queue.close()
 
     # Row sanity check
-    orig_n = len(df)
-    merged_n = len(merged_out)
-    if merged_n != orig_n:
-        print(f"[warn] Row count changed: original {orig_n} → merged {merged_n}")
+    if merged_n != n_rows:
+        print(f"[warn] Row count changed: original {n_rows} → merged {merged_n}")
     else:
         print(f"[ok] Row count verified: {merged_n} rows")
 
-    print("\nShard folders kept for inspection:")
-    for shard_dir in workdirs:
-        print(f" - {shard_dir}")
-
 
 if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
-        print("\n[info] Interrupted by user. Check shard logs for progress.")
+        print("\n[info] Interrupted by user. Progress is kept in the queue; rerun to continue.")
         sys.exit(130)
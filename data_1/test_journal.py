@@ -0,0 +1,34 @@
+# test_journal.py — resume round trip: python -m pytest -q test_journal.py
+import io
+
+import pandas as pd
+
+from journal import BatchJournal, cell_text
+
+
+def test_cell_text():
+    assert [cell_text(v) for v in (None, float("nan"), pd.NA, "", "Сыр", 0)] == ["", "", "", "", "Сыр", "0"]
+
+
+def test_resume_round_trip(tmp_path):
+    src = tmp_path / "in.csv"
+    src.write_text("barcode,name,brand,productDesc\n1,a,,\n2,b,,\n", encoding="utf-8")
+    df = pd.read_csv(src, dtype=str)
+    df.at[0, "name"], df.at[0, "brand"], df.at[0, "productDesc"] = "Сыр Hochland 45%", "Hochland", None
+    df.at[1, "name"], df.at[1, "brand"], df.at[1, "productDesc"] = "Вода", None, float("nan")
+    expected = io.StringIO()
+    df.to_csv(expected, index=False)
+
+    j = BatchJournal(tmp_path / "j.jsonl", src)
+    j.replay(df, [])
+    j.commit(1, df, ["0", "1"], [])
+    j.close()
+
+    resumed = pd.read_csv(src, dtype=str)
+    done = BatchJournal(tmp_path / "j.jsonl", src).replay(resumed, [])
+    out = io.StringIO()
+    resumed.to_csv(out, index=False)
+    assert done == {"0", "1"}
+    assert "None" not in out.getvalue()
+    assert pd.read_csv(io.StringIO(out.getvalue()), dtype=str).fillna("").equals(
+        pd.read_csv(io.StringIO(expected.getvalue()), dtype=str).fillna(""))
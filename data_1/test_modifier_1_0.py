@@ -0,0 +1,73 @@
+# test_modifier_1_0.py — salvage + bisection: python -m pytest -q test_modifier_1_0.py
+import asyncio
+import json
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")  # the module builds its client at import
+
+import modifier_1_0 as m
+
+ROWS = [{"id": str(i), "barcode": f"46{i:011d}", "name": f"Товар {i}"} for i in range(4)]
+
+
+def content(rows):
+    return json.dumps({"rows": rows}, ensure_ascii=False)
+
+
+def test_salvage_rows_truncated():
+    text = content(ROWS)
+    cut = text[: text.index('"id": "3"') + 4]  # stopped at max tokens inside the last row
+    assert m.salvage_rows(cut) == ROWS[:3]
+
+
+def test_salvage_rows_malformed():
+    text = content(ROWS[:2])[:-2] + ', {"id": "2", "name": oops}, ' + json.dumps(ROWS[3]) + "]}"
+    assert m.salvage_rows(text) == ROWS[:2]            # stops at the first element that does not parse
+    assert m.salvage_rows('{"rows": [1, "x", {"id": "0"}]}') == [{"id": "0"}]
+    assert m.salvage_rows('{"items": []}') == []
+    assert m.salvage_rows(None) == []
+
+
+def test_isolate_plan_terminal_outcomes():
+    err = RuntimeError("timeout")
+    assert m._isolate_plan(ROWS, 1, ROWS, None) == ((ROWS, [], None, []), None)
+    assert m._isolate_plan(ROWS, 1, None, m.RequeueBatch()) == (([], [], None, ROWS), None)
+    assert m._isolate_plan(ROWS, 1, None, err) == (([], ROWS, err, []), None)
+    bad = m.BadResponse("extra text", rows=ROWS)
+    assert m._isolate_plan(ROWS, 1, None, bad) == ((ROWS, [], None, []), None)
+
+
+def test_isolate_plan_poisoned_row():
+    bad = m.BadResponse("truncated", rows=ROWS[:2])
+    assert m._isolate_plan(ROWS, 1, None, bad) == (None, (ROWS[:2], ROWS[2:]))
+    alone = m.BadResponse("malformed")
+    assert m._isolate_plan(ROWS[2:3], 1, None, alone) == (([], ROWS[2:3], alone, []), None)
+
+
+def test_isolate_plan_requeues_when_batcher_shrank(monkeypatch):
+    class Batcher:
+        size = 1
+    monkeypatch.setattr(m, "BATCHER", Batcher())
+    bad = m.BadResponse("truncated", rows=ROWS[:1])
+    assert m._isolate_plan(ROWS, 1, None, bad) == ((ROWS[:1], [], None, ROWS[1:]), None)
+
+
+def test_acall_isolating_bisects_one_request_at_a_time(monkeypatch):
+    poisoned, active, peak = "2", [0], [0]
+
+    async def fake_call(batch_payload, bi):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        await asyncio.sleep(0.01)
+        active[0] -= 1
+        ok = [it for it in batch_payload if it["id"] != poisoned]
+        if len(ok) == len(batch_payload):
+            return ok, None
+        return None, m.BadResponse("malformed", rows=ok[:1])
+
+    monkeypatch.setattr(m, "acall_with_retries", fake_call)
+    monkeypatch.setattr(m, "BATCHER", None)
+    good, failed, err, requeue = asyncio.run(m.acall_isolating(ROWS, 1))
+    assert sorted(r["id"] for r in good) == ["0", "1", "3"]
+    assert [it["id"] for it in failed] == [poisoned] and isinstance(err, m.BadResponse) and requeue == []
+    assert peak[0] == 1
@@ -0,0 +1,182 @@
+# translation_memory.py
+"""
+Translation memory for modifier_1_0, built from earlier change reports.
+
+Every accepted high-confidence report row (old_name → new_name, brand,
+productDesc, changes) becomes an entry keyed by the normalized, case-folded
+old name. Only rows answered by the model under the current namespace (the
+report's `namespace` column: model + prompt + schema, as for the response
+cache) count; rows from another namespace, without one, or answered by the
+memory itself (source tm-*) are skipped, so a prompt or model change is not
+bypassed and the memory never feeds on its own answers. Lookup:
+- exact: the same key → a model-shaped row, so modifier_1_0 runs it through
+  the same merge/validation as a fresh answer and skips the API;
+- fuzzy (off by default, TM_FUZZY=1): candidates sharing the most character
+  trigrams, within the edit distance, with the same numbers, and whose
+  differing words look like a typo — not a size/variant (S/M, XXL/XXXL,
+  AA/AAA, газ/негаз, п/сл), a short token, a word the memory knows on its
+  own, or a different first letter ("Тобот"/"Робот"). A near neighbour is
+  still a different product often enough that it is never answered
+  locally: it is returned as a hint and the row goes to the model with it.
+
+Usage:
+    tm = TranslationMemory.from_reports(["data_1_0_changes.csv"], namespace=NAMESPACE_ID)
+    row, kind = tm.lookup("Молоко Простоквашино 3,2% 1л")   # kind: "exact" | "fuzzy" (row = hint) | None
+"""
+
+import csv
+import json
+import os
+import re
+from collections import Counter
+
+from llm_cache import normalize_name
+
+_DIGITS_RE = re.compile(r"\d+")
+# sizes, pack/variant words and slash abbreviations: a different one is a different product
+_VARIANT_RE = re.compile(
+    r"^(?:x*[sml]|x+l|nb|a{1,4}|mini|maxi|мини|макси|light|лайт|zero|без\w*|"
+    r"не?газ\w*|сладк\w*|сух\w*|полу\w*|\w+/\w*)$"
+)
+
+
+def tm_key(name: str) -> str:
+    return normalize_name(name).casefold()
+
+
+def trigrams(s: str) -> set:
+    s = f"  {s} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance, or limit + 1 as soon as it is certain to exceed `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+        if min(cur) > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+
+class TranslationMemory:
+    def __init__(self, max_dist: int = 2, max_dist_ratio: float = 0.1, fuzzy: bool = False,
+                 namespace: str | None = None):
+        self.max_dist = max_dist
+        self.namespace = namespace  # None: accept rows of any namespace
+        self.max_dist_ratio = max_dist_ratio
+        self.fuzzy = fuzzy
+        self.entries = {}         # key -> {"old_name", "name", "brand", "productDesc", "changes"}
+        self.index = {}           # trigram -> set of keys
+        self.vocab = Counter()    # words of the remembered names
+        self.hits = Counter()     # "exact" / "fuzzy"
+        self.lookups = 0
+        self.stale = 0            # report rows skipped: other namespace or answered by the memory
+
+    @classmethod
+    def from_reports(cls, paths, **kwargs):
+        tm = cls(**kwargs)
+        for path in paths:
+            if path and os.path.exists(path):
+                tm.load_report(path)
+        return tm
+
+    def load_report(self, path) -> int:
+        """Add accepted rows of one report CSV; later reports override earlier ones."""
+        n = 0
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                if row.get("confidence") != "high" or row.get("error") or not (row.get("new_name") or "").strip():
+                    continue
+                if (self.namespace is not None and row.get("namespace") != self.namespace) \
+                        or (row.get("source") or "").startswith("tm-"):
+                    self.stale += 1
+                    continue
+                self.add(row["old_name"], row)
+                n += 1
+        return n
+
+    def add(self, old_name: str, row: dict):
+        key = tm_key(old_name)
+        if not key:
+            return
+        if key not in self.entries:
+            for g in trigrams(key):
+                self.index.setdefault(g, set()).add(key)
+            self.vocab.update(key.split())
+        try:
+            changes = json.loads(row.get("changes") or "{}")
+        except ValueError:
+            changes = {}
+        self.entries[key] = {
+            "old_name": old_name,
+            "name": row["new_name"],
+            "brand": row.get("brand") or None,
+            "productDesc": row.get("productDesc") or None,
+            "changes": changes,
+        }
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _fuzzy_key(self, key: str):
+        limit = min(self.max_dist, max(1, int(len(key) * self.max_dist_ratio)))
+        grams = trigrams(key)
+        shared = Counter()
+        for g in grams:
+            for k in self.index.get(g, ()):
+                shared[k] += 1
+        digits = _DIGITS_RE.findall(key)
+        best, best_d = None, limit + 1
+        for k, n in shared.most_common(8):
+            if n < len(grams) // 2:
+                break
+            if _DIGITS_RE.findall(k) != digits:
+                continue
+            d = edit_distance(key, k, limit)
+            if d < best_d and self._typo_only(key, k, limit):
+                best, best_d = k, d
+        return best
+
+    def _typo_only(self, key: str, cand: str, limit: int) -> bool:
+        """The words that differ are spelling variants of each other, not another size/variant/word."""
+        a, b = Counter(key.split()), Counter(cand.split())
+        mine, theirs = sorted((a - b).elements()), sorted((b - a).elements())
+        if len(mine) != len(theirs):
+            return False
+        for w in mine + theirs:
+            if len(w) <= 3 or _DIGITS_RE.search(w) or _VARIANT_RE.match(w):
+                return False
+        for w in mine:
+            if self.vocab[w]:
+                return False  # a real word elsewhere in the memory, not a typo
+            if not any(w[0] == t[0] and edit_distance(w, t, limit) <= limit for t in theirs):
+                return False
+        return True
+
+    def lookup(self, name: str):
+        """(model-shaped row without id/barcode, "exact"), (hint for the model, "fuzzy") or (None, None)."""
+        self.lookups += 1
+        key = tm_key(name)
+        kind = "exact" if key in self.entries else None
+        if kind is None and self.fuzzy and key:
+            key = self._fuzzy_key(key)
+            kind = "fuzzy" if key else None
+        if kind is None:
+            return None, None
+        self.hits[kind] += 1
+        e = self.entries[key]
+        if kind == "fuzzy":
+            return {"similar": e["old_name"], "edited": e["name"], "brand": e["brand"]}, kind
+        return {"name": e["name"], "brand": e["brand"], "productDesc": e["productDesc"],
+                "changed": True, "changes": e["changes"], "confidence": "high"}, kind
+
+    def summary(self) -> str:
+        rate = (self.hits["exact"] / self.lookups) if self.lookups else 0.0
+        return (f"translation memory: {len(self.entries)} entries, exact={self.hits['exact']} "
+                f"fuzzy hints={self.hits['fuzzy']} of {self.lookups} lookups ({rate:.1%} answered)")
@@ -0,0 +1,260 @@
+# work_queue.py
+"""
+SQLite-backed work queue shared by run_parallel and its modifier_1_0 workers.
+
+The input is cut into contiguous row ranges ("units"). Workers pull the
+lowest pending unit, process it, and commit the merged values + report rows
+for that unit in one transaction. A unit whose worker dies is put back to
+pending by the supervisor, so no shard ever waits on the slowest process.
+
+Leases expire: a claim holds a unit for `lease_sec` seconds and the worker
+heartbeats to extend it. A unit whose lease ran out (worker host died, network
+share went away) is claimable again by anyone, so workers on several machines
+can share one queue file on a common filesystem. Commits are idempotent: the
+first result committed for a unit wins and later duplicates are ignored.
+
+Journal mode: WAL by default (single host). WAL keeps its index in shared
+memory, which processes on different machines do not share, so a queue on
+NFS/SMB must use the rollback journal: SQLITE_JOURNAL_MODE=DELETE on every
+host (run_parallel --shared-fs sets it for itself and its workers). The same
+setting applies to the rate state and the response cache. Locking then relies
+on the share's POSIX locks (NFS needs a working lock manager).
+
+Units also carry the byte range of their rows in the input CSV (see
+csv_ranges), so workers and the merge read only the rows they need.
+
+Tables:
+    units(id, start, stop, byte_start, byte_stop, status pending|leased|done, worker, attempts,
+          leased_at, leased_until)
+    results(unit_id, rows_json, report_json, worker, committed_at)
+    meta(key, value)  -- fingerprint / input / header_bytes
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_LEASE_SEC = 300
+
+
+def sqlite_journal_mode() -> str:
+    """WAL on one host; DELETE for files on a network share (SQLITE_JOURNAL_MODE)."""
+    mode = os.getenv("SQLITE_JOURNAL_MODE", "WAL").upper()
+    return mode if mode in {"WAL", "DELETE", "TRUNCATE", "PERSIST"} else "WAL"
+
+
+class WorkQueue:
+    def __init__(self, path, lease_sec: float = DEFAULT_LEASE_SEC):
+        self.path = str(path)
+        self.lease_sec = lease_sec
+        self.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        self.conn.execute(f"PRAGMA journal_mode={sqlite_journal_mode()}")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS units ("
+            " id INTEGER PRIMARY KEY,"
+            " start INTEGER NOT NULL,"
+            " stop INTEGER NOT NULL,"
+            " byte_start INTEGER,"
+            " byte_stop INTEGER,"
+            " status TEXT NOT NULL DEFAULT 'pending',"
+            " worker TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " leased_at REAL,"
+            " leased_until REAL)"
+        )
+        cols = {r[1] for r in self.conn.execute("PRAGMA table_info(units)")}
+        if "leased_until" not in cols:  # queue file from before lease expiry
+            self.conn.execute("ALTER TABLE units ADD COLUMN leased_until REAL")
+            self.conn.execute("UPDATE units SET leased_until=0 WHERE status='leased'")
+        if "byte_start" not in cols:  # queue file from before byte ranges; create() rebuilds it
+            self.conn.execute("ALTER TABLE units ADD COLUMN byte_start INTEGER")
+            self.conn.execute("ALTER TABLE units ADD COLUMN byte_stop INTEGER")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " unit_id INTEGER PRIMARY KEY,"
+            " rows_json TEXT NOT NULL,"
+            " report_json TEXT NOT NULL,"
+            " worker TEXT,"
+            " committed_at REAL)"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    # ---- setup ----
+    def create(self, units, fingerprint: str, input_name: str = "", header_bytes: int = 0) -> int:
+        """(Re)build the queue from csv_ranges.scan_units() ranges. Keeps progress if the input is unchanged.
+
+        units: [(start_row, stop_row, byte_start, byte_stop), ...]
+        """
+        if self.meta("fingerprint") == fingerprint and self.meta("header_bytes") is not None:
+            return self.conn.execute("SELECT COUNT(*) FROM units").fetchone()[0]
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.execute("DELETE FROM units")
+        self.conn.execute("DELETE FROM results")
+        self.conn.executemany(
+            "INSERT INTO units(id, start, stop, byte_start, byte_stop) VALUES (?,?,?,?,?)",
+            [(k, *u) for k, u in enumerate(units)],
+        )
+        self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                              [("fingerprint", fingerprint), ("input", input_name),
+                               ("header_bytes", str(header_bytes))])
+        self.conn.execute("COMMIT")
+        return self.conn.execute("SELECT COUNT(*) FROM units").fetchone()[0]
+
+    def meta(self, key: str):
+        row = self.conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    # ---- worker side ----
+    def claim(self, worker: str):
+        """Lease the lowest pending (or lease-expired) unit → (unit_id, start, stop, byte_start, byte_stop)."""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT id, start, stop, byte_start, byte_stop FROM units"
+                " WHERE status='pending' OR (status='leased' AND leased_until < ?)"
+                " ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row:
+                self.conn.execute(
+                    "UPDATE units SET status='leased', worker=?, attempts=attempts+1,"
+                    " leased_at=?, leased_until=? WHERE id=?",
+                    (worker, now, now + self.lease_sec, row[0]),
+                )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def heartbeat(self, unit_id: int, worker: str) -> bool:
+        """Extend this worker's lease; False if the unit is no longer leased to it."""
+        cur = self.conn.execute(
+            "UPDATE units SET leased_until=? WHERE id=? AND status='leased' AND worker=?",
+            (time.time() + self.lease_sec, unit_id, worker),
+        )
+        return cur.rowcount == 1
+
+    def complete(self, unit_id: int, worker: str, rows: dict, report: list) -> bool:
+        """Store a unit's merged values ({row id: {col: value}}) and report rows, mark it done.
+
+        Idempotent: returns False (and changes nothing) if the unit was already committed,
+        e.g. by another worker that picked it up after this one's lease expired.
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = self.conn.execute(
+                "INSERT OR IGNORE INTO results VALUES (?,?,?,?,?)",
+                (unit_id, json.dumps(rows, ensure_ascii=False), json.dumps(report, ensure_ascii=False),
+                 worker, time.time()),
+            )
+            fresh = cur.rowcount == 1
+            if fresh:
+                self.conn.execute(
+                    "UPDATE units SET status='done', worker=?, leased_until=NULL WHERE id=?", (worker, unit_id))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return fresh
+
+    # ---- supervisor side ----
+    def release_worker(self, worker: str) -> int:
+        """Put the units a dead worker held back to pending."""
+        cur = self.conn.execute(
+            "UPDATE units SET status='pending', worker=NULL, leased_at=NULL, leased_until=NULL"
+            " WHERE status='leased' AND worker=?",
+            (worker,),
+        )
+        return cur.rowcount
+
+    def expire_leases(self) -> int:
+        """Put units whose lease ran out back to pending (claim() also takes them directly)."""
+        cur = self.conn.execute(
+            "UPDATE units SET status='pending', worker=NULL, leased_at=NULL, leased_until=NULL"
+            " WHERE status='leased' AND leased_until < ?",
+            (time.time(),),
+        )
+        return cur.rowcount
+
+    def leases(self):
+        """(unit_id, worker, seconds left) of live leases."""
+        now = time.time()
+        return [(u, w, until - now) for u, w, until in self.conn.execute(
+            "SELECT id, worker, leased_until FROM units WHERE status='leased' ORDER BY id")]
+
+    def counts(self) -> dict:
+        out = {"pending": 0, "leased": 0, "done": 0}
+        for status, n in self.conn.execute("SELECT status, COUNT(*) FROM units GROUP BY status"):
+            out[status] = n
+        return out
+
+    def done_rows(self) -> int:
+        return self.conn.execute("SELECT COALESCE(SUM(stop - start), 0) FROM units WHERE status='done'").fetchone()[0]
+
+    def report_columns(self) -> list:
+        """Union of report keys in first-seen order (what pd.concat of all reports would give)."""
+        cols = {}
+        for (report_json,) in self.conn.execute("SELECT report_json FROM results ORDER BY unit_id"):
+            for rec in json.loads(report_json):
+                cols.update(dict.fromkeys(rec))
+        return list(cols)
+
+    def iter_results(self):
+        """(unit_id, start, stop, byte_start, byte_stop, rows, report, worker) in unit (= row) order.
+
+        One unit at a time comes off the cursor, so the merge stays flat in memory.
+        """
+        for unit_id, start, stop, b0, b1, rows_json, report_json, worker in self.conn.execute(
+            "SELECT u.id, u.start, u.stop, u.byte_start, u.byte_stop, r.rows_json, r.report_json, r.worker"
+            " FROM units u JOIN results r ON r.unit_id = u.id ORDER BY u.id"
+        ):
+            yield unit_id, start, stop, b0, b1, json.loads(rows_json), json.loads(report_json), worker
+
+    def close(self):
+        self.conn.close()
+
+
+class LeaseKeeper:
+    """Background heartbeat for the unit a worker is processing.
+
+    Uses its own connection (sqlite3 connections stay in their thread) and
+    extends the lease every lease_sec/3 seconds until stopped.
+    """
+
+    def __init__(self, path, lease_sec: float = DEFAULT_LEASE_SEC):
+        self.path = str(path)
+        self.lease_sec = lease_sec
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, unit_id: int, worker: str):
+        self.lost = False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(unit_id, worker), daemon=True)
+        self._thread.start()
+
+    def _run(self, unit_id, worker):
+        queue = WorkQueue(self.path, self.lease_sec)
+        try:
+            while not self._stop.wait(self.lease_sec / 3):
+                try:
+                    if not queue.heartbeat(unit_id, worker):
+                        self.lost = True
+                        print(f"[warn] lease on unit {unit_id} lost (expired and re-claimed elsewhere)")
+                        return
+                except sqlite3.OperationalError as e:
+                    print(f"[warn] heartbeat for unit {unit_id} failed: {e}")
+        finally:
+            queue.close()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None